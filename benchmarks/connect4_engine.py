@@ -0,0 +1,44 @@
+"""
+Micro-benchmark of the envs' step, comparing Connect4Env's line counts with its bitboard engine,
+and timing NacEnv too.
+
+    python -m benchmarks.connect4_engine [steps]
+"""
+import sys
+import time
+from typing import Any
+import numpy as np
+
+from games.connect4.env import Connect4Env
+from games.nac.env import NacEnv
+
+
+def steps_per_second(env: Any, steps: int, seed: int = 0) -> float:
+    """
+    Steps the env with random legal actions (against its default random opponent),
+    resetting whenever a game ends, and returns the number of steps per second.
+    In both games, an action is legal if the first square for it (the top of the column, for Connect 4) is empty.
+
+    >>> steps_per_second(Connect4Env(bitboard=True), 10) > 0
+    True
+    >>> steps_per_second(NacEnv(), 10) > 0
+    True
+    """
+    random_state = np.random.RandomState(seed)
+    nb_actions = env.action_space.n
+    env.reset()
+    start = time.perf_counter()
+    for _ in range(steps):
+        _, _, done, _ = env.step(random_state.choice(np.flatnonzero(env.board[:nb_actions] == 0)))
+        if done:
+            env.reset()
+    return steps / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    STEPS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    LINES_RATE = steps_per_second(Connect4Env(), STEPS)
+    BITBOARD_RATE = steps_per_second(Connect4Env(bitboard=True), STEPS)
+    print(f'connect 4, line counts: {LINES_RATE:10.0f} steps/sec')
+    print(f'connect 4, bitboard:    {BITBOARD_RATE:10.0f} steps/sec ({BITBOARD_RATE / LINES_RATE:.1f}x)')
+    print(f'noughts and crosses:    {steps_per_second(NacEnv(), STEPS):10.0f} steps/sec')
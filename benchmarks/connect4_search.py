@@ -0,0 +1,42 @@
+"""
+Speed of the alpha-beta Connect 4 opponent at a few search depths, playing against random legal moves.
+
+    python -m benchmarks.connect4_search [games]
+"""
+import sys
+import time
+from typing import Tuple
+import numpy as np
+
+from games.connect4.env import Connect4Env, WIDTH
+from games.connect4.search import AlphaBetaOpponent
+
+
+def search_speed(depth: int, games: int, seed: int = 0) -> Tuple[float, float]:
+    """
+    Plays games with the search as the env's opponent, and returns its positions searched per second,
+    and moves per second.
+
+    >>> positions_per_second, moves_per_second = search_speed(2, 1)
+    >>> positions_per_second > moves_per_second > 0
+    True
+    """
+    random_state = np.random.RandomState(seed)
+    opponent = AlphaBetaOpponent(depth=depth)
+    env = Connect4Env(get_opponent_action=opponent)
+    moves = 0
+    start = time.perf_counter()
+    for _ in range(games):
+        board, done = env.reset(), False
+        while not done:
+            board, _, done, _ = env.step(random_state.choice(np.flatnonzero(board[:WIDTH] == 0)))
+            moves += 1
+    elapsed = time.perf_counter() - start
+    return opponent.nodes / elapsed, moves / elapsed
+
+
+if __name__ == '__main__':
+    GAMES = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for DEPTH in (2, 4, 6, 8):
+        POSITIONS_RATE, MOVES_RATE = search_speed(DEPTH, GAMES)
+        print(f'depth {DEPTH}: {POSITIONS_RATE:8.0f} positions/sec, {MOVES_RATE:6.1f} moves/sec')
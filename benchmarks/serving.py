@@ -0,0 +1,60 @@
+"""
+Move latency of the move server (see games/server.py) under load: many clients at once play random legal moves
+against the saved noughts and crosses agents, each over its own connection.
+
+    python -m benchmarks.serving [clients] [games per client] [batch window in ms]
+"""
+import asyncio
+import json
+import sys
+import uuid
+from typing import Any, Dict
+import numpy as np
+
+from games.server import GAMES, MoveServer
+
+
+async def _play_games(games: int, seed: int, port: int) -> None:
+    random_state = np.random.RandomState(seed)
+    reader, writer = await asyncio.open_connection('localhost', port)
+
+    async def request(**request: Any) -> Dict[str, Any]:
+        writer.write(json.dumps(request).encode() + b'\n')
+        await writer.drain()
+        reply: Dict[str, Any] = json.loads(await reader.readline())
+        return reply
+
+    for game in range(games):
+        session = uuid.uuid4().hex
+        reply = await request(op='new', session=session, agent_first=game % 2 == 0)
+        while not reply['done']:
+            action = int(random_state.choice(np.flatnonzero(np.array(reply['board']) == 0)))
+            reply = await request(op='move', session=session, action=action)
+    writer.close()
+
+
+async def measure(clients: int, games: int, window: float, port: int = 0) -> Dict[str, Any]:
+    """
+    Serves on the port (by default, any free one) while the clients play.
+
+    >>> stats = asyncio.run(measure(clients=4, games=2, window=0.002))
+    >>> stats['sessions'], stats['moves'] > 0, stats['batches'] <= stats['moves']
+    (0, True, True)
+    """
+    game = GAMES['nac']
+    assert game.weights is not None
+    server = MoveServer(game, game.load_agents(game.weights), window)
+    tcp_server = await asyncio.start_server(server.handle, 'localhost', port)
+    port = tcp_server.sockets[0].getsockname()[1]
+    async with tcp_server:
+        await asyncio.gather(*[_play_games(games, seed, port) for seed in range(clients)])
+    return await server.respond({'op': 'stats'})
+
+
+if __name__ == '__main__':
+    CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    GAMES_EACH = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    WINDOW = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.002
+    STATS = asyncio.run(measure(CLIENTS, GAMES_EACH, WINDOW))
+    print(f"{STATS['moves']} moves in {STATS['batches']} batches ({STATS['moves'] / STATS['batches']:.1f} a batch): "
+          f"p50 {STATS['p50_ms']:.2f}ms, p99 {STATS['p99_ms']:.2f}ms")
@@ -0,0 +1,230 @@
+"""
+The benchmark suite: throughput of the envs, the processors, Q-network inference, replay sampling
+and training, all on the CPU.
+Results are printed, can be written as JSON, and are compared with a baseline file of earlier results,
+failing (with exit status 1) if any benchmark has slowed down by more than the tolerance.
+
+    python -m benchmarks.suite [--quick] [--only NAME ...] [--repeats 3] [--output results.json]
+                               [--baseline benchmarks/baseline.json] [--tolerance 0.3] [--update-baseline]
+
+Every result is a rate, so higher is better. Rates depend on the machine,
+so update the baseline (with --update-baseline) when moving to another one.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+import numpy as np
+
+from benchmarks.connect4_engine import steps_per_second
+from games.connect4.env import Connect4Env, NUM_POSITIONS
+from games.encoding import OneHotProcessor
+from games.memory import BoardMemory
+from games.nac.env import NacEnv
+from games.numpy_dqn import get_numpy_dqn_agent
+from games.numpy_network import NumpyQNetwork
+from games.prioritized import PrioritizedBoardMemory
+
+LAYER_SIZE = 69 * 2  # As in games.connect4.agent, which loads TensorFlow.
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+BATCH_SIZE = 256
+
+
+class Benchmark(NamedTuple):
+    unit: str
+    run: Callable[[float], float]  # Given a scale (1 for a full run), returns the rate.
+
+
+def _rate(function: Callable[[], Any], calls: int) -> float:
+    """
+    Calls the function calls times, and returns calls per second.
+    It is called a few times first, untimed, so that one-off costs (eg. building a TensorFlow graph) are left out.
+
+    >>> _rate(lambda: None, 10) > 0
+    True
+    """
+    for _ in range(max(calls // 10, 1)):
+        function()
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return calls / (time.perf_counter() - start)
+
+
+def _boards(count: int, board_size: int = NUM_POSITIONS, seed: int = 0) -> np.ndarray:
+    return np.random.RandomState(seed).randint(3, size=(count, board_size)).astype(np.int8)
+
+
+def _connect4_agent() -> Any:
+    from games.connect4.agent import get_dqn_agent  # pylint: disable=import-outside-toplevel
+    return get_dqn_agent(Connect4Env())
+
+
+def processor_single(scale: float) -> float:
+    from games.connect4.processor import Connect4Processor  # pylint: disable=import-outside-toplevel
+    processor = Connect4Processor()
+    board = _boards(1)[0]
+    return _rate(lambda: processor.process_observation(board), int(20000 * scale))
+
+
+def processor_batch(scale: float) -> float:
+    """
+    Boards per second encoded a replay batch at a time, as the agents' processors do.
+    """
+    processor = OneHotProcessor(deferred=True)
+    boards = _boards(BATCH_SIZE)[:, np.newaxis]
+    return BATCH_SIZE * _rate(lambda: processor.process_state_batch(boards), int(2000 * scale))
+
+
+def inference_single(scale: float) -> float:
+    agent = _connect4_agent()
+    state = [agent.processor.process_observation(_boards(1)[0])]
+    return _rate(lambda: agent.compute_q_values(state), int(500 * scale))
+
+
+def inference_batch(scale: float) -> float:
+    agent = _connect4_agent()
+    states = [[agent.processor.process_observation(board)] for board in _boards(BATCH_SIZE)]
+    return BATCH_SIZE * _rate(lambda: agent.compute_batch_q_values(states), int(200 * scale))
+
+
+def numpy_inference_batch(scale: float) -> float:
+    random_state = np.random.RandomState(0)
+    network = NumpyQNetwork([(random_state.randn(3 * NUM_POSITIONS, LAYER_SIZE), np.zeros(LAYER_SIZE)),
+                             (random_state.randn(LAYER_SIZE, 7), np.zeros(7))])
+    states = [[network.processor.process_observation(board)] for board in _boards(BATCH_SIZE)]
+    return BATCH_SIZE * _rate(lambda: network.compute_batch_q_values(states), int(2000 * scale))
+
+
+def replay_sampling(scale: float) -> float:
+    memory = BoardMemory(limit=50000, board_size=NUM_POSITIONS)
+    for step, board in enumerate(_boards(50000)):
+        memory.append_board(board, step % 7, 0., step % 20 == 19)
+    return _rate(lambda: memory.sample_batch(32), int(2000 * scale))
+
+
+def prioritized_replay_sampling(scale: float) -> float:
+    """
+    Batches per second sampled from a full prioritized memory of a million transitions, and their priorities updated,
+    as PrioritizedDQNAgent does each training step.
+    """
+    limit = 1000000
+    random_state = np.random.RandomState(0)
+    memory = PrioritizedBoardMemory(limit=limit, board_size=NUM_POSITIONS)
+    # Filled directly, since appending a million transitions one at a time would take longer than the benchmark.
+    memory.boards[:] = random_state.randint(256, size=memory.boards.shape)
+    memory.terminals[:] = np.arange(limit) % 20 == 19
+    memory.size = limit
+    entries = np.arange(1, limit - 1)
+    can_sample = ~memory.terminals[memory._positions(entries - 1)]  # pylint: disable=protected-access
+    memory.tree.update(entries, random_state.random_sample(len(entries)) * can_sample)
+
+    def sample() -> None:
+        memory.sample_batch(32)
+        memory.update_priorities(random_state.standard_normal(32))
+    return _rate(sample, int(2000 * scale))
+
+
+def training(scale: float, backend: str = 'keras') -> float:
+    """
+    Training steps per second, once the agent's warm-up steps (which don't train) are over.
+    """
+    agent = _connect4_agent() if backend == 'keras' else get_numpy_dqn_agent(Connect4Env())
+    agent.fit(Connect4Env(), nb_steps=agent.nb_steps_warmup + agent.batch_size, visualize=False, verbose=0)
+    agent.nb_steps_warmup = 0  # Since fit starts counting steps from 0 again.
+    steps = int(1000 * scale)
+    start = time.perf_counter()
+    agent.fit(Connect4Env(), nb_steps=steps, visualize=False, verbose=0)
+    return steps / (time.perf_counter() - start)
+
+
+BENCHMARKS: Dict[str, Benchmark] = {
+    'env.connect4.step': Benchmark('steps/s', lambda scale: steps_per_second(Connect4Env(), int(20000 * scale))),
+    'env.nac.step': Benchmark('steps/s', lambda scale: steps_per_second(NacEnv(), int(20000 * scale))),
+    'processor.single': Benchmark('boards/s', processor_single),
+    'processor.batch': Benchmark('boards/s', processor_batch),
+    'inference.single': Benchmark('calls/s', inference_single),
+    'inference.batch': Benchmark('boards/s', inference_batch),
+    'inference.numpy.batch': Benchmark('boards/s', numpy_inference_batch),
+    'replay.sample': Benchmark('batches/s', replay_sampling),
+    'replay.prioritized.sample': Benchmark('batches/s', prioritized_replay_sampling),
+    'train.connect4': Benchmark('steps/s', training),
+    'train.connect4.numpy': Benchmark('steps/s', lambda scale: training(scale, backend='numpy')),
+}
+
+
+def run(names: List[str], scale: float = 1., repeats: int = 3) -> Dict[str, dict]:
+    """
+    Runs each benchmark repeats times, and keeps its best rate (the one least slowed by anything else running).
+    """
+    results = {}
+    for name in names:
+        benchmark = BENCHMARKS[name]
+        results[name] = {'value': round(max(benchmark.run(scale) for _ in range(repeats)), 1), 'unit': benchmark.unit}
+        print(f'{name:<22} {results[name]["value"]:12.1f} {benchmark.unit}', flush=True)
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+    The benchmarks that ran more than tolerance (a fraction) slower than the baseline,
+    described as lines to print.
+
+    >>> compare({'a': {'value': 60., 'unit': 'steps/s'}, 'b': {'value': 95., 'unit': 'steps/s'}},
+    ...         {'a': {'value': 100., 'unit': 'steps/s'}, 'b': {'value': 100., 'unit': 'steps/s'}}, tolerance=0.3)
+    ['a: 60.0 steps/s is 40% slower than the baseline 100.0']
+    """
+    regressions = []
+    for name, result in results.items():
+        if name in baseline:
+            ratio = result['value'] / baseline[name]['value']
+            if ratio < 1 - tolerance:
+                regressions.append(f'{name}: {result["value"]:.1f} {result["unit"]} is {1 - ratio:.0%} slower '
+                                   f'than the baseline {baseline[name]["value"]:.1f}')
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Run the benchmarks, and compare them with a baseline.')
+    parser.add_argument('--quick', action='store_true', help='run each benchmark for a tenth as long')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), default=list(BENCHMARKS),
+                        metavar='NAME', help=f'run only these benchmarks (of {", ".join(BENCHMARKS)})')
+    parser.add_argument('--repeats', type=int, default=3, help='run each benchmark this many times, keeping the best')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='the results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='the fraction slower than the baseline that counts as a regression')
+    parser.add_argument('--update-baseline', action='store_true', help='write the results to the baseline file')
+    args = parser.parse_args(argv)
+
+    results = run(args.only, 0.1 if args.quick else 1., args.repeats)
+    report = {'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                          'processor': platform.processor()},
+              'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.update_baseline:
+        baseline_results: Dict[str, dict] = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding='utf-8') as baseline_file:
+                baseline_results = json.load(baseline_file)['results']
+        with open(args.baseline, 'w', encoding='utf-8') as baseline_file:
+            json.dump({**report, 'results': {**baseline_results, **results}}, baseline_file, indent=2)
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline} to compare with')
+        return 0
+    with open(args.baseline, encoding='utf-8') as baseline_file:
+        regressions = compare(results, json.load(baseline_file)['results'], args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Sample efficiency of training with symmetry-augmented replay memory:
+trains noughts and crosses agents for the same number of steps with and without it,
+and compares how they then do against a random player.
+
+    python -m benchmarks.symmetry [steps] [seeds]
+"""
+import random
+import sys
+import time
+from typing import Any, Type
+import numpy as np
+import tensorflow as tf
+
+from games.nac.agent import get_dqn_agent
+from games.nac.env import NacEnv
+from games.nac.vector_env import VectorNacEnv
+from games.numpy_network import NumpyQNetwork
+from games.policy import QPolicy, select_legal_actions
+
+
+def mean_reward(agent: Any, vector_env_class: Type[Any] = VectorNacEnv, games: int = 2000, seed: int = 0) -> float:
+    """
+    The agent's mean reward per game, playing greedily against random legal moves
+    (and only legal moves itself, if agent.mask_illegal is set).
+
+    >>> network = NumpyQNetwork([(np.zeros((27, 9)), np.arange(9.))])
+    >>> -10 <= mean_reward(network, games=20) <= 1
+    True
+    """
+    weights = agent.get_weights() if isinstance(agent, NumpyQNetwork) else agent.model.get_weights()
+    network = NumpyQNetwork(list(zip(weights[::2], weights[1::2])))
+    mask_illegal = getattr(agent, 'mask_illegal', False)
+    env = vector_env_class(num_envs=min(games, 500), seed=seed)
+    boards = env.reset()
+    total, finished = 0., 0
+    while finished < games:
+        q_values = network.compute_batch_q_values([[network.processor.process_observation(board)] for board in boards])
+        legal = env.legal_action_mask(boards) if mask_illegal else np.ones(q_values.shape, dtype=bool)
+        boards, rewards, dones, _ = env.step(select_legal_actions(QPolicy(), q_values, legal))
+        total += float(rewards.sum())
+        finished += int(dones.sum())
+    return total / finished
+
+
+def train(augment: bool, steps: int, seed: int) -> Any:
+    random.seed(seed)
+    np.random.seed(seed)
+    tf.random.set_seed(seed)
+    env = NacEnv()
+    env.seed(seed)
+    agent = get_dqn_agent(env, augment=augment)
+    agent.fit(env, nb_steps=steps, visualize=False, verbose=0)
+    return agent
+
+
+if __name__ == '__main__':
+    STEPS = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    SEEDS = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+    for AUGMENT in (False, True):
+        START = time.perf_counter()
+        REWARDS = [mean_reward(train(AUGMENT, STEPS, seed)) for seed in range(SEEDS)]
+        print(f'{"with" if AUGMENT else "without"} symmetries: mean reward {np.mean(REWARDS):6.3f} '
+              f'(seeds {", ".join(f"{reward:.3f}" for reward in REWARDS)}) in {time.perf_counter() - START:.0f}s')
@@ -0,0 +1,74 @@
+"""
+Learning per second of training, for a few training schedules: noughts and crosses agents (trained by the numpy
+backend, against random moves) are given the same wall-clock time under each, and then scored against perfect play.
+
+    python -m benchmarks.training_schedule [seconds] [seeds]
+
+Training less often, on bigger batches (or several batches at a time), makes more of each second, as the cost of
+each training call is mostly overhead for networks this small; n-step returns pass rewards back faster.
+"""
+import sys
+import time
+from typing import Any, Dict, List, NamedTuple
+import numpy as np
+
+from games.nac.env import NacEnv
+from games.nac.solver import evaluate
+from games.numpy_dqn import get_numpy_dqn_agent
+
+CHUNK_STEPS = 1000  # Steps trained between checks of the time.
+SCHEDULES: Dict[str, Dict[str, Any]] = {
+    'every step, batch 32': {},
+    'every 4 steps, batch 128': {'train_interval': 4, 'batch_size': 128},
+    'every 8 steps, batch 256': {'train_interval': 8, 'batch_size': 256},
+    'every 4 steps, 4 x batch 32': {'train_interval': 4, 'gradient_steps': 4},
+    'every 4 steps, batch 128, 3-step': {'train_interval': 4, 'batch_size': 128, 'n_step': 3},
+}
+
+
+class ScheduleResult(NamedTuple):
+    steps: int  # Env steps in the time.
+    samples_per_second: float  # Transitions trained on a second.
+    optimal: float  # The fraction of positions in which the agent plays a best move.
+
+
+def train_for(seconds: float, seed: int = 0, **kwargs: Any) -> ScheduleResult:
+    """
+    Trains an agent with the given get_numpy_dqn_agent settings for about seconds, and scores it.
+
+    >>> result = train_for(0.1, train_interval=4, batch_size=64)
+    >>> result.steps >= CHUNK_STEPS, 0 <= result.optimal <= 1
+    (True, True)
+    """
+    np.random.seed(seed)
+    agent = get_numpy_dqn_agent(NacEnv(), **kwargs)
+    env = NacEnv()
+    env.seed(seed)
+    warmup = agent.nb_steps_warmup
+    steps = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        agent.fit(env, nb_steps=CHUNK_STEPS, verbose=0)
+        agent.nb_steps_warmup = 0  # Since fit starts counting steps from 0 again.
+        steps += CHUNK_STEPS
+    elapsed = time.perf_counter() - start
+    trained = (steps - warmup) // agent.train_interval * agent.gradient_steps * agent.batch_size
+    evaluation = evaluate(agent, player=0)
+    return ScheduleResult(steps, trained / elapsed, evaluation.optimal / evaluation.positions)
+
+
+def compare(seconds: float, seeds: int) -> List[str]:
+    lines = []
+    for name, kwargs in SCHEDULES.items():
+        results = [train_for(seconds, seed, **kwargs) for seed in range(seeds)]
+        lines.append(f'{name:34} {np.mean([r.steps for r in results]):8.0f} steps '
+                     f'{np.mean([r.samples_per_second for r in results]):8.0f} samples/sec '
+                     f'{np.mean([r.optimal for r in results]):6.1%} best moves')
+    return lines
+
+
+if __name__ == '__main__':
+    SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 10.
+    SEEDS = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    for LINE in compare(SECONDS, SEEDS):
+        print(LINE, flush=True)
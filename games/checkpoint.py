@@ -0,0 +1,331 @@
+"""
+Checkpoints of the whole state of a training run, so that it can be resumed as if it had never stopped:
+each agent's network and target network weights, optimizer state, replay memory, policy settings
+and step counter, the random states, and whatever else the run keeps (eg. the round it is on).
+
+A checkpoint is a directory of NumPy files and a JSON file:
+
+    state.json                        the run's state, steps and policy settings, and the list of agents
+    random.npz                        numpy's global random state, and the env's (for its random opponent)
+    <agent>/weights.npz               the model's weights, the target model's and the optimizer's
+    <agent>/memory/<array>.npy        the replay memory's arrays, as BoardMemory keeps them (boards packed two bits
+                                      a square), and its priorities if it has them, which can be memory-mapped
+                                      to look at without loading them
+
+Saving takes a copy of everything first, which is quick, and then writes it in a background thread,
+so training carries on meanwhile. Each checkpoint is written to a temporary directory that is renamed into place
+once it is complete, and then the LATEST file (naming the latest checkpoint) is replaced, with os.replace,
+so an interrupted save never leaves a partial checkpoint to resume from.
+
+Resuming restores all of that exactly, but a resumed run can still differ from one that never stopped:
+- Keras trains in graph mode, where the Adam and soft target updates run in no fixed order,
+  so its training is not bit-for-bit reproducible anyway (NumpyDQNAgent's is).
+- An opponent's cache of Q-values (see opponent.py) starts empty, and the cached Q-values it no longer has
+  may differ from recomputed ones in the last bits, since they were computed in batches of other sizes.
+- Rollout workers (see rollout.py) are only checkpointed between rounds, not within them.
+- What is only logged (keras-rl's progress and episode counts, profiling) starts again from the resumed step.
+"""
+import json
+import os
+import shutil
+import threading
+from typing import Any, Dict, List, Optional
+import numpy as np
+from tensorflow.keras import backend
+from rl.callbacks import Callback
+
+LATEST = 'LATEST'
+STATE_FILE = 'state.json'
+RANDOM_FILE = 'random.npz'
+WEIGHTS_FILE = 'weights.npz'
+MEMORY_DIRECTORY = 'memory'
+MEMORY_ARRAYS = ('boards', 'actions', 'rewards', 'terminals', 'priorities')  # Those the memory has.
+MEMORY_SETTINGS = ('next_index', 'size', 'max_priority', 'batches')
+POLICY_SETTINGS = ('eps', 'tau', 'clip')
+
+
+def _random_state_arrays(random_state: Any, prefix: str) -> Dict[str, np.ndarray]:
+    """
+    A RandomState's state, as arrays to save with np.savez.
+    """
+    _, keys, position, has_gauss, cached_gaussian = random_state.get_state()
+    return {f'{prefix}keys': keys, f'{prefix}numbers': np.array([position, has_gauss]),
+            f'{prefix}gaussian': np.array(cached_gaussian)}
+
+
+def _set_random_state(random_state: Any, arrays: Any, prefix: str) -> None:
+    """
+    >>> saved = _random_state_arrays(np.random.RandomState(0), 'r')
+    >>> random_state = np.random.RandomState(1)
+    >>> _set_random_state(random_state, saved, 'r')
+    >>> random_state.randint(100) == np.random.RandomState(0).randint(100)
+    True
+    """
+    position, has_gauss = arrays[f'{prefix}numbers']
+    random_state.set_state(('MT19937', arrays[f'{prefix}keys'], int(position), int(has_gauss),
+                            float(arrays[f'{prefix}gaussian'])))
+
+
+def _env_random_state(env: Any) -> Optional[Any]:
+    """
+    The RandomState an env's random opponent plays with (its action space's), if it has one.
+    """
+    return getattr(getattr(env, 'action_space', None), 'np_random', None)
+
+
+def _optimizer(agent: Any) -> Any:
+    optimizer = agent.trainable_model.optimizer
+    # keras-rl wraps it in an AdditionalUpdatesOptimizer, for soft updates of the target model.
+    return getattr(optimizer, 'optimizer', optimizer)
+
+
+def _optimizer_variables(optimizer: Any) -> List[Any]:
+    # Keras' optimizers have variables since TensorFlow 2.11, and its legacy ones (which keras-rl uses) weights.
+    return list(optimizer.weights if hasattr(optimizer, 'weights') else optimizer.variables)
+
+
+def _optimizer_weights(optimizer: Any) -> List[np.ndarray]:
+    if hasattr(optimizer, 'get_weights'):
+        weights: List[np.ndarray] = optimizer.get_weights()
+        return weights
+    return list(backend.batch_get_value(_optimizer_variables(optimizer)))
+
+
+def _set_optimizer_weights(optimizer: Any, weights: List[np.ndarray]) -> None:
+    if hasattr(optimizer, 'get_weights'):
+        optimizer.set_weights(weights)
+    else:  # Which also works in graph mode, unlike these optimizers' set_weights.
+        backend.batch_set_value(list(zip(_optimizer_variables(optimizer), weights)))
+
+
+def _build_optimizer(optimizer: Any, variables: List[Any]) -> None:
+    """
+    Makes the optimizer's slots for the variables, which Keras otherwise only makes when it first trains,
+    so that they can be filled in: with build, for Keras' optimizers since TensorFlow 2.11,
+    or _create_all_weights, for its legacy ones.
+
+    >>> from tensorflow.keras.layers import Dense
+    >>> from tensorflow.keras.models import Sequential
+    >>> from tensorflow.keras.optimizers import Adam, legacy
+    >>> model = Sequential([Dense(3, input_shape=(2,))])
+    >>> for optimizer in (Adam(), legacy.Adam()):
+    ...     _build_optimizer(optimizer, model.trainable_weights)
+    ...     _set_optimizer_weights(optimizer, [np.full(variable.shape, 7) for variable in _optimizer_variables(optimizer)])
+    ...     print(len(_optimizer_variables(optimizer)), _optimizer_weights(optimizer)[0])
+    5 7
+    5 7
+    """
+    if hasattr(optimizer, 'build'):
+        optimizer.build(variables)
+    else:
+        optimizer._create_all_weights(variables)  # pylint: disable=protected-access
+
+
+def _snapshot(agent: Any) -> dict:
+    """
+    Copies of everything that is saved for an agent.
+    """
+    memory = agent.memory
+    policies = {name: {setting: getattr(getattr(agent, name), setting) for setting in POLICY_SETTINGS
+                       if hasattr(getattr(agent, name), setting)}
+                for name in ('policy', 'test_policy')}
+    return {
+        'state': {'step': int(agent.step), 'policies': policies,
+                  'memory': {name: getattr(memory, name) for name in MEMORY_SETTINGS if hasattr(memory, name)}},
+        'weights': {'model': agent.model.get_weights(), 'target_model': agent.target_model.get_weights(),
+                    'optimizer': _optimizer_weights(_optimizer(agent))},
+        'memory': {name: getattr(memory, name).copy() for name in MEMORY_ARRAYS if hasattr(memory, name)},
+    }
+
+
+def _write_agent(directory: str, snapshot: dict) -> None:
+    os.makedirs(os.path.join(directory, MEMORY_DIRECTORY))
+    np.savez(os.path.join(directory, WEIGHTS_FILE),
+             **{f'{name}_{i}': weights for name, weights_list in snapshot['weights'].items()
+                for i, weights in enumerate(weights_list)})
+    for name, array in snapshot['memory'].items():
+        np.save(os.path.join(directory, MEMORY_DIRECTORY, f'{name}.npy'), array)
+
+
+def _load_weights(arrays: Any, name: str) -> List[np.ndarray]:
+    count = sum(1 for key in arrays.files if key.startswith(f'{name}_'))
+    return [arrays[f'{name}_{i}'] for i in range(count)]
+
+
+def _restore_agent(directory: str, agent: Any, state: dict) -> None:
+    with np.load(os.path.join(directory, WEIGHTS_FILE)) as arrays:
+        agent.model.set_weights(_load_weights(arrays, 'model'))
+        agent.target_model.set_weights(_load_weights(arrays, 'target_model'))
+        optimizer_weights = _load_weights(arrays, 'optimizer')
+    optimizer = _optimizer(agent)
+    if optimizer_weights and not _optimizer_variables(optimizer):
+        _build_optimizer(optimizer, agent.trainable_model.trainable_weights)
+    if optimizer_weights:
+        _set_optimizer_weights(optimizer, optimizer_weights)
+
+    memory = agent.memory
+    for name in MEMORY_ARRAYS:
+        if hasattr(memory, name):
+            getattr(memory, name)[...] = np.load(os.path.join(directory, MEMORY_DIRECTORY, f'{name}.npy'),
+                                                 mmap_mode='r')
+    for name, value in state['memory'].items():
+        setattr(memory, name, value)
+    for name, settings in state['policies'].items():
+        for setting, value in settings.items():
+            setattr(getattr(agent, name), setting, value)
+    agent.step = state['step']
+
+
+def _read_state(path: str) -> dict:
+    with open(os.path.join(path, STATE_FILE), encoding='utf-8') as state_file:
+        state: dict = json.load(state_file)
+    return state
+
+
+class Checkpointer:
+    """
+    Saves and loads checkpoints of training runs in a directory, keeping the latest few.
+    The agents are keras-rl DQNAgents (compiled, with a BoardMemory), saved and loaded by name.
+
+    Call wait() (or close()) before exiting, to let the last save finish.
+    """
+    def __init__(self, directory: str, keep: int = 2) -> None:
+        self.directory = directory
+        self.keep = keep
+        self.saved = 0
+        self._thread: Optional[threading.Thread] = None
+        self.error: Optional[BaseException] = None
+
+    def latest(self) -> Optional[str]:
+        """
+        The path of the latest complete checkpoint, if there is one.
+        """
+        try:
+            with open(os.path.join(self.directory, LATEST), encoding='utf-8') as latest_file:
+                name = latest_file.read().strip()
+        except FileNotFoundError:
+            return None
+        return os.path.join(self.directory, name)
+
+    def save(self, agents: Dict[str, Any], state: Optional[dict] = None, env: Optional[Any] = None,
+             background: bool = True) -> None:
+        """
+        Checkpoints the agents, the run's state (anything JSON can hold) and the random states,
+        in a background thread unless background is False. Waits for any earlier save to finish first.
+        """
+        self.wait()
+        snapshots = {name: _snapshot(agent) for name, agent in agents.items()}
+        random_arrays = _random_state_arrays(np.random, 'global_')
+        env_random_state = _env_random_state(env)
+        if env_random_state is not None:
+            random_arrays.update(_random_state_arrays(env_random_state, 'env_'))
+        run_state = {'run': state or {}, 'agents': {name: snapshot['state'] for name, snapshot in snapshots.items()}}
+        name = f'checkpoint-{self._next_number():06d}'
+        if background:
+            self._thread = threading.Thread(target=self._write, args=(name, run_state, random_arrays, snapshots))
+            self._thread.start()
+        else:
+            self._write(name, run_state, random_arrays, snapshots)
+
+    def _next_number(self) -> int:
+        # After every existing checkpoint's, even if LATEST names an earlier one (eg. after resuming from it).
+        existing = [int(name.split('-')[-1]) for name in self._checkpoints()]
+        self.saved = max([self.saved] + existing) + 1
+        return self.saved
+
+    def _checkpoints(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if name.startswith('checkpoint-'))
+
+    def _write(self, name: str, run_state: dict, random_arrays: Dict[str, np.ndarray],
+               snapshots: Dict[str, dict]) -> None:
+        try:
+            temporary = os.path.join(self.directory, f'.{name}.tmp')
+            shutil.rmtree(temporary, ignore_errors=True)
+            for agent_name, snapshot in snapshots.items():
+                _write_agent(os.path.join(temporary, agent_name), snapshot)
+            np.savez(os.path.join(temporary, RANDOM_FILE), **random_arrays)
+            with open(os.path.join(temporary, STATE_FILE), 'w', encoding='utf-8') as state_file:
+                json.dump(run_state, state_file, indent=2)
+            os.replace(temporary, os.path.join(self.directory, name))
+
+            latest_temporary = os.path.join(self.directory, f'.{LATEST}.tmp')
+            with open(latest_temporary, 'w', encoding='utf-8') as latest_file:
+                latest_file.write(name)
+            os.replace(latest_temporary, os.path.join(self.directory, LATEST))
+            self._remove_old(name)
+        except BaseException as error:  # pylint: disable=broad-except
+            self.error = error  # Raised by wait, in the training thread.
+
+    def _remove_old(self, latest: str) -> None:
+        for name in self._checkpoints()[:-self.keep]:
+            if name != latest:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def wait(self) -> None:
+        """
+        Waits for the save in progress (if any) to finish, and raises any error it met.
+        """
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    close = wait
+
+    def load(self, agents: Dict[str, Any], path: Optional[str] = None) -> Optional[dict]:
+        """
+        Restores the agents and numpy's global random state from the checkpoint at path, or else the latest one,
+        and returns the run's state, or None if there is no checkpoint.
+        The agents must have been built as they were when saved, with the same sizes of network and memory.
+        """
+        path = self.latest() if path is None else path
+        if path is None:
+            return None
+        run_state = _read_state(path)
+        for name, agent in agents.items():
+            _restore_agent(os.path.join(path, name), agent, run_state['agents'][name])
+        with np.load(os.path.join(path, RANDOM_FILE)) as random_arrays:
+            _set_random_state(np.random, random_arrays, 'global_')
+        state: dict = run_state['run']
+        return state
+
+
+class CheckpointCallback(Callback):
+    """
+    A keras-rl callback that checkpoints the agent being fitted (as agent_name, along with the other agents)
+    every interval steps, at the end of an episode, with the run's state and (as its 'step') the agent's step
+    within the fit call.
+
+    Given a checkpoint it saved to resume from (after loading it with Checkpointer.load), it carries on from there:
+    it counts steps on from the checkpoint's, so that agent.fit(env, nb_steps) stops where it would have
+    and its warm-up isn't repeated, and puts back the random state of the env's opponent.
+    """
+    def __init__(self, checkpointer: Checkpointer, agent_name: str, agents: Dict[str, Any], state: dict,
+                 interval: int = 5000, resume_from: Optional[str] = None) -> None:
+        super().__init__()
+        self.checkpointer = checkpointer
+        self.agent_name = agent_name
+        self.agents = agents
+        self.state = state
+        self.interval = interval
+        self.resume_from = resume_from
+        self.last_saved = 0 if resume_from is None else int(_read_state(resume_from)['run'].get('step', 0))
+
+    def on_episode_begin(self, episode: int, logs: Optional[dict] = None) -> None:
+        # fit sets step to 0 after on_train_begin, so this is the first chance to change it.
+        if episode == 0 and self.resume_from is not None:
+            self.model.step = self.last_saved
+            env_random_state = _env_random_state(self.env)
+            with np.load(os.path.join(self.resume_from, RANDOM_FILE)) as random_arrays:
+                if env_random_state is not None and 'env_keys' in random_arrays.files:
+                    _set_random_state(env_random_state, random_arrays, 'env_')
+
+    def on_episode_end(self, episode: int, logs: Optional[dict] = None) -> None:
+        if self.model.step - self.last_saved >= self.interval:
+            self.last_saved = int(self.model.step)
+            self.checkpointer.save({**self.agents, self.agent_name: self.model},
+                                   {**self.state, 'step': self.last_saved}, self.env)
@@ -1,22 +1,46 @@
-from typing import Type, Tuple
+from typing import Any, List, Optional, Type, Tuple
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Dense, Flatten
 from tensorflow.keras.optimizers import Adam
 
-from rl.agents.dqn import DQNAgent
 from rl.core import Agent
 from rl.policy import MaxBoltzmannQPolicy, BoltzmannQPolicy
-from rl.memory import SequentialMemory
 
 from gym import Env
 
-from games.connect4.env import Connect4Env, Connect4SecondPlayerEnv
+from games.connect4.env import Connect4Env, Connect4SecondPlayerEnv, NUM_POSITIONS
 from games.connect4.processor import Connect4Processor
+from games.connect4.symmetry import SYMMETRIES
+from games.connect4.vector_env import VectorConnect4Env, VectorConnect4SecondPlayerEnv, legal_action_mask
+from games.dqn import MaskedDQNAgent, PrioritizedDQNAgent, PrioritizedMaskedDQNAgent, VersionedDQNAgent
+from games.masked_policy import MaskedBoltzmannQPolicy, MaskedMaxBoltzmannQPolicy
+from games.memory import BoardMemory
+from games.numpy_dqn import get_numpy_dqn_agent
+from games.prioritized import PrioritizedBoardMemory, PrioritizedSymmetricMemory
+from games.symmetry import SymmetricMemory
+from games.opponent import CACHE_SIZE, BatchedOpponent
+from games.rollout import ParallelRollouts, train_parallel
+from games.tournament import Results, play_agents
 
 LAYER_SIZE = 69 * 2  # len(list(winning_combos())) = 69
+VECTOR_ENVS = {Connect4Env: VectorConnect4Env, Connect4SecondPlayerEnv: VectorConnect4SecondPlayerEnv}
 
-def get_dqn_agent(env: Env) -> Agent:
+def get_dqn_agent(env: Env, augment: bool = True, mask_illegal: bool = True, perspective: bool = False,
+                  layer_size: int = LAYER_SIZE, memory_limit: int = 50000, nb_steps_warmup: int = 100,
+                  target_model_update: float = 1e-2, learning_rate: float = 1e-3, prioritized: bool = False,
+                  batch_size: int = 32, train_interval: int = 1, gradient_steps: int = 1, n_step: int = 1,
+                  backend: str = 'keras') -> Agent:
     """
+    With mask_illegal, the agent only ever picks legal moves (and only learns from legal moves in the next state);
+    otherwise it has to learn not to play into full columns.
+    With perspective, the network sees the squares as its own and its opponent's, rather than X's and O's
+    (so it could play either side).
+    With prioritized, transitions are replayed by priority (see prioritized.py) rather than uniformly.
+    It trains every train_interval steps on a batch of batch_size transitions (gradient_steps batches, one after
+    the other, with backend='numpy'), of n_step steps each (see memory.py).
+    With backend='numpy', the agent is a NumpyDQNAgent (see numpy_dqn.py), trained without TensorFlow.
+    The rest are the hyperparameters: the hidden layer's size, the replay memory's, and keras-rl's and Adam's settings.
+
     >>> env = Connect4Env()
     >>> agent = get_dqn_agent(env)
     >>> agent.layers[1].weights[0].shape
@@ -24,48 +48,88 @@ def get_dqn_agent(env: Env) -> Agent:
     >>> agent.layers[2].weights[0].shape
     TensorShape([LAYER_SIZE, 6])
     """
+    if backend == 'numpy':
+        return get_numpy_dqn_agent(env, augment, mask_illegal, perspective, layer_size, memory_limit, nb_steps_warmup,
+                                   target_model_update, learning_rate, prioritized, batch_size, train_interval,
+                                   gradient_steps, n_step)
+    if gradient_steps != 1:
+        raise ValueError('keras-rl trains on one batch at a time: gradient_steps needs the numpy backend')
     nb_actions = env.action_space.n
 
     model = Sequential([
         Flatten(input_shape=(1,) + env.observation_space.shape),
-        Dense(LAYER_SIZE, activation='relu'),
+        Dense(layer_size, activation='relu'),
         Dense(nb_actions, activation='linear'),
     ])
 
-    memory = SequentialMemory(limit=50000, window_length=1)
-    training_policy = MaxBoltzmannQPolicy(eps=0.15, tau=1)  # EpsGreedyQPolicy(eps=0.2)
-    test_policy = BoltzmannQPolicy(tau=1)
-    processor = Connect4Processor()
-    dqn = DQNAgent(model=model,
-                   processor=processor,
-                   nb_actions=nb_actions,
-                   memory=memory,
-                   nb_steps_warmup=100,
-                   target_model_update=1e-2,
-                   policy=training_policy,
-                   test_policy=test_policy)
+    # With augment, every move is also learnt in its symmetric positions.
+    # The processor encodes whole batches of raw boards as they are sampled, so the memory holds raw boards.
+    if prioritized:
+        memory = PrioritizedSymmetricMemory(limit=memory_limit, board_size=NUM_POSITIONS, symmetries=SYMMETRIES,
+                                            one_hot=False, n_step=n_step) if augment \
+            else PrioritizedBoardMemory(limit=memory_limit, board_size=NUM_POSITIONS, one_hot=False, n_step=n_step)
+    else:
+        memory = SymmetricMemory(limit=memory_limit, board_size=NUM_POSITIONS, symmetries=SYMMETRIES, one_hot=False,
+                                 n_step=n_step) if augment \
+            else BoardMemory(limit=memory_limit, board_size=NUM_POSITIONS, one_hot=False, n_step=n_step)
+    if mask_illegal:
+        training_policy = MaskedMaxBoltzmannQPolicy(eps=0.15, tau=1)
+        test_policy = MaskedBoltzmannQPolicy(tau=1)
+    else:
+        training_policy = MaxBoltzmannQPolicy(eps=0.15, tau=1)  # EpsGreedyQPolicy(eps=0.2)
+        test_policy = BoltzmannQPolicy(tau=1)
+    processor = Connect4Processor(perspective=perspective, deferred=True)
+    if prioritized:
+        agent_class = PrioritizedMaskedDQNAgent if mask_illegal else PrioritizedDQNAgent
+    else:
+        agent_class = MaskedDQNAgent if mask_illegal else VersionedDQNAgent
+    dqn = agent_class(model=model,
+                      processor=processor,
+                      nb_actions=nb_actions,
+                      memory=memory,
+                      gamma=memory.gamma ** n_step,
+                      batch_size=batch_size,
+                      nb_steps_warmup=nb_steps_warmup,
+                      train_interval=train_interval,
+                      target_model_update=target_model_update,
+                      policy=training_policy,
+                      test_policy=test_policy)
     # https://keras.io/examples/rl/deep_q_network_breakout/#train says
     # Adam optimizer improves training time over RMSProp (for breakout game)
     # They also use clipnorm=1.0. Might be worth a try.
-    dqn.compile(Adam(lr=1e-3), metrics=['mae'])
+    dqn.compile(Adam(lr=learning_rate), metrics=['mae'])
     return dqn
 
 
-def train_agent(env: Env, agent: Agent, steps: int = 10000) -> Agent:
-    agent.fit(env, nb_steps=steps, visualize=False, verbose=1)
+def train_agent(env: Env, agent: Agent, steps: int = 10000, rollouts: Optional[ParallelRollouts] = None,
+                callbacks: Optional[List[Any]] = None, verbose: int = 1) -> Agent:
+    """
+    Trains the agent in the env (against a random opponent, if the env has none) or, given rollouts,
+    on the same kind of games played in its worker processes.
+    The keras-rl callbacks (eg. ProfilingCallback) are only used when training in the env.
+    """
+    if rollouts is None:
+        agent.fit(env, nb_steps=steps, visualize=False, verbose=verbose, callbacks=callbacks)
+    else:
+        train_parallel(agent, VECTOR_ENVS[type(env)], rollouts, steps, verbose=verbose > 0)
     return agent
 
 
 def get_env_with_opponent(trainee_env: Type[Env], opponent: Agent) -> Env:
     # opponent.training = False  # Can set it to False if using a probabilistic test_policy (eg. Boltzmann)
     opponent.training = True  # So that it still takes random choices occasionally when played against.
-    return trainee_env(get_opponent_action=lambda board: opponent.forward(opponent.processor.process_observation(board)))
+    return trainee_env(get_opponent_action=BatchedOpponent(opponent, legal_action_mask, cache_size=CACHE_SIZE))
 
 
-def train_against(trainee: Agent, trainee_env: Type[Env], opponent: Agent, steps: int = 10000) -> Env:
+def train_against(trainee: Agent, trainee_env: Type[Env], opponent: Agent, steps: int = 10000,
+                  rollouts: Optional[ParallelRollouts] = None, callbacks: Optional[List[Any]] = None,
+                  verbose: int = 1) -> Env:
     trainee.training = True
     env = get_env_with_opponent(trainee_env, opponent)
-    train_agent(env, trainee, steps)
+    if rollouts is None:
+        train_agent(env, trainee, steps, callbacks=callbacks, verbose=verbose)
+    else:
+        train_parallel(trainee, VECTOR_ENVS[trainee_env], rollouts, steps, opponent, verbose=verbose > 0)
     return env
 
 
@@ -107,9 +171,14 @@ def play(env: Env, agent: Agent) -> None:
         print(f"{'Game over' if done else ''} Reward: {reward} {info}\n")
         step += 1
 
-def test(env: Env, agent: Agent, nb_episodes=250) -> None:
-    test_history = agent.test(env, nb_episodes=nb_episodes, visualize=False, verbose=False).history
-    test_scores = test_history['episode_reward']
-    test_lengths = test_history['nb_steps']
-    print(f'  over {nb_episodes} games, average score  {sum(test_scores)/len(test_scores)}, range {min(test_scores)} - {max(test_scores)}')
-    print(f'  over {nb_episodes} games, average length {sum(test_lengths)/len(test_lengths)}, range {min(test_lengths)} - {max(test_lengths)}\n')
+def test(env: Env, agent: Agent, nb_episodes: int = 250, seed: int = 0, verbose: bool = True) -> Results:
+    """
+    Plays the agent against the env's opponent (if it can act on a batch of boards; otherwise random legal moves)
+    over nb_episodes games at once in the matching vector env, and prints how it did (if verbose).
+    The same seed gives the same games for the same agents, so rounds can be compared.
+    """
+    opponent = env.get_opponent_action if hasattr(env.get_opponent_action, 'act_batch') else None
+    results = play_agents(agent, VECTOR_ENVS[type(env)], nb_episodes, opponent, seed=seed)
+    if verbose:
+        print(results, end='\n\n')
+    return results
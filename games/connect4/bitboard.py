@@ -0,0 +1,186 @@
+"""
+A bitboard encoding of the Connect 4 board, as an alternative game core for Connect4Env.
+
+Each player's chips are held in one 64-bit int, laid out column by column from the
+bottom, with an extra always-empty sentinel bit on top of each column so that shifts
+never wrap from one column into the next:
+
+     6 13 20 27 34 41 48   <- sentinel row
+     5 12 19 26 33 40 47
+     4 11 18 25 32 39 46
+     3 10 17 24 31 38 45
+     2  9 16 23 30 37 44
+     1  8 15 22 29 36 43
+     0  7 14 21 28 35 42
+
+See http://blog.gamesolver.org/solving-connect-four/06-bitboard/ for the idea.
+"""
+from typing import NamedTuple, Optional, Tuple
+import numpy as np
+
+from .types import Action, Board
+
+# Kept in step with games.connect4.env (which imports this module).
+WIDTH = 7
+HEIGHT = 6
+NUM_POSITIONS = WIDTH * HEIGHT
+COLUMN_BITS = HEIGHT + 1
+
+# The bits of the bottom row, and of every playable (non-sentinel) cell.
+BOTTOM_MASK = sum(1 << (column * COLUMN_BITS) for column in range(WIDTH))
+BOARD_MASK = BOTTOM_MASK * ((1 << HEIGHT) - 1)
+DRAW_REWARD = 0.5  # As Connect4Env gives.
+
+# The bit for each position of the env's board array, indexed by position.
+POSITION_BITS: Tuple[int, ...] = tuple(
+    1 << ((position % WIDTH) * COLUMN_BITS + HEIGHT - 1 - position // WIDTH)
+    for position in range(NUM_POSITIONS)
+)
+
+# The bit index of each position, for turning bitboards back into board arrays.
+POSITION_SHIFTS = np.array([bit.bit_length() - 1 for bit in POSITION_BITS])
+COLUMN_MASKS = tuple(((1 << HEIGHT) - 1) << (column * COLUMN_BITS) for column in range(WIDTH))
+
+# Vertical, horizontal and the two diagonal directions.
+DIRECTIONS = (1, COLUMN_BITS, COLUMN_BITS - 1, COLUMN_BITS + 1)
+
+
+def from_board(board: Board, mark: int) -> int:
+    """
+    Returns the bitboard of the chips with the given mark (1 or 2) on the env's board array.
+
+    >>> board = np.zeros(NUM_POSITIONS, dtype=np.int8)
+    >>> board[[41, 40, 34]] = (1, 2, 1)
+    >>> from_board(board, 1) == POSITION_BITS[41] | POSITION_BITS[34]
+    True
+    >>> from_board(board, 2) == POSITION_BITS[40]
+    True
+    """
+    bitboard = 0
+    for position in np.flatnonzero(board == mark).tolist():
+        bitboard |= POSITION_BITS[position]
+    return bitboard
+
+
+def has_four(bitboard: int) -> bool:
+    """
+    Whether the bitboard contains four in a row in any direction.
+
+    >>> has_four(POSITION_BITS[35] | POSITION_BITS[36] | POSITION_BITS[37])
+    False
+    >>> has_four(POSITION_BITS[35] | POSITION_BITS[36] | POSITION_BITS[37] | POSITION_BITS[38])
+    True
+    >>> has_four(POSITION_BITS[41] | POSITION_BITS[33] | POSITION_BITS[25] | POSITION_BITS[17])
+    True
+    >>> # Does not wrap around from the top of one column into the next.
+    >>> has_four(POSITION_BITS[1] | POSITION_BITS[0] | POSITION_BITS[41] | POSITION_BITS[34])
+    False
+    """
+    for shift in DIRECTIONS:
+        pairs = bitboard & (bitboard >> shift)
+        if pairs & (pairs >> (2 * shift)):
+            return True
+    return False
+
+
+def winning_cells(bitboard: int) -> int:
+    """
+    Returns the cells (whether empty or not) that would complete four in a row for this bitboard.
+
+    >>> winning_cells(POSITION_BITS[35] | POSITION_BITS[36] | POSITION_BITS[37]) == POSITION_BITS[38]
+    True
+    >>> winning_cells(POSITION_BITS[36] | POSITION_BITS[37] | POSITION_BITS[38]) == POSITION_BITS[35] | POSITION_BITS[39]
+    True
+    >>> winning_cells(POSITION_BITS[41] | POSITION_BITS[34] | POSITION_BITS[27]) == POSITION_BITS[20]
+    True
+    """
+    # Vertical: only ever completed from above.
+    cells = (bitboard << 1) & (bitboard << 2) & (bitboard << 3)
+    for shift in DIRECTIONS[1:]:
+        # The missing chip is at one end of three in a row...
+        pair = (bitboard << shift) & (bitboard << (2 * shift))
+        cells |= pair & (bitboard << (3 * shift))
+        cells |= pair & (bitboard >> shift)
+        # ...or the other.
+        pair = (bitboard >> shift) & (bitboard >> (2 * shift))
+        cells |= pair & (bitboard << shift)
+        cells |= pair & (bitboard >> (3 * shift))
+    return cells & BOARD_MASK
+
+
+def playable_cells(occupied: int) -> int:
+    """
+    Returns the lowest empty cell of each column that is not full.
+
+    >>> playable_cells(0) == BOTTOM_MASK
+    True
+    >>> playable_cells(POSITION_BITS[35]) == BOTTOM_MASK - POSITION_BITS[35] + POSITION_BITS[28]
+    True
+    """
+    return (occupied + BOTTOM_MASK) & BOARD_MASK
+
+
+def can_win_next(bitboard: int, occupied: int) -> bool:
+    """
+    Whether the player with this bitboard can complete four in a row with their next chip.
+
+    >>> three = POSITION_BITS[35] | POSITION_BITS[36] | POSITION_BITS[37]
+    >>> can_win_next(three, three)
+    True
+    >>> can_win_next(three, three | POSITION_BITS[38])
+    False
+    >>> # The winning cell is in the second row, and the cell beneath it is still empty.
+    >>> three = POSITION_BITS[28] | POSITION_BITS[29] | POSITION_BITS[30]
+    >>> can_win_next(three, three | POSITION_BITS[35] | POSITION_BITS[36] | POSITION_BITS[37])
+    False
+    """
+    return bool(winning_cells(bitboard) & playable_cells(occupied))
+
+
+class Connect4State(NamedTuple):
+    """
+    A position as bitboards, for searching without copying the env's board: play returns a new state.
+
+    >>> state = Connect4State.from_board(np.zeros(NUM_POSITIONS, dtype=np.int8))
+    >>> for column in (3, 3, 4, 4, 5, 5):
+    ...     state = state.play(column)
+    >>> state.mark, state.legal_actions(), state.outcome(), state.play(6).outcome()
+    (1, (0, 1, 2, 3, 4, 5, 6), None, 1.0)
+    >>> (Connect4State.from_board(state.board()) == state, state.board()[-7:].tolist())
+    (True, [0, 0, 0, 1, 1, 1, 0])
+    """
+    current: int  # The chips of the player to move.
+    occupied: int
+    mark: int  # Of the player to move: 1 or 2.
+
+    @classmethod
+    def from_board(cls, board: Board) -> 'Connect4State':
+        mark = 1 if (board == 1).sum() == (board == 2).sum() else 2
+        return cls(from_board(board, mark), from_board(board, 1) | from_board(board, 2), mark)
+
+    def legal_actions(self) -> Tuple[Action, ...]:
+        playable = playable_cells(self.occupied)
+        return tuple(Action(column) for column in range(WIDTH) if playable & COLUMN_MASKS[column])
+
+    def play(self, action: Action) -> 'Connect4State':
+        occupied = self.occupied | (playable_cells(self.occupied) & COLUMN_MASKS[action])
+        return Connect4State(self.current ^ self.occupied, occupied, 3 - self.mark)
+
+    def lost(self) -> bool:
+        """
+        Whether the player who just moved has won.
+        """
+        return has_four(self.current ^ self.occupied)
+
+    def outcome(self) -> Optional[float]:
+        """
+        The reward for the player who just moved, as Connect4Env gives it, if the game is over (and None if not).
+        """
+        if self.lost():
+            return 1.
+        return DRAW_REWARD if self.occupied == BOARD_MASK else None
+
+    def board(self) -> Board:
+        first = self.current if self.mark == 1 else self.current ^ self.occupied
+        second = self.occupied ^ first
+        return Board((((first >> POSITION_SHIFTS) & 1) + 2 * ((second >> POSITION_SHIFTS) & 1)).astype(np.int8))
@@ -0,0 +1,168 @@
+"""
+Opening books: the Q-values of an agent, or the moves of alpha-beta search, for every position in the first few moves
+of a game, worked out ahead of time, so that the same openings need not be evaluated or searched again and again.
+
+A book is one .npy file of records sorted by key, memory-mapped rather than read in (but for the keys, 8 bytes a
+position, which are read in to be binary searched): each position's key is its bitboards' current + occupied
+(see bitboard.py; no two positions share one).
+Agents' books hold their Q-values; search books hold the score of the move found, and -inf for the other columns.
+
+    python -m games.connect4.book agent WEIGHTS_FILE PLIES BOOK_FILE
+    python -m games.connect4.book search DEPTH PLIES BOOK_FILE
+"""
+import sys
+from typing import Any, List, Tuple
+import numpy as np
+
+from . import bitboard as bb
+from .bitboard import Connect4State
+
+POSITION_BITS = np.array(bb.POSITION_BITS, dtype=np.uint64)
+RECORD = np.dtype([('key', np.uint64), ('values', np.float32, (bb.WIDTH,))])
+
+
+def position_keys(boards: np.ndarray) -> np.ndarray:
+    """
+    The keys of a batch of boards, with the player to move worked out from the number of chips.
+
+    >>> state = Connect4State.from_board(np.zeros(bb.NUM_POSITIONS, dtype=np.int8)).play(3).play(3).play(2)
+    >>> position_keys(state.board()[np.newaxis]).tolist() == [state.current + state.occupied]
+    True
+    """
+    occupied = (boards != 0).astype(np.uint64) @ POSITION_BITS
+    marks = np.where((boards == 1).sum(axis=1) == (boards == 2).sum(axis=1), 1, 2)
+    current = (boards == marks[:, np.newaxis]).astype(np.uint64) @ POSITION_BITS
+    keys: np.ndarray = current + occupied
+    return keys
+
+
+def opening_positions(plies: int) -> List[Connect4State]:
+    """
+    Every position, other than won ones, in which fewer than plies chips have been played.
+
+    >>> [len(opening_positions(plies)) for plies in range(1, 6)]
+    [1, 8, 57, 295, 1415]
+    """
+    level = [Connect4State(0, 0, 1)]
+    positions: List[Connect4State] = []
+    for _ in range(plies):
+        positions.extend(level)
+        level = sorted({child for state in level for child in map(state.play, state.legal_actions())
+                        if child.outcome() is None})
+    return positions
+
+
+class OpeningBook:
+    """
+    Looks up the values of batches of boards (with which were found), and counts its hits and misses.
+
+    >>> import os, tempfile
+    >>> positions = opening_positions(3)
+    >>> path = os.path.join(tempfile.mkdtemp(), 'book.npy')
+    >>> write_book(path, positions, np.tile(np.arange(7, dtype=np.float32), (len(positions), 1)))
+    >>> book = OpeningBook(path)
+    >>> boards = np.array([positions[5].board(), opening_positions(4)[-1].board()])
+    >>> found, values = book.lookup(boards)
+    >>> found.tolist(), values[0].tolist(), len(book), book.hits, book.misses, f'{book.hit_rate:.0%}'
+    ([True, False], [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0], 57, 1, 1, '50%')
+
+    An empty book finds nothing.
+    >>> write_book(path, [], np.zeros((0, 7), dtype=np.float32))
+    >>> OpeningBook(path).lookup(boards)[0].tolist()
+    [False, False]
+    """
+    def __init__(self, path: str) -> None:
+        self.records = np.load(path, mmap_mode='r')
+        self.keys = np.ascontiguousarray(self.records['key'])
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def lookup(self, boards: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Whether each board is in the book, and the values of those that are.
+        """
+        keys = position_keys(boards)
+        if len(self.keys) == 0:
+            self.misses += len(keys)
+            return np.zeros(len(keys), dtype=bool), np.zeros((0, bb.WIDTH), dtype=np.float32)
+        indices = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        found = self.keys[indices] == keys
+        self.hits += int(found.sum())
+        self.misses += len(found) - int(found.sum())
+        return found, np.array(self.records['values'][indices[found]])
+
+
+def write_book(path: str, positions: List[Connect4State], values: np.ndarray) -> None:
+    records = np.zeros(len(positions), dtype=RECORD)
+    records['key'] = [state.current + state.occupied for state in positions]
+    records['values'] = values
+    np.save(path, np.sort(records, order='key'))
+
+
+def build_agent_book(path: str, agent: Any, plies: int) -> int:
+    """
+    Writes a book of the agent's Q-values (a DQN agent or a NumpyQNetwork), in one forward pass,
+    and returns its number of positions.
+
+    An opponent that looks up its Q-values in the book plays as it would without it.
+    >>> import os, tempfile
+    >>> from games.numpy_network import NumpyQNetwork
+    >>> from games.opponent import BatchedOpponent
+    >>> from .vector_env import legal_action_mask
+    >>> random_state = np.random.RandomState(0)
+    >>> agent = NumpyQNetwork([(random_state.normal(size=(126, 7)), np.zeros(7))])
+    >>> path = os.path.join(tempfile.mkdtemp(), 'book.npy')
+    >>> build_agent_book(path, agent, 4)
+    295
+    >>> opponent = BatchedOpponent(agent, legal_action_mask, book=OpeningBook(path))
+    >>> boards = np.array([state.board() for state in opening_positions(5)[::50]])
+    >>> (opponent.act_batch(boards) == BatchedOpponent(agent, legal_action_mask).act_batch(boards)).all()
+    True
+    >>> opponent.book.hits, opponent.book.misses
+    (6, 23)
+    """
+    positions = opening_positions(plies)
+    process_observation = agent.processor.process_observation
+    values = agent.compute_batch_q_values([[process_observation(state.board())] for state in positions])
+    write_book(path, positions, values)
+    return len(positions)
+
+
+def build_search_book(path: str, opponent: Any, plies: int) -> int:
+    """
+    Writes a book of the moves of an AlphaBetaOpponent (without its eps), and returns its number of positions.
+
+    >>> import os, tempfile
+    >>> from .search import AlphaBetaOpponent
+    >>> path = os.path.join(tempfile.mkdtemp(), 'book.npy')
+    >>> build_search_book(path, AlphaBetaOpponent(depth=2), 2)
+    8
+    >>> book = OpeningBook(path)
+    >>> AlphaBetaOpponent(depth=2, book=book)(np.zeros(bb.NUM_POSITIONS, dtype=np.int8)), book.hits
+    (3, 1)
+    """
+    positions = opening_positions(plies)
+    values = np.full((len(positions), bb.WIDTH), -np.inf, dtype=np.float32)
+    for row, state in zip(values, positions):
+        column, score = opponent.search(state.board())
+        row[column] = score
+    write_book(path, positions, values)
+    return len(positions)
+
+
+if __name__ == '__main__':
+    KIND, SOURCE, PLIES, PATH = sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4]
+    if KIND == 'agent':
+        from games.connect4.numpy_agent import get_numpy_agent
+        COUNT = build_agent_book(PATH, get_numpy_agent(SOURCE), PLIES)
+    else:
+        from games.connect4.search import AlphaBetaOpponent
+        COUNT = build_search_book(PATH, AlphaBetaOpponent(depth=int(SOURCE)), PLIES)
+    print(f'Wrote {COUNT} positions to {PATH}')
@@ -5,7 +5,9 @@ import numpy as np
 from gym import spaces, Env
 from gym.utils import seeding
 
+from games.lines import LineCounts
 from .types import Action, Board
+from . import bitboard as bb
 
 WIDTH = 7
 HEIGHT = 6
@@ -46,21 +48,42 @@ class Connect4Env(Env):
      7, 8, 9,10,11,12,13,
      ...
     35,36,37,38,39,40,41]
+
+    The height of each column, and each player's chips on each winning line (see games/lines.py),
+    are kept up to date as chips are dropped, so a win or a threat is found from the lines through the last chip.
+    Assign a whole board to self.board (rather than changing it in place) to start from another position.
+
+    Pass bitboard=True to also keep each player's chips as a bitboard (see bitboard.py),
+    and use it for the win and threat checks instead.
+    Observations, rewards and info are the same either way.
     """
     reward_range = (-np.inf, np.inf)
     observation_space = spaces.MultiBinary(NUM_POSITIONS * 3)
     action_space = spaces.Discrete(WIDTH)
 
-    def __init__(self, get_opponent_action: Callable[[Board], Action]=None) -> None:
+    def __init__(self, get_opponent_action: Callable[[Board], Action]=None, bitboard: bool = False) -> None:
         super().__init__()
+        self.use_bitboard = bitboard
         self.np_random = seeding.np_random(1)
         self.action_space.seed(1)
         default_get_action = lambda _: self.action_space.sample()
         self.get_opponent_action = get_opponent_action or default_get_action
         # Both of these encode the state, and are mutable.
         self.current_player: Literal[0, 1] = 0
+        self.lines = LineCounts(list(winning_combos()), NUM_POSITIONS)
         self.board = np.zeros(NUM_POSITIONS, dtype="int")
 
+    @property
+    def board(self) -> np.ndarray:
+        return self._board
+
+    @board.setter
+    def board(self, board: np.ndarray) -> None:
+        self._board = board
+        self.heights = [int((board[column::WIDTH] != 0).sum()) for column in range(WIDTH)]
+        self.bitboards = [bb.from_board(board, 1), bb.from_board(board, 2)]
+        self.lines.reset(board)
+
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
         self.action_space.seed(seed)
@@ -96,6 +119,19 @@ class Connect4Env(Env):
         # Cannot place chip into a column that is full.
         return self.board[action] == 0
 
+    def legal_action_mask(self) -> np.ndarray:
+        """
+        Which columns can still take a chip.
+
+        >>> env = Connect4Env()
+        >>> obs = env.reset()
+        >>> for _ in range(HEIGHT):
+        ...     env.drop_chip(2)
+        >>> env.legal_action_mask().astype(int)
+        array([1, 1, 0, 1, 1, 1, 1])
+        """
+        return self.board[:WIDTH] == 0
+
     def _can_other_player_win_next(self) -> bool:
         """
         >>> env = Connect4Env()
@@ -111,12 +147,13 @@ class Connect4Env(Env):
         >>> env._can_other_player_win_next()
         True
         """
-        for combo in winning_combos():
-            # Looking for three spaces in the combo claimed by the other player, with one empty,
-            # and the spaces below them are all occupied (or it's the bottom row).
-            if (self.board[list(combo)] == 2 - self.current_player).sum() == 3 \
-                    and (self.board[list(combo)] == 0).sum() == 1 \
-                    and (self.board[list(x + WIDTH for x in combo if x < NUM_POSITIONS - WIDTH)] > 0).all():
+        if self.use_bitboard:
+            return bb.can_win_next(self.bitboards[1 - self.current_player], self.bitboards[0] | self.bitboards[1])
+        # Looking for lines with three spaces claimed by the other player, and the empty one
+        # resting on a chip (or on the bottom row).
+        for line in self.lines.open[1 - self.current_player]:
+            position = self.lines.empty_square(line, self.board)
+            if position >= NUM_POSITIONS - WIDTH or self.board[position + WIDTH] != 0:
                 return True
         return False
 
@@ -132,13 +169,12 @@ class Connect4Env(Env):
         >>> env._has_current_player_won()
         True
         """
-        for combo in winning_combos():
-            if (self.board[list(combo)] == self.current_player + 1).all():
-                return True
-        return False
+        if self.use_bitboard:
+            return bb.has_four(self.bitboards[self.current_player])
+        return self.lines.won[self.current_player]
 
     def _is_board_full_next(self) -> bool:
-        return (self.board != 0).sum() >= NUM_POSITIONS - 1
+        return sum(self.heights) >= NUM_POSITIONS - 1
 
     def drop_chip(self, action: Action) -> None:
         """
@@ -164,11 +200,13 @@ class Connect4Env(Env):
         """
         if action > WIDTH:
             raise Exception('Illegal action')
-        for row in range(HEIGHT - 1, -1, -1):
-            if self.board[row * WIDTH + action] == 0:
-                self.board[row * WIDTH + action] = self.current_player + 1
-                break
-
+        if self.heights[action] == HEIGHT:
+            return
+        position = (HEIGHT - 1 - self.heights[action]) * WIDTH + action
+        self.heights[action] += 1
+        self.board[position] = self.current_player + 1
+        self.bitboards[self.current_player] |= bb.POSITION_BITS[position]
+        self.lines.add(position, self.current_player)
 
     def step(self, action: Action) -> Tuple[Board, float, bool, dict]:
         """
@@ -186,6 +224,19 @@ class Connect4Env(Env):
         • • • • • • •
         • • • • • • •
         • • X • • O •
+
+        The bitboard engine plays out exactly the same.
+        >>> def play_out(env):
+        ...     _ = env.reset()
+        ...     results = []
+        ...     for a in np.random.RandomState(0).randint(WIDTH, size=300):
+        ...         board, reward, done, info = env.step(a)
+        ...         results.append((board.tobytes(), reward, info))
+        ...         if done:
+        ...             _ = env.reset()
+        ...     return results
+        >>> play_out(Connect4Env()) == play_out(Connect4Env(bitboard=True))
+        True
         """
         info = {"state": "in progress"}
         reward = 0
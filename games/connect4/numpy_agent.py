@@ -0,0 +1,23 @@
+"""
+Connect 4 agents that play from saved weights in NumPy, without loading TensorFlow.
+"""
+from typing import Tuple
+
+from games.numpy_network import NumpyQNetwork
+from games.policy import QPolicy
+
+# The same policies as get_dqn_agent, which only picks legal actions by default.
+TRAINING_POLICY = QPolicy(eps=0.15, tau=1.)
+TEST_POLICY = QPolicy(tau=1.)
+
+
+def get_numpy_agent(filepath: str) -> NumpyQNetwork:
+    return NumpyQNetwork.load(filepath, policy=TRAINING_POLICY, test_policy=TEST_POLICY, mask_illegal=True)
+
+
+def load_numpy_agents(path_base: str) -> Tuple[NumpyQNetwork, NumpyQNetwork]:
+    """
+    Loads the agents saved by save_agents, for the first and second player.
+    """
+    path_ext = '.hdf5'
+    return get_numpy_agent(f'{path_base}-1{path_ext}'), get_numpy_agent(f'{path_base}-2{path_ext}')
@@ -1,7 +1,15 @@
+import argparse
 import os
+from typing import Any, Dict, List, Optional
 from games.connect4.env import Connect4Env, Connect4SecondPlayerEnv
-from games.connect4.agent import train_against, train_agent, load_agents, get_dqn_agent, play, save_agents, test
+from games.connect4.agent import (train_against, train_agent, load_agents, get_dqn_agent, get_env_with_opponent, play,
+                                  save_agents, test)
 from games.connect4.play_human import play_human
+from games.connect4.search import AlphaBetaOpponent
+from games.checkpoint import Checkpointer, CheckpointCallback
+from games.profiling import Profiler, ProfilingCallback
+from games.rollout import ParallelRollouts
+from games.tournament import seed_schedule
 # from tensorflow.python.framework.ops import disable_eager_execution
 # from tensorflow.python.compiler.mlcompute import set_mlc_device
 
@@ -11,18 +19,68 @@ if __name__ == '__main__':
     # disable_eager_execution()
     # set_mlc_device(device_name='gpu')
 
+    PARSER = argparse.ArgumentParser(description='Train Connect 4 agents, and play against them.')
+    PARSER.add_argument('--workers', type=int, default=0,
+                        help='collect training games in this many worker processes (0 to play them in this one)')
+    PARSER.add_argument('--profile', action='store_true',
+                        help='time each phase of training (env, opponent, processor, replay sampling, backward pass) '
+                             'and report it after every training run (only when training in this process)')
+    PARSER.add_argument('--trace', metavar='PATH',
+                        help='with --profile, also write every timed call to this JSON file, in Chrome trace format')
+    PARSER.add_argument('--checkpoint-every', type=int, default=0, metavar='STEPS',
+                        help='also checkpoint the training state every this many steps within a round '
+                             '(at the end of a game), as well as after training each player '
+                             '(only when training in this process)')
+    ARGS = PARSER.parse_args()
+    ROLLOUTS = ParallelRollouts(ARGS.workers) if ARGS.workers else None
+    PROFILER = Profiler(trace=ARGS.trace is not None) if ARGS.profile else None
+
     DEFAULT_WEIGHT_FILE_NAME = 'temp'
+    SEARCH_DEPTH = 4
+    # Each test has its own seed, the same every round, so that rounds are compared on the same games.
+    TEST_SEEDS = seed_schedule(0, 6)
     SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
+    # The whole training state is checkpointed along with the weights, in NAME-checkpoints,
+    # so that "improve NAME X" can carry on where training stopped (see checkpoint.py for what can still differ).
+    CHECKPOINTER = Checkpointer(os.path.join(SCRIPT_PATH, 'weights', f'{DEFAULT_WEIGHT_FILE_NAME}-checkpoints'))
+
+    def callbacks(round_index: int, player: int, agents: Dict[str, Any], resume_from: Optional[str] = None) -> List[Any]:
+        """
+        The callbacks for training the player in the round (counted from 0): profiling, and checkpoints within the round
+        (resuming from the given checkpoint, taken within the round).
+        """
+        round_callbacks: List[Any] = []
+        if PROFILER is not None:
+            round_callbacks.append(ProfilingCallback(PROFILER, f'round {round_index + 1}, player {player}', ARGS.trace))
+        if ARGS.checkpoint_every or resume_from is not None:
+            others = {name: agent for name, agent in agents.items() if name != f'player {player}'}
+            round_callbacks.append(CheckpointCallback(CHECKPOINTER, f'player {player}', others,
+                                                      {'round': round_index, 'player': player, 'random_rounds': RANDOM_ROUNDS},
+                                                      interval=ARGS.checkpoint_every or 10 ** 9,
+                                                      resume_from=resume_from))
+        return round_callbacks
+
+    def checkpoint(round_index: int, player: int, agents: Dict[str, Any]) -> None:
+        """
+        Checkpoints the agents once training the player in the round (counted from 0) is done (in the background).
+        """
+        next_round, next_player = (round_index, 2) if player == 1 else (round_index + 1, 1)
+        CHECKPOINTER.save(agents, {'round': next_round, 'player': next_player, 'step': 0, 'random_rounds': RANDOM_ROUNDS,
+                                   'rollouts_round': None if ROLLOUTS is None else ROLLOUTS.round})
+
     WORDS = ['']
     while WORDS[0] not in ('load', 'new', 'improve'):
         WORD = input("""
 Type one of:
     - "load NAME" to load pre-trained agents from the named file (eg. "load weights")
     - "new X" to train new agents over X rounds (eg. "new 20")
-    - "improve NAME X" to load pre-trained agents and continue training them (eg. "improve temp 5")
+    - "improve NAME X" to load pre-trained agents and train them for X more rounds (eg. "improve temp 5")
 Your choice? """)
         WORDS = WORD.split(' ')
 
+    RESUME = {'round': 0, 'player': 1, 'step': 0}
+    RESUME_FROM = None  # The checkpoint to carry on from, if it was taken within a round.
+    RANDOM_ROUNDS = 1  # Rounds played against random legal actions, at the start.
     if WORDS[0] == 'load':
         FILENAME = 'weights'
         try:
@@ -31,7 +89,6 @@ Your choice? """)
             pass
         agent_1, env_1, agent_2, env_2 = load_agents(os.path.join(SCRIPT_PATH, 'weights', FILENAME))
     elif WORDS[0] == 'improve':
-        INITIAL = 0
         ROUNDS = 10
         FILENAME = 'weights'
         try:
@@ -39,7 +96,28 @@ Your choice? """)
             ROUNDS = int(WORDS[2])
         except (ValueError, IndexError):
             pass
-        agent_1, env_1, agent_2, env_2 = load_agents(os.path.join(SCRIPT_PATH, 'weights', FILENAME))
+        SAVED = Checkpointer(os.path.join(SCRIPT_PATH, 'weights', f'{FILENAME}-checkpoints'))
+        if SAVED.latest() is None:
+            agent_1, env_1, agent_2, env_2 = load_agents(os.path.join(SCRIPT_PATH, 'weights', FILENAME))
+            RANDOM_ROUNDS = 0
+        else:
+            agent_1 = get_dqn_agent(Connect4Env())
+            agent_2 = get_dqn_agent(Connect4SecondPlayerEnv())
+            RESUME = SAVED.load({'player 1': agent_1, 'player 2': agent_2}) or RESUME
+            RANDOM_ROUNDS = RESUME['random_rounds']
+            # The envs each player was last trained in, as they would be without the break,
+            # to test against as the previous players (random legal actions, after a round of them).
+            LAST_ROUND_1 = RESUME['round'] if RESUME['player'] == 2 else RESUME['round'] - 1
+            env_1 = Connect4Env() if LAST_ROUND_1 < RANDOM_ROUNDS else get_env_with_opponent(Connect4Env, agent_2)
+            env_2 = Connect4SecondPlayerEnv() if RESUME['round'] - 1 < RANDOM_ROUNDS \
+                else get_env_with_opponent(Connect4SecondPlayerEnv, agent_1)
+            RESUME_FROM = SAVED.latest() if RESUME['step'] else None
+            if ROLLOUTS is not None and RESUME.get('rollouts_round') is not None:
+                ROLLOUTS.round = RESUME['rollouts_round']
+            print(f'Resuming from {SAVED.latest()}: round {RESUME["round"] + 1}, player {RESUME["player"]}, '
+                  f'step {RESUME["step"]}')
+        # X more rounds, counting the one that was under way (if any) as the first.
+        ROUNDS += RESUME['round']
     else:
         ROUNDS = 10
         try:
@@ -52,36 +130,56 @@ Your choice? """)
         env_2 = Connect4SecondPlayerEnv()
         agent_2 = get_dqn_agent(env_2)
 
-        print()
-        print(f'Round 1 of {ROUNDS} (against random legal actions)')
-        print('Training player 1')
-        agent_1 = train_agent(env_1, agent_1)
-        print('Training player 2')
-        agent_2 = train_agent(env_2, agent_2)
-        INITIAL = 1
-
     if WORDS[0] in ('improve', 'new'):
-        for i in range(INITIAL, ROUNDS):
+        AGENTS = {'player 1': agent_1, 'player 2': agent_2}
+        for i in range(RESUME['round'], ROUNDS):
             old_env_1 = env_1
             old_env_2 = env_2
             print()
-            print(f'Round {i + 1} of {ROUNDS}')
-            print('Training player 1')
-            env_1 = train_against(agent_1, Connect4Env, agent_2)
-            print('Testing against previous player 2')
-            test(old_env_1, agent_1)
-            print('Testing against latest player 2')
-            test(env_1, agent_1)
-            print(f'Round {i + 1} of {ROUNDS}')
+            if i < RANDOM_ROUNDS:
+                print(f'Round {i + 1} of {ROUNDS} (against random legal actions)')
+            else:
+                print(f'Round {i + 1} of {ROUNDS}')
+            if (i, 2) != (RESUME['round'], RESUME['player']):
+                RESUMING = RESUME_FROM if i == RESUME['round'] else None
+                print('Training player 1')
+                if i < RANDOM_ROUNDS:
+                    env_1 = Connect4Env()
+                    agent_1 = train_agent(env_1, agent_1, rollouts=ROLLOUTS, callbacks=callbacks(i, 1, AGENTS, RESUMING))
+                else:
+                    env_1 = train_against(agent_1, Connect4Env, agent_2, rollouts=ROLLOUTS,
+                                          callbacks=callbacks(i, 1, AGENTS, RESUMING))
+                    print('Testing against previous player 2')
+                    test(old_env_1, agent_1, seed=TEST_SEEDS[0])
+                    print('Testing against latest player 2')
+                    test(env_1, agent_1, seed=TEST_SEEDS[1])
+                    print(f'Testing against alpha-beta search (depth {SEARCH_DEPTH})')
+                    test(Connect4Env(get_opponent_action=AlphaBetaOpponent(SEARCH_DEPTH)), agent_1, seed=TEST_SEEDS[2])
+                checkpoint(i, 1, AGENTS)
+                print(f'Round {i + 1} of {ROUNDS}')
+            RESUMING = RESUME_FROM if (i, 2) == (RESUME['round'], RESUME['player']) else None
             print('Training player 2')
-            env_2 = train_against(agent_2, Connect4SecondPlayerEnv, agent_1)
-            print('Testing against previous player 1')
-            test(old_env_2, agent_2)
-            print('Testing against latest player 1')
-            test(env_2, agent_2)
+            if i < RANDOM_ROUNDS:
+                env_2 = Connect4SecondPlayerEnv()
+                agent_2 = train_agent(env_2, agent_2, rollouts=ROLLOUTS, callbacks=callbacks(i, 2, AGENTS, RESUMING))
+            else:
+                env_2 = train_against(agent_2, Connect4SecondPlayerEnv, agent_1, rollouts=ROLLOUTS,
+                                      callbacks=callbacks(i, 2, AGENTS, RESUMING))
+                print('Testing against previous player 1')
+                test(old_env_2, agent_2, seed=TEST_SEEDS[3])
+                print('Testing against latest player 1')
+                test(env_2, agent_2, seed=TEST_SEEDS[4])
+                print(f'Testing against alpha-beta search (depth {SEARCH_DEPTH})')
+                test(Connect4SecondPlayerEnv(get_opponent_action=AlphaBetaOpponent(SEARCH_DEPTH)), agent_2,
+                     seed=TEST_SEEDS[5])
+            checkpoint(i, 2, AGENTS)
 
             print(f'Saving weights for trained agents (as {DEFAULT_WEIGHT_FILE_NAME})')
             save_agents(os.path.join(SCRIPT_PATH, 'weights', DEFAULT_WEIGHT_FILE_NAME), agent_1, agent_2)
+        CHECKPOINTER.wait()
+
+    if ROLLOUTS is not None:
+        ROLLOUTS.close()
 
     print("Play against themselves:")
     play(env_1, agent_1)
@@ -1,11 +1,15 @@
 import numpy as np
 from rl.processors import Processor
 
-from games.connect4.types import BoardForDqn, Board
+from games.encoding import OneHotProcessor
+from games.connect4.types import BoardForDqn
 
 
-class Connect4Processor(Processor):
-    def process_observation(self, observation: Board) -> BoardForDqn:
+class Connect4Processor(OneHotProcessor, Processor):
+    """
+    See OneHotProcessor for the perspective and deferred (batch) encodings.
+    """
+    def process_observation(self, observation: np.ndarray) -> BoardForDqn:
         """
         Processes the observation as obtained from the environment for use in an agent and
         returns it.
@@ -21,4 +25,4 @@ class Connect4Processor(Processor):
         array([1, 0, 0, 1, 0, 0, 1, 0, 0, 1, 0, 0, 1, 0, 0, 1, 0, 0, 1, 0, 0, 1,
                0, 0, 1, 0, 0], dtype=int8)
         """
-        return np.eye(3, dtype=np.int8)[observation].reshape(-1)
+        return BoardForDqn(super().process_observation(observation))
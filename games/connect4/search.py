@@ -0,0 +1,209 @@
+"""
+A Connect 4 opponent that looks ahead with depth-limited alpha-beta search over bitboards (see bitboard.py).
+
+Positions are hashed with Zobrist keys into a transposition table of bounded size, evicting the least recently used,
+and moves are tried centre first (after the best move found for the position before, if any).
+Positions at the depth limit are scored by how many cells would complete four in a row for each player
+(more on the rows that favour them in the endgame), and by their chips in the centre column.
+"""
+from collections import OrderedDict
+from typing import Any, NamedTuple, Optional, Tuple
+import numpy as np
+
+from . import bitboard as bb
+from .types import Action, Board
+
+COLUMN_ORDER = (3, 2, 4, 1, 5, 0, 6)
+COLUMN_MASKS = bb.COLUMN_MASKS
+CENTER_MASK = COLUMN_MASKS[bb.WIDTH // 2]
+# Rows 1, 3 and 5 counting from the bottom, where the first player's threats are worth most (and the rest for the second's).
+ODD_ROWS_MASK = bb.BOTTOM_MASK * 0b010101
+PARITY_MASKS = (ODD_ROWS_MASK, bb.BOARD_MASK & ~ODD_ROWS_MASK)
+WIN_SCORE = 1000000  # Plus the depth left, so that quicker wins score higher.
+
+# A random key for each mark (1 or 2, at index 0 or 1) in each bit of the bitboard layout.
+ZOBRIST_KEYS = np.random.RandomState(4).randint(0, 2 ** 63, size=(2, bb.WIDTH * bb.COLUMN_BITS), dtype=np.int64).tolist()
+
+EXACT, LOWER, UPPER = range(3)
+
+
+class TableEntry(NamedTuple):
+    depth: int
+    flag: int  # Whether value is exact, or only a lower or upper bound (from a cut-off).
+    value: int
+    column: int
+
+
+def _count(bits: int) -> int:
+    return bin(bits).count('1')
+
+
+def zobrist_hash(board: Board) -> int:
+    """
+    >>> board = np.zeros(bb.NUM_POSITIONS, dtype=np.int8)
+    >>> zobrist_hash(board)
+    0
+    >>> board[41] = 1
+    >>> zobrist_hash(board) == ZOBRIST_KEYS[0][bb.POSITION_BITS[41].bit_length() - 1]
+    True
+    """
+    key = 0
+    for position in np.flatnonzero(board).tolist():
+        key ^= ZOBRIST_KEYS[board[position] - 1][bb.POSITION_BITS[position].bit_length() - 1]
+    return key
+
+
+def evaluate(current: int, opponent: int, occupied: int, mark: int) -> int:
+    """
+    A heuristic score for the player to move (with the given mark), from the empty cells that would complete a line
+    for each player (counting double on the rows where they would come into play in the endgame: odd rows for the
+    first player, and even rows for the second), and the chips in the centre column.
+    """
+    empty = bb.BOARD_MASK & ~occupied
+    current_threats = bb.winning_cells(current) & empty
+    opponent_threats = bb.winning_cells(opponent) & empty
+    threats = _count(current_threats) + _count(current_threats & PARITY_MASKS[mark - 1]) \
+        - _count(opponent_threats) - _count(opponent_threats & PARITY_MASKS[2 - mark])
+    return 4 * threats + _count(current & CENTER_MASK) - _count(opponent & CENTER_MASK)
+
+
+class AlphaBetaOpponent:
+    """
+    Picks moves by alpha-beta search to the given depth (in moves, counting both players'),
+    to be passed as Connect4Env's get_opponent_action, or act_batch as a vector env's get_opponent_actions.
+    With eps, it plays a random legal move that often instead.
+    The transposition table is kept between moves, up to table_size positions.
+    Given an OpeningBook of its moves (see book.py), it plays those without searching.
+
+    It takes a win, and blocks a loss.
+    >>> opponent = AlphaBetaOpponent(depth=4)
+    >>> board = np.zeros(bb.NUM_POSITIONS, dtype=np.int8)
+    >>> board[[41, 40, 39, 34, 33, 32]] = [1, 1, 1, 2, 2, 2]
+    >>> opponent(board)
+    3
+    >>> board = np.zeros(bb.NUM_POSITIONS, dtype=np.int8)
+    >>> board[[41, 34, 27, 40, 33]] = [1, 1, 1, 2, 2]
+    >>> opponent(board)
+    6
+
+    It finds a win two moves ahead: a third chip on the bottom row, with both ends open.
+    >>> board = np.zeros(bb.NUM_POSITIONS, dtype=np.int8)
+    >>> board[[37, 38, 30, 31]] = [1, 1, 2, 2]
+    >>> opponent(board) in (1, 4)
+    True
+    """
+    def __init__(self, depth: int = 6, table_size: int = 1000000, eps: float = 0.,
+                 random_state: Optional[Any] = None, book: Optional[Any] = None) -> None:
+        self.depth = depth
+        self.table_size = table_size
+        self.eps = eps
+        self.random_state = np.random.RandomState(0) if random_state is None else random_state
+        self.book = book
+        self.table: 'OrderedDict[int, TableEntry]' = OrderedDict()
+        self.nodes = 0
+
+    def _store(self, key: int, entry: TableEntry) -> None:
+        self.table[key] = entry
+        self.table.move_to_end(key)
+        if len(self.table) > self.table_size:
+            self.table.popitem(last=False)
+
+    def _negamax(self, current: int, occupied: int, mark: int, key: int, depth: int, alpha: int, beta: int) -> int:
+        """
+        The score for the player to move (with bitboard current, and the given mark), searching depth more moves.
+        """
+        self.nodes += 1
+        playable = bb.playable_cells(occupied)
+        if bb.winning_cells(current) & playable:
+            return WIN_SCORE + depth
+        if playable == 0:
+            return 0
+        opponent = current ^ occupied
+        if depth == 0:
+            return evaluate(current, opponent, occupied, mark)
+
+        original_alpha = alpha
+        hint = None
+        entry = self.table.get(key)
+        if entry is not None:
+            self.table.move_to_end(key)
+            hint = entry.column
+            if entry.depth >= depth:
+                if entry.flag == EXACT:
+                    return entry.value
+                if entry.flag == LOWER:
+                    alpha = max(alpha, entry.value)
+                else:
+                    beta = min(beta, entry.value)
+                if alpha >= beta:
+                    return entry.value
+
+        columns = self._columns(playable, bb.winning_cells(opponent) & playable, hint)
+        if not columns:  # The opponent has two winning cells to play next: lost.
+            return -WIN_SCORE - depth + 1
+        best_value, best_column = -WIN_SCORE - depth - 1, columns[0]
+        for column in columns:
+            move = playable & COLUMN_MASKS[column]
+            value = -self._negamax(opponent, occupied | move, 3 - mark,
+                                   key ^ ZOBRIST_KEYS[mark - 1][move.bit_length() - 1], depth - 1, -beta, -alpha)
+            if value > best_value:
+                best_value, best_column = value, column
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+
+        flag = UPPER if best_value <= original_alpha else LOWER if best_value >= beta else EXACT
+        self._store(key, TableEntry(depth, flag, best_value, best_column))
+        return best_value
+
+    @staticmethod
+    def _columns(playable: int, threats: int, hint: Optional[int]) -> Tuple[int, ...]:
+        """
+        The columns worth trying, in order: only the block if the opponent threatens to win next
+        (none if it threatens twice), otherwise the hint then the others centre first.
+        """
+        if threats:
+            blocks = tuple(column for column in COLUMN_ORDER if threats & COLUMN_MASKS[column])
+            return blocks if len(blocks) == 1 else ()
+        columns = tuple(column for column in COLUMN_ORDER if playable & COLUMN_MASKS[column])
+        if hint in columns:
+            columns = (hint,) + tuple(column for column in columns if column != hint)
+        return columns
+
+    def search(self, board: Board) -> Tuple[Action, int]:
+        """
+        The best column for the player to move on the board (worked out from the number of chips), and its score,
+        from the opening book if it has the board.
+        """
+        if self.book is not None:
+            found, values = self.book.lookup(board[np.newaxis])
+            if found[0]:
+                return Action(int(values[0].argmax())), int(values[0].max())
+        mark = 1 if (board == 1).sum() == (board == 2).sum() else 2
+        current, opponent = bb.from_board(board, mark), bb.from_board(board, 3 - mark)
+        occupied = current | opponent
+        playable = bb.playable_cells(occupied)
+        winning = bb.winning_cells(current) & playable
+        if winning:
+            return Action(next(column for column in COLUMN_ORDER if winning & COLUMN_MASKS[column])), WIN_SCORE + self.depth
+        key = zobrist_hash(board)
+        columns = self._columns(playable, bb.winning_cells(opponent) & playable, None) \
+            or tuple(column for column in COLUMN_ORDER if playable & COLUMN_MASKS[column])
+        alpha, beta = -WIN_SCORE - self.depth - 1, WIN_SCORE + self.depth + 1
+        best_column, best_value = columns[0], alpha
+        for column in columns:
+            move = playable & COLUMN_MASKS[column]
+            value = -self._negamax(opponent, occupied | move, 3 - mark,
+                                   key ^ ZOBRIST_KEYS[mark - 1][move.bit_length() - 1], self.depth - 1, -beta, -alpha)
+            if value > best_value:
+                best_column, best_value = column, value
+            alpha = max(alpha, value)
+        return Action(best_column), best_value
+
+    def __call__(self, board: Board) -> Action:
+        if self.eps and self.random_state.random_sample() < self.eps:
+            return Action(int(self.random_state.choice(np.flatnonzero(board[:bb.WIDTH] == 0))))
+        return self.search(board)[0]
+
+    def act_batch(self, boards: np.ndarray) -> np.ndarray:
+        return np.array([self(board) for board in boards])
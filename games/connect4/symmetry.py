@@ -0,0 +1,22 @@
+"""
+Connect 4 is the same game mirrored left to right.
+
+>>> board = np.zeros(WIDTH * HEIGHT, dtype=np.int8)
+>>> board[-WIDTH:] = [1, 2, 0, 0, 0, 0, 0]
+>>> SYMMETRIES.boards(board)[:, -WIDTH:]
+array([[1, 2, 0, 0, 0, 0, 0],
+       [0, 0, 0, 0, 0, 2, 1]], dtype=int8)
+>>> SYMMETRIES.actions[:, 1]
+array([1, 5])
+"""
+import numpy as np
+
+from games.symmetry import Symmetries
+from .env import WIDTH, HEIGHT
+
+_GRID = np.arange(WIDTH * HEIGHT).reshape(HEIGHT, WIDTH)
+
+SYMMETRIES = Symmetries(
+    squares=np.array([_GRID.reshape(-1), _GRID[:, ::-1].reshape(-1)]),
+    actions=np.array([np.arange(WIDTH), np.arange(WIDTH)[::-1]]),
+)
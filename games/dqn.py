@@ -0,0 +1,135 @@
+"""
+A keras-rl DQNAgent that only ever considers legal actions, in either game.
+"""
+from typing import Any, List, Optional
+import numpy as np
+from rl.agents.dqn import DQNAgent
+
+from games.encoding import free_squares
+
+
+class MaskedModel:
+    """
+    Wraps a Keras model so that predict_on_batch gives every illegal action the lowest Q-value of its state,
+    so that the best action of each state is a legal one. Everything else is passed through to the model.
+    """
+    def __init__(self, model: Any, nb_actions: int) -> None:
+        self.model = model
+        self.nb_actions = nb_actions
+
+    def predict_on_batch(self, batch: Any) -> np.ndarray:
+        """
+        >>> class Model:
+        ...     def predict_on_batch(self, batch):
+        ...         return np.array([[3., 2., 1.]] * len(batch))
+        >>> from games.encoding import one_hot
+        >>> MaskedModel(Model(), 3).predict_on_batch(one_hot(np.array([[[1, 0, 0]], [[0, 0, 0]]])))
+        array([[1., 2., 1.],
+               [3., 2., 1.]])
+        """
+        q_values = self.model.predict_on_batch(batch)
+        legal = free_squares(np.asarray(batch).reshape(len(q_values), -1), self.nb_actions)
+        return np.where(legal, q_values, q_values.min(axis=1, keepdims=True))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.model, name)
+
+
+class VersionedDQNAgent(DQNAgent):
+    """
+    A DQNAgent that counts the changes to its weights, from training or load_weights, in weights_version,
+    so that a cache of its Q-values (see opponent.py) can tell when they are stale without asking TensorFlow.
+    """
+    weights_version = 0
+
+    def backward(self, reward: float, terminal: bool) -> List[float]:
+        metrics: List[float] = super().backward(reward, terminal)
+        # keras-rl trains on these steps (after appending to the memory).
+        if self.training and self.step > self.nb_steps_warmup and self.step % self.train_interval == 0:
+            self.weights_version += 1
+        return metrics
+
+    def load_weights(self, filepath: str) -> None:
+        super().load_weights(filepath)
+        self.weights_version += 1
+
+
+class MaskedDQNAgent(VersionedDQNAgent):
+    """
+    A DQNAgent that picks only legal actions, and learns from the best legal action of the next state.
+    Its policy and test_policy must take a mask of the legal actions, as the policies of masked_policy.py do.
+    The legal actions are read from the observations by the processor's legal_action_mask, if it has one
+    (as OneHotProcessor does), otherwise from one-hot encoded observations (see encoding.py), so it works for both games.
+    """
+    mask_illegal = True  # So that other code picking actions for it (eg. BatchedOpponent) knows to mask them too.
+
+    def compile(self, optimizer: Any, metrics: Optional[List[Any]] = None) -> None:
+        super().compile(optimizer, metrics=[] if metrics is None else metrics)
+        # keras-rl's compile makes target_model, so this can only wrap it here.
+        self.target_model = MaskedModel(self.target_model, self.nb_actions)  # pylint: disable=attribute-defined-outside-init
+
+    def forward(self, observation: np.ndarray) -> int:
+        state = self.memory.get_recent_state(observation)
+        q_values = self.compute_q_values(state)
+        policy = self.policy if self.training else self.test_policy
+        legal_action_mask = getattr(self.processor, 'legal_action_mask', free_squares)
+        action = policy.select_action(q_values=q_values, legal=legal_action_mask(observation, self.nb_actions))
+
+        self.recent_observation = observation
+        self.recent_action = action
+        return action
+
+
+class PrioritizedTrainableModel:
+    """
+    Wraps a DQNAgent's trainable model so that each batch it trains on, sampled from a prioritized memory
+    (see prioritized.py), is weighted by the memory's importance-sampling weights, and the memory's priorities
+    are updated from the batch's TD errors (from the model before it trains). Everything else is passed through.
+    """
+    def __init__(self, trainable_model: Any, model: Any, memory: Any) -> None:
+        self.trainable_model = trainable_model
+        self.model = model
+        self.memory = memory
+
+    def train_on_batch(self, inputs: List[Any], targets: List[Any]) -> Any:
+        """
+        >>> class Model:
+        ...     def predict_on_batch(self, batch):
+        ...         return np.array([[1., 2.], [3., 4.]])
+        ...     def train_on_batch(self, inputs, targets, sample_weight):
+        ...         return sample_weight[0]
+        >>> class Memory:
+        ...     last_weights = np.array([.5, 1.])
+        ...     def update_priorities(self, td_errors):
+        ...         print(td_errors)
+        >>> model = PrioritizedTrainableModel(Model(), Model(), Memory())
+        >>> model.train_on_batch([np.zeros((2, 1, 2)), np.array([[2., 0.], [0., 0.]]), np.array([[1., 0.], [0., 1.]])],
+        ...                      [np.zeros(2), np.zeros((2, 2))])
+        [ 1. -4.]
+        array([0.5, 1. ])
+        """
+        *states, q_targets, masks = inputs
+        q_values = self.model.predict_on_batch(states[0] if len(states) == 1 else states)
+        self.memory.update_priorities(((q_targets - q_values) * masks).sum(axis=1))
+        weights = self.memory.last_weights
+        return self.trainable_model.train_on_batch(inputs, targets, sample_weight=[weights, np.ones_like(weights)])
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.trainable_model, name)
+
+
+class PrioritizedDQNAgent(VersionedDQNAgent):
+    """
+    A DQNAgent that learns from a prioritized replay memory, such as PrioritizedBoardMemory.
+    """
+    def compile(self, optimizer: Any, metrics: Optional[List[Any]] = None) -> None:
+        super().compile(optimizer, metrics=[] if metrics is None else metrics)
+        # keras-rl's compile makes trainable_model, so it can only be wrapped here.
+        self.trainable_model = PrioritizedTrainableModel(  # pylint: disable=attribute-defined-outside-init
+            self.trainable_model, self.model, self.memory)
+
+
+class PrioritizedMaskedDQNAgent(PrioritizedDQNAgent, MaskedDQNAgent):
+    """
+    A MaskedDQNAgent that learns from a prioritized replay memory.
+    """
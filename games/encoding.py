@@ -0,0 +1,124 @@
+"""
+The one-hot encoding of boards used as the Q-networks' input, for both games.
+This module doesn't import keras-rl, so it can be used without loading TensorFlow.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+# Row i is the encoding of a square holding i (0 for free, 1 or 2 for a player's mark).
+ONE_HOT = np.eye(3, dtype=np.int8)
+# The same for each player to move, with their own mark encoded as mark 1 is in ONE_HOT.
+PERSPECTIVE_ONE_HOT = np.stack([ONE_HOT, ONE_HOT[[0, 2, 1]]])
+
+
+def players_to_move(boards: np.ndarray) -> np.ndarray:
+    """
+    Whose turn it is on each board (player 0, with mark 1, moves first), for a single board or a batch.
+
+    >>> players_to_move(np.array([[0, 0, 0], [1, 0, 0], [1, 2, 0]]))
+    array([0, 1, 0])
+    """
+    return ((boards != 0).sum(axis=-1) % 2).astype(np.intp)
+
+
+def encode(boards: np.ndarray, perspective: bool = False, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    One-hot encodes boards as one_hot does, or with perspective, as free, the player to move's mark,
+    or the other player's mark (the same as one_hot when player 0 is to move),
+    by looking each square up in a table. Writes the encoding into out, if given.
+
+    >>> encode(np.array([1, 0, 0]), perspective=True), encode(np.array([1, 2, 0]), perspective=True)
+    (array([0, 0, 1, 1, 0, 0, 1, 0, 0], dtype=int8), array([0, 1, 0, 0, 0, 1, 1, 0, 0], dtype=int8))
+    """
+    boards = np.asarray(boards)
+    shape = boards.shape[:-1] + (-1,)
+    if perspective:
+        encoded = PERSPECTIVE_ONE_HOT[players_to_move(boards)[..., np.newaxis], boards]
+    else:
+        encoded = ONE_HOT[boards]
+    if out is None:
+        return encoded.reshape(shape)
+    out.reshape(encoded.shape)[...] = encoded
+    return out
+
+
+def one_hot(boards: np.ndarray) -> np.ndarray:
+    """
+    Encodes each square as three neurons, only one of which is 1: free, player 1's mark or player 2's mark.
+    Works on a single board or a batch of them.
+
+    >>> one_hot(np.array([0, 1, 2]))
+    array([1, 0, 0, 0, 1, 0, 0, 0, 1], dtype=int8)
+    >>> one_hot(np.zeros((5, 42), dtype=np.int8)).shape
+    (5, 126)
+    """
+    return ONE_HOT[boards].reshape(boards.shape[:-1] + (-1,))
+
+
+def free_squares(encoded: np.ndarray, squares: int) -> np.ndarray:
+    """
+    Which of the first squares are free, in one-hot encoded boards (a single one or a batch).
+    In both games, action a is legal just when square a is free (for Connect 4, the top of column a),
+    so free_squares(encoded, nb_actions) is the mask of legal actions.
+
+    >>> free_squares(one_hot(np.array([[0, 1, 2, 0], [2, 0, 0, 1]])), 3)
+    array([[ True, False, False],
+           [False,  True,  True]])
+    """
+    return encoded[..., 0:3 * squares:3] == 1
+
+
+class OneHotProcessor:
+    """
+    One-hot encodes observations for the Q-networks, as the games' keras-rl processors do (they are built on this),
+    without keras-rl.
+
+    With perspective, the squares are encoded as free, the player to move's or the other player's,
+    rather than free, X's or O's (see encode), so the same network could play either side.
+
+    With deferred, process_observation keeps the raw board (an int8 copy), so that is what the agent
+    and its memory hold (use BoardMemory with one_hot=False), and process_state_batch encodes a whole batch at once,
+    into one of two buffers that are reused from call to call. keras-rl uses each processed batch before processing
+    the next but one (DQNAgent.backward processes state0 and then state1), so two are enough.
+
+    >>> boards = np.array([[[0, 1, 2]], [[1, 2, 1]]], dtype=np.int8)
+    >>> processor = OneHotProcessor(perspective=True, deferred=True)
+    >>> processor.process_observation(boards[1, 0])
+    array([1, 2, 1], dtype=int8)
+    >>> processor.process_state_batch(boards)
+    array([[[1, 0, 0, 0, 1, 0, 0, 0, 1]],
+    <BLANKLINE>
+           [[0, 0, 1, 0, 1, 0, 0, 0, 1]]], dtype=int8)
+    >>> processor.process_state_batch(boards) is processor.process_state_batch(boards)
+    False
+    """
+    def __init__(self, perspective: bool = False, deferred: bool = False) -> None:
+        self.perspective = perspective
+        self.deferred = deferred
+        self._buffers: Dict[Tuple[int, ...], List[np.ndarray]] = {}  # Two for each shape of batch
+
+    def process_observation(self, observation: np.ndarray) -> np.ndarray:
+        if self.deferred:
+            return np.array(observation, dtype=np.int8)
+        return encode(observation, self.perspective)
+
+    def process_state_batch(self, batch: Any) -> np.ndarray:
+        if not self.deferred:
+            return batch
+        # keras-rl's DQNAgent hands over the batch as an array of objects.
+        boards = np.asarray(batch).astype(np.int8, copy=False)
+        shape = boards.shape[:-1] + (3 * boards.shape[-1],)
+        buffers = self._buffers.get(shape)
+        if buffers is None:
+            buffers = self._buffers[shape] = [np.empty(shape, dtype=np.int8), np.empty(shape, dtype=np.int8)]
+        buffers.reverse()  # Use the one not used last time.
+        out = buffers[0]
+        return encode(boards, self.perspective, out)
+
+    def legal_action_mask(self, observation: np.ndarray, nb_actions: int) -> np.ndarray:
+        """
+        Which actions are legal in a processed observation: in both games, those whose square is free.
+        """
+        if self.deferred:
+            return np.asarray(observation)[..., :nb_actions] == 0
+        return free_squares(observation, nb_actions)
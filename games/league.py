@@ -0,0 +1,191 @@
+"""
+A league of frozen past versions of both players, to train each player against a mix of opponents,
+rather than only against the other player's latest version (which tends to go round in circles).
+
+Snapshots are kept as NumPy weights and played with NumpyQNetwork (see numpy_network.py), so they are cheap to keep
+and to send to worker processes, and playing them needs no TensorFlow.
+Opponents are picked by prioritized fictitious self-play: each of the other player's snapshots is picked
+with a weight of (1 - score) ** power, where score is how well the trainee last did against it
+(1 for always winning, 0 for always losing), so most training is against the opponents it can't yet beat.
+Snapshots it hasn't played yet get the highest weight. The scores come from evaluation matches,
+which can be spread over a pool of worker processes.
+"""
+import json
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Type
+import numpy as np
+
+from games.encoding import OneHotProcessor
+from games.numpy_network import NumpyQNetwork
+from games.policy import QPolicy, as_q_policy
+from games.rollout import get_weights
+from games.tournament import play_agents
+
+
+class Snapshot(NamedTuple):
+    name: str
+    seat: int  # 0 for the first player, 1 for the second.
+    weights: List[np.ndarray]  # As model.get_weights() gives them.
+    policy: QPolicy
+    test_policy: QPolicy
+    mask_illegal: bool
+    perspective: bool
+
+    def network(self, random_state: Optional[Any] = None) -> NumpyQNetwork:
+        """
+        A NumpyQNetwork that plays as the agent did.
+        """
+        return NumpyQNetwork(list(zip(self.weights[::2], self.weights[1::2])), policy=self.policy,
+                             test_policy=self.test_policy, processor=OneHotProcessor(self.perspective, deferred=True),
+                             random_state=random_state, mask_illegal=self.mask_illegal)
+
+
+def take_snapshot(agent: Any, seat: int, name: str) -> Snapshot:
+    """
+    A frozen copy of a keras-rl DQNAgent (or a NumpyQNetwork).
+    """
+    return Snapshot(name, seat, [np.array(weights, dtype=np.float32) for weights in get_weights(agent)],
+                    as_q_policy(agent.policy), as_q_policy(agent.test_policy), getattr(agent, 'mask_illegal', False),
+                    getattr(agent.processor, 'perspective', False))
+
+
+class MatchJob(NamedTuple):
+    player: Snapshot
+    opponent: Snapshot
+    vector_env_class: Type[Any]  # The player's, eg. VectorConnect4Env for seat 0
+    games: int
+    seed: int
+
+
+def play_match(job: MatchJob) -> float:
+    """
+    Plays the games of an evaluation match, with both sides using their test policies,
+    and returns the player's score: its wins plus half its draws, over the games.
+    """
+    results = play_agents(job.player.network(), job.vector_env_class, job.games, job.opponent.network(),
+                          num_envs=min(job.games, 250), seed=job.seed)
+    return (results.wins + results.draws / 2) / results.games
+
+
+class League:
+    """
+    The snapshots of each seat (up to size of each, dropping the oldest), and the current score of each seat's
+    trainee against each of the other seat's snapshots.
+
+    >>> def snapshot(name, seat):
+    ...     return Snapshot(name, seat, [np.zeros((27, 9)), np.zeros(9)], QPolicy(), QPolicy(), True, False)
+    >>> league = League(size=2)
+    >>> for name in 'abc':
+    ...     league.add(snapshot(name, seat=1))
+    >>> [s.name for s in league.snapshots[1]]
+    ['b', 'c']
+    >>> league.priorities(0)  # Neither has been played, so both are as likely.
+    array([0.5, 0.5])
+    >>> league.record(0, 'b', .5)
+    >>> league.priorities(0)  # Unplayed, c is more likely than b, which the trainee beats half the time.
+    array([0.2, 0.8])
+    >>> league.record(0, 'c', 1.)
+    >>> league.priorities(0), league.sample(0).name
+    (array([1., 0.]), 'b')
+
+    It can be saved and loaded again, and then picks opponents as it would have carried on picking them.
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'league.npz')
+    >>> league.save(path)
+    >>> loaded = League.load(path)
+    >>> [s.name for s in loaded.snapshots[1]], loaded.scores, loaded.snapshots[1][0].policy
+    (['b', 'c'], [{'b': 0.5, 'c': 1.0}, {}], QPolicy(eps=None, tau=None, clip=(-500.0, 500.0)))
+    >>> loaded.random_state.randint(100, size=5).tolist() == league.random_state.randint(100, size=5).tolist()
+    True
+    """
+    def __init__(self, size: int = 10, power: float = 2., random_state: Optional[Any] = None) -> None:
+        self.size = size
+        self.power = power
+        self.random_state = np.random.RandomState(0) if random_state is None else random_state
+        self.snapshots: List[List[Snapshot]] = [[], []]
+        self.scores: List[Dict[str, float]] = [{}, {}]  # By the trainee's seat, then the opponent's name.
+
+    def add(self, snapshot: Snapshot) -> None:
+        """
+        Adds a snapshot to its seat's pool (in place of any of the same name), dropping the oldest if the pool is full.
+        """
+        pool = self.snapshots[snapshot.seat]
+        pool[:] = [kept for kept in pool if kept.name != snapshot.name] + [snapshot]
+        for dropped in pool[:-self.size]:
+            self.scores[1 - snapshot.seat].pop(dropped.name, None)
+        del pool[:-self.size]
+
+    def record(self, seat: int, name: str, score: float) -> None:
+        """
+        Records the score of the seat's trainee against the named snapshot of the other seat.
+        """
+        self.scores[seat][name] = score
+
+    def priorities(self, seat: int) -> np.ndarray:
+        """
+        The chance of picking each of the other seat's snapshots as the seat's trainee's next opponent.
+        """
+        scores = np.array([self.scores[seat].get(snapshot.name, 0.) for snapshot in self.snapshots[1 - seat]])
+        weights = (1 - scores) ** self.power
+        if weights.sum() == 0:  # It beats every one of them.
+            weights = np.ones(len(scores))
+        return weights / weights.sum()
+
+    def sample(self, seat: int) -> Snapshot:
+        """
+        Picks an opponent for the seat's trainee.
+        """
+        opponents = self.snapshots[1 - seat]
+        return opponents[self.random_state.choice(len(opponents), p=self.priorities(seat))]
+
+    def evaluate(self, player: Snapshot, vector_env_class: Type[Any], games: int = 100, seed: int = 0,
+                 pool: Optional[Any] = None) -> Dict[str, float]:
+        """
+        Plays the snapshot of a seat's trainee against every snapshot of the other seat, in the pool's
+        worker processes if given one (eg. a multiprocessing.Pool), and records and returns its scores.
+        """
+        opponents = self.snapshots[1 - player.seat]
+        jobs = [MatchJob(player, opponent, vector_env_class, games, seed) for opponent in opponents]
+        scores = (map if pool is None else pool.map)(play_match, jobs)
+        results = dict(zip((opponent.name for opponent in opponents), scores))
+        for name, score in results.items():
+            self.record(player.seat, name, score)
+        return results
+
+    def save(self, path: str) -> None:
+        """
+        Writes the league (and its random state) to a single .npz file, replacing it only once the new one is complete.
+        """
+        arrays = {f'{snapshot.name}/{i}': weights for pool in self.snapshots for snapshot in pool
+                  for i, weights in enumerate(snapshot.weights)}
+        random_state = self.random_state.get_state(legacy=False)
+        metadata = {'size': self.size, 'power': self.power, 'scores': self.scores,
+                    'random_state': {**random_state, 'state': {**random_state['state'],
+                                                               'key': random_state['state']['key'].tolist()}},
+                    'snapshots': [[{**snapshot._asdict(), 'weights': len(snapshot.weights)} for snapshot in pool]
+                                  for pool in self.snapshots]}
+        temporary = f'{path}.tmp.npz'
+        np.savez(temporary, metadata=np.array(json.dumps(metadata)), **arrays)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path: str, random_state: Optional[Any] = None) -> 'League':
+        with np.load(path) as arrays:
+            metadata = json.loads(str(arrays['metadata']))
+            league = cls(metadata['size'], metadata['power'], random_state)
+            if 'random_state' in metadata:  # Carrying on from where it was saved, rather than from random_state's seed.
+                state = metadata['random_state']
+                league.random_state.set_state(
+                    {**state, 'state': {**state['state'], 'key': np.array(state['state']['key'], dtype=np.uint32)}})
+            league.scores = metadata['scores']
+            for pool, snapshots in zip(league.snapshots, metadata['snapshots']):
+                for fields in snapshots:
+                    weights = [arrays[f'{fields["name"]}/{i}'] for i in range(fields['weights'])]
+                    pool.append(Snapshot(**{**fields, 'weights': weights, 'policy': _q_policy(fields['policy']),
+                                            'test_policy': _q_policy(fields['test_policy'])}))
+        return league
+
+
+def _q_policy(fields: Tuple[Any, ...]) -> QPolicy:
+    eps, tau, clip = fields
+    return QPolicy(eps, tau, tuple(clip))
@@ -0,0 +1,65 @@
+"""
+Incremental tracking of the winning lines of a board game, so that checking for a win or a threat after a move
+only looks at the lines through the square just played, rather than scanning the whole board.
+"""
+from typing import List, Sequence, Set, Tuple
+import numpy as np
+
+
+class LineCounts:
+    """
+    How many chips each player (0 or 1, with marks 1 and 2) has on each winning line,
+    which lines are open for them: one chip short of complete, with none of the other player's,
+    and whether they have completed one.
+    Update it with add as each chip is played, or rebuild it from a whole board with reset.
+
+    >>> lines = LineCounts([(0, 1, 2), (0, 3, 6)], board_size=9)
+    >>> lines.add(0, player=0), lines.add(1, player=0), lines.open[0]
+    (False, False, {0})
+    >>> lines.add(3, player=1), lines.open
+    (False, [{0}, set()])
+    >>> lines.add(2, player=0), lines.open, lines.won
+    (True, [set(), set()], [True, False])
+    >>> lines.reset(np.array([1, 1, 0, 0, 0, 0, 2, 0, 0]))
+    >>> lines.counts, lines.open
+    ([[2, 1], [0, 1]], [{0}, set()])
+    """
+    def __init__(self, combos: Sequence[Sequence[int]], board_size: int) -> None:
+        self.combos: Tuple[Tuple[int, ...], ...] = tuple(tuple(combo) for combo in combos)
+        self.length = len(self.combos[0])
+        self.lines_through: Tuple[Tuple[int, ...], ...] = tuple(
+            tuple(line for line, combo in enumerate(self.combos) if position in combo) for position in range(board_size))
+        self.counts: List[List[int]] = [[0] * len(self.combos), [0] * len(self.combos)]
+        self.open: List[Set[int]] = [set(), set()]
+        self.won = [False, False]
+
+    def reset(self, board: np.ndarray) -> None:
+        self.counts = [[0] * len(self.combos), [0] * len(self.combos)]
+        self.open = [set(), set()]
+        self.won = [False, False]
+        for position in np.flatnonzero(board).tolist():
+            self.add(position, int(board[position]) - 1)
+
+    def add(self, position: int, player: int) -> bool:
+        """
+        Counts a chip for the player at position, and returns whether it completes a line.
+        """
+        counts, other_counts = self.counts[player], self.counts[1 - player]
+        won = False
+        for line in self.lines_through[position]:
+            counts[line] += 1
+            if other_counts[line] == 0:
+                if counts[line] == self.length:
+                    won = self.won[player] = True
+                    self.open[player].discard(line)
+                elif counts[line] == self.length - 1:
+                    self.open[player].add(line)
+            elif counts[line] == 1:
+                self.open[1 - player].discard(line)
+        return won
+
+    def empty_square(self, line: int, board: np.ndarray) -> int:
+        """
+        The first empty square of the line on the board (the only one, for an open line).
+        """
+        return next(position for position in self.combos[line] if board[position] == 0)
@@ -0,0 +1,44 @@
+"""
+keras-rl's Q policies, restricted to legal actions: select_action takes a mask of the legal actions
+along with the Q-values (everything is legal if it is left out), and never picks an illegal one.
+MaskedDQNAgent (see dqn.py) passes them the mask.
+"""
+from typing import Any, Optional
+import numpy as np
+from rl.policy import BoltzmannQPolicy, EpsGreedyQPolicy, GreedyQPolicy, MaxBoltzmannQPolicy
+
+from games.policy import select_legal_actions
+
+
+def _select_action(policy: Any, q_values: np.ndarray, legal: Optional[np.ndarray]) -> int:
+    legal = np.ones(q_values.shape, dtype=bool) if legal is None else legal
+    return int(select_legal_actions(policy, q_values[np.newaxis], legal[np.newaxis])[0])
+
+
+class MaskedGreedyQPolicy(GreedyQPolicy):
+    """
+    >>> MaskedGreedyQPolicy().select_action(np.array([1., 5., 2.]), legal=np.array([True, False, True]))
+    2
+    """
+    def select_action(self, q_values: np.ndarray, legal: Optional[np.ndarray] = None) -> int:
+        return _select_action(self, q_values, legal)
+
+
+class MaskedEpsGreedyQPolicy(EpsGreedyQPolicy):
+    """
+    >>> policy = MaskedEpsGreedyQPolicy(eps=1.)
+    >>> {policy.select_action(np.array([1., 5., 2.]), legal=np.array([True, False, True])) for _ in range(100)}
+    {0, 2}
+    """
+    def select_action(self, q_values: np.ndarray, legal: Optional[np.ndarray] = None) -> int:
+        return _select_action(self, q_values, legal)
+
+
+class MaskedBoltzmannQPolicy(BoltzmannQPolicy):
+    def select_action(self, q_values: np.ndarray, legal: Optional[np.ndarray] = None) -> int:
+        return _select_action(self, q_values, legal)
+
+
+class MaskedMaxBoltzmannQPolicy(MaxBoltzmannQPolicy):
+    def select_action(self, q_values: np.ndarray, legal: Optional[np.ndarray] = None) -> int:
+        return _select_action(self, q_values, legal)
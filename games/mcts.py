@@ -0,0 +1,204 @@
+"""
+A player that looks ahead with Monte Carlo tree search (PUCT, as in AlphaZero), guided by a DQN agent's Q-network.
+
+The network is only run on the positions where the searching player is to move: the softmax of its Q-values for the
+legal moves gives each move's prior, and each Q-value stands for the move's value until the move has been searched.
+The opponent's moves all get the same prior, and are chosen for the searching player's worst outcome.
+Games that end in the tree are scored as the envs reward them.
+
+Leaves are collected a batch at a time (with a virtual loss on the way down, so that they spread out) and evaluated
+in one call of the network. Positions are bitboard states (see nac/bitboard.py and connect4/bitboard.py), which
+play moves without copying a board, and the tree below the position reached is kept for the next search.
+"""
+import time
+from typing import Any, List, Optional, Tuple, Type
+import numpy as np
+
+from games.encoding import OneHotProcessor
+
+LOSS = -2.  # As the envs reward letting the opponent win (and winning is worth 1).
+
+Path = List[Tuple['Node', int]]
+
+
+class Node:
+    """
+    A position in the tree and, once expanded, the statistics of its moves (as arrays, in legal_actions order).
+    Values are the searching player's, whoever is to move.
+    """
+    __slots__ = ('state', 'value', 'outcome', 'actions', 'priors', 'initial_values', 'visits', 'totals', 'children')
+
+    def __init__(self, state: Any, value: float, outcome: Optional[float] = None) -> None:
+        self.state = state
+        self.value = value  # The estimate before searching it: the Q-value of the player's last move.
+        self.outcome = outcome  # The final value, if the game is over.
+        self.actions: Tuple[int, ...] = ()
+        self.priors = self.initial_values = self.totals = np.zeros(0)
+        self.visits = np.zeros(0, dtype=int)
+        self.children: List[Optional['Node']] = []
+
+    def expand(self, actions: Tuple[int, ...], priors: np.ndarray, initial_values: np.ndarray) -> None:
+        self.actions = actions
+        self.priors = priors
+        self.initial_values = initial_values
+        self.visits = np.zeros(len(actions), dtype=int)
+        self.totals = np.zeros(len(actions))
+        self.children = [None] * len(actions)
+
+
+class MCTSPlayer:
+    """
+    Picks moves for whoever is to move on the boards it is given, with the network of the agent for that side
+    (a DQN agent or a NumpyQNetwork: only its processor and compute_batch_q_values are used),
+    and the game's bitboard state class.
+    It can be an env's get_opponent_action, or play as an agent (with play or play_human).
+    Each move is searched for a number of simulations, or until seconds have passed, whichever comes first.
+    exploration weighs the priors against the values searched, and temperature spreads the priors.
+
+    With a network that prefers the top row, it still takes a win, and blocks a loss.
+    >>> from games.nac.bitboard import NacState
+    >>> from games.numpy_network import NumpyQNetwork
+    >>> network = NumpyQNetwork([(np.zeros((27, 9)), np.array([.5, .5, .5, 0, 0, 0, 0, 0, 0]))])
+    >>> player = MCTSPlayer(network, NacState, simulations=100)
+    >>> player(np.array([1, 0, 0, 0, 2, 0, 1, 0, 2]))  # X takes the left column...
+    3
+    >>> player(np.array([1, 0, 0, 2, 2, 0, 0, 1, 0]))  # ...and stops O taking the middle row.
+    5
+    >>> player.evaluations > 0
+    True
+
+    The tree is kept between moves: after X's and O's moves, the search starts from the position it reached.
+    >>> player = MCTSPlayer(network, NacState, simulations=200)
+    >>> board = np.zeros(9, dtype=np.int8)
+    >>> move = player(board)
+    >>> board[move] = 1
+    >>> node = player.root.children[player.root.actions.index(move)]
+    >>> board[node.actions[node.visits.argmax()]] = 2  # O replies with the move searched most.
+    >>> visits = player.find(NacState.from_board(board)).visits.sum()
+    >>> _ = player(board)
+    >>> player.reused, visits > 0
+    (True, True)
+    """
+    def __init__(self, network: Any, state_class: Type[Any], simulations: int = 200, seconds: Optional[float] = None,
+                 batch_size: int = 8, exploration: float = 2., temperature: float = .5) -> None:
+        self.network = network
+        self.state_class = state_class
+        self.simulations = simulations
+        self.seconds = seconds
+        self.batch_size = batch_size
+        self.exploration = exploration
+        self.temperature = temperature
+        # As an agent, it is given raw boards.
+        self.processor = OneHotProcessor(deferred=True)
+        self.training = False
+        self.root: Optional[Node] = None
+        self.reused = False  # Whether the last search started from the tree kept from the one before.
+        self.evaluations = 0  # Positions evaluated by the network, in all.
+
+    def __call__(self, board: Any) -> Any:
+        state = self.state_class.from_board(board)
+        root = self.find(state)
+        self.reused = root is not None
+        if root is None:
+            root = Node(state, 0.)
+        self.root = root
+        start = time.perf_counter()
+        simulations = 0
+        while simulations < self.simulations and (self.seconds is None or time.perf_counter() - start < self.seconds):
+            simulations += self._simulate(root)
+        means = root.totals / np.maximum(root.visits, 1)
+        return max(zip(root.visits.tolist(), means.tolist(), root.actions))[2]
+
+    def act_batch(self, boards: np.ndarray) -> np.ndarray:
+        return np.array([self(board) for board in boards])
+
+    def forward(self, observation: np.ndarray) -> Any:
+        return self(observation)
+
+    def find(self, state: Any) -> Optional[Node]:
+        """
+        The node for the state among the last root's children and grandchildren (or the root itself), if searched.
+        """
+        if self.root is None or self.root.state.mark != state.mark:
+            return None
+        nodes = [self.root]
+        for _ in range(3):
+            for node in nodes:
+                if node.state == state:
+                    return node
+            nodes = [child for node in nodes for child in node.children if child is not None]
+        return None
+
+    def _simulate(self, root: Node) -> int:
+        """
+        Runs a batch of simulations from the root, and returns how many were backed up.
+        """
+        leaves: List[Tuple[Node, Path]] = []
+        backed_up = 0
+        for _ in range(self.batch_size):
+            path, leaf = self._descend(root)
+            if leaf.outcome is None and leaf.state.mark == root.state.mark:
+                if any(leaf is pending for pending, _ in leaves):
+                    self._backup(path, None)
+                    break
+                leaves.append((leaf, path))
+                continue
+            if leaf.outcome is None:
+                # The opponent is to move: all its moves are as likely, and as good as the player's last move.
+                actions = leaf.state.legal_actions()
+                leaf.expand(actions, np.full(len(actions), 1 / len(actions)), np.full(len(actions), leaf.value))
+            self._backup(path, leaf.value if leaf.outcome is None else leaf.outcome)
+            backed_up += 1
+        if leaves:
+            processor = self.network.processor
+            q_values = self.network.compute_batch_q_values(
+                [[processor.process_observation(leaf.state.board())] for leaf, _ in leaves])
+            self.evaluations += len(leaves)
+            for (leaf, path), leaf_q_values in zip(leaves, q_values):
+                actions = leaf.state.legal_actions()
+                values = leaf_q_values[list(actions)].astype(float)
+                priors = np.exp((values - values.max()) / self.temperature)
+                leaf.expand(actions, priors / priors.sum(), values)
+                self._backup(path, values.max())
+            backed_up += len(leaves)
+        return backed_up
+
+    def _descend(self, root: Node) -> Tuple[Path, Node]:
+        """
+        Follows the best moves (by PUCT) down to a position not yet expanded, or the end of a game,
+        with a virtual loss for each move on the way.
+        """
+        mark = root.state.mark
+        path: Path = []
+        node = root
+        while node.outcome is None and node.actions:
+            mine = node.state.mark == mark
+            values = np.where(node.visits > 0, node.totals / np.maximum(node.visits, 1), node.initial_values)
+            scores = (values if mine else -values) + \
+                self.exploration * node.priors * np.sqrt(node.visits.sum() + 1) / (1 + node.visits)
+            index = int(np.argmax(scores))
+            path.append((node, index))
+            node.visits[index] += 1
+            node.totals[index] += LOSS if mine else 1.
+            child = node.children[index]
+            if child is None:
+                state = node.state.play(node.actions[index])
+                outcome = state.outcome()
+                if outcome is not None and not mine:
+                    outcome = LOSS if outcome == 1 else outcome
+                child = node.children[index] = Node(state, node.initial_values[index], outcome)
+            node = child
+        return path, node
+
+    @staticmethod
+    def _backup(path: Path, value: Optional[float]) -> None:
+        """
+        Replaces the virtual losses on the path with the value, or just takes them back (given None).
+        """
+        for node, index in path:
+            virtual_loss = LOSS if node.state.mark == path[0][0].state.mark else 1.
+            if value is None:
+                node.visits[index] -= 1
+                node.totals[index] -= virtual_loss
+            else:
+                node.totals[index] += value - virtual_loss
@@ -0,0 +1,204 @@
+"""
+A replay memory for DQNAgent that stores boards compactly in preallocated arrays.
+
+keras-rl's SequentialMemory keeps every observation as its own numpy array (the one-hot encoding,
+plus the array's overhead) in a deque, which comes to about 420 bytes a transition for Connect 4.
+BoardMemory stores the raw board instead, two bits a square, with actions, rewards and terminals
+in parallel arrays: 17 bytes a transition for Connect 4, and 9 for noughts and crosses.
+Batches are gathered with a single fancy-index and one-hot encoded as a whole.
+
+With n_step, the transitions sampled are n-step ones: the rewards of up to n_step steps, discounted by gamma,
+and the state after them (or the episode's end, if sooner), gathered for the whole batch at once.
+The agent should then discount its next state's Q-value by gamma ** n_step.
+"""
+from typing import Any, List, NamedTuple, Optional, Tuple
+import numpy as np
+from rl.memory import Memory, Experience
+
+SQUARES_PER_BYTE = 4  # Each square is 0, 1 or 2, so fits in two bits.
+SHIFTS = np.arange(0, 8, 2, dtype=np.uint8)
+# Row b is the four squares packed in the byte b, and their one-hot encoding.
+UNPACKED = ((np.arange(256, dtype=np.uint8)[:, np.newaxis] >> SHIFTS) & 3).astype(np.int8)
+UNPACKED_ONE_HOT = np.eye(4, 3, dtype=np.int8)[UNPACKED].reshape(256, -1)  # (3 never occurs in a board)
+
+
+def pack_boards(boards: np.ndarray) -> np.ndarray:
+    """
+    Packs a batch of boards into two bits a square.
+
+    >>> pack_boards(np.array([[0, 1, 2, 1, 2]]))
+    array([[100,   2]], dtype=uint8)
+    """
+    padding = -boards.shape[-1] % SQUARES_PER_BYTE
+    padded = np.pad(boards.astype(np.uint8), [(0, 0)] * (boards.ndim - 1) + [(0, padding)])
+    squares = padded.reshape(boards.shape[:-1] + (-1, SQUARES_PER_BYTE))
+    return np.bitwise_or.reduce(squares << SHIFTS, axis=-1).astype(np.uint8)
+
+
+def unpack_boards(packed: np.ndarray, board_size: int) -> np.ndarray:
+    """
+    >>> unpack_boards(pack_boards(np.array([[0, 1, 2, 1, 2]])), 5)
+    array([[0, 1, 2, 1, 2]], dtype=int8)
+    """
+    return UNPACKED[packed].reshape(packed.shape[:-1] + (-1,))[..., :board_size]
+
+
+class ExperienceBatch(NamedTuple):
+    state0: np.ndarray  # (batch, window_length, observation size)
+    action: np.ndarray
+    reward: np.ndarray
+    state1: np.ndarray
+    terminal1: np.ndarray
+
+
+class BoardMemory(Memory):
+    """
+    A drop-in replacement for SequentialMemory (with window_length=1), for board games.
+    The observations it is given are the processed ones: one-hot encoded boards if one_hot is set
+    (as the games' processors give), otherwise raw boards. It gives back the same in its samples.
+
+    It samples the same transitions SequentialMemory would, never across the end of an episode.
+    >>> memory = BoardMemory(limit=5, board_size=3, one_hot=False)
+    >>> for step in range(6):
+    ...     memory.append(np.array([step % 3, 0, 1]), action=step, reward=step / 2, terminal=step == 2)
+    >>> memory.nb_entries
+    5
+    >>> batch = memory.sample_batch(2, batch_idxs=[1, 3])
+    >>> batch.state0[:, 0], batch.action, batch.reward, batch.terminal1, batch.state1[:, 0]
+    (array([[2, 0, 1],
+           [1, 0, 1]], dtype=int8), array([2, 4]), array([1., 2.], dtype=float32), array([ True, False]), array([[0, 0, 1],
+           [2, 0, 1]], dtype=int8))
+    >>> sorted(set(memory.sample_batch(50).action))  # Not 3, whose board follows the episode's final one.
+    [2, 4]
+
+    With n_step=2, the rewards of two steps are summed, unless the episode ends after the first.
+    >>> memory = BoardMemory(limit=10, board_size=3, one_hot=False, n_step=2, gamma=.5)
+    >>> for step in range(7):
+    ...     memory.append(np.array([step % 3, 0, 1]), action=step, reward=step, terminal=step == 2)
+    >>> batch = memory.sample_batch(3, batch_idxs=[1, 2, 4])
+    >>> batch.reward, batch.terminal1, batch.state1[:, 0, 0]
+    (array([2. , 2. , 6.5], dtype=float32), array([ True,  True, False]), array([0, 0, 0], dtype=int8))
+    """
+    def __init__(self, limit: int, board_size: int, one_hot: bool = True, n_step: int = 1, gamma: float = .99,
+                 **kwargs: Any) -> None:
+        kwargs.setdefault('window_length', 1)
+        super().__init__(**kwargs)
+        if self.window_length != 1:
+            raise ValueError('BoardMemory only supports window_length=1')
+        self.limit = limit
+        self.board_size = board_size
+        self.one_hot = one_hot
+        self.n_step = n_step
+        self.gamma = gamma  # Only used to discount the rewards of n-step transitions (keras-rl's default).
+        self.boards = np.zeros((limit, -(-board_size // SQUARES_PER_BYTE)), dtype=np.uint8)
+        self.actions = np.zeros(limit, dtype=np.uint8)
+        self.rewards = np.zeros(limit, dtype=np.float32)
+        self.terminals = np.zeros(limit, dtype=bool)
+        self.next_index = 0
+        self.size = 0
+
+    @property
+    def nb_entries(self) -> int:
+        return self.size
+
+    def append(self, observation: np.ndarray, action: int, reward: float, terminal: bool, training: bool = True) -> None:
+        super().append(observation, action, reward, terminal, training=training)
+        if not training:
+            return
+        self.append_board(self.board(observation), action, reward, terminal)
+
+    def board(self, observation: np.ndarray) -> np.ndarray:
+        """
+        The raw board of a processed observation.
+        """
+        board = np.asarray(observation)
+        return board.reshape(self.board_size, 3).argmax(axis=1) if self.one_hot else board
+
+    def append_board(self, board: np.ndarray, action: int, reward: float, terminal: bool) -> None:
+        """
+        Stores a transition given the raw board, rather than the processed observation.
+        """
+        self.boards[self.next_index] = pack_boards(board[np.newaxis])[0]
+        self.actions[self.next_index] = action
+        self.rewards[self.next_index] = reward
+        self.terminals[self.next_index] = terminal
+        self.next_index = (self.next_index + 1) % self.limit
+        self.size = min(self.size + 1, self.limit)
+
+    def _positions(self, entries: np.ndarray) -> np.ndarray:
+        """
+        Where the given entries (counting from the oldest) are in the arrays.
+        """
+        start = self.next_index if self.size == self.limit else 0
+        return (start + entries) % self.limit
+
+    def _sample_entries(self, batch_size: int) -> np.ndarray:
+        """
+        Picks entries to use as state0, with n_step following entries, that don't start a new episode.
+        As SequentialMemory does, the first entry is never used, as it isn't known whether it starts an episode.
+        """
+        assert self.size >= self.n_step + 2, 'not enough entries in the memory'
+        # Up to half of the entries can follow an episode's final one (as agent.fit stores the final observation too),
+        # so only with twice the batch's entries to choose from are there sure to be enough for no repeats.
+        unique = (self.size - self.n_step - 1) // 2 >= batch_size
+        entries = np.random.randint(1, self.size - self.n_step, size=batch_size)
+        while True:
+            # The entry after an episode's final board is the start of the next episode: pick again.
+            invalid = self.terminals[self._positions(entries - 1)]
+            if unique:
+                # As in SequentialMemory, there are no repeats if there are enough entries to choose from.
+                _, first = np.unique(entries, return_index=True)
+                repeated = np.ones(batch_size, dtype=bool)
+                repeated[first] = False
+                invalid |= repeated
+            if not invalid.any():
+                return entries
+            entries[invalid] = np.random.randint(1, self.size - self.n_step, size=invalid.sum())
+
+    def _observations(self, packed: np.ndarray) -> np.ndarray:
+        if not self.one_hot:
+            return unpack_boards(packed, self.board_size)[:, np.newaxis]
+        return UNPACKED_ONE_HOT[packed].reshape(len(packed), 1, -1)[..., :self.board_size * 3]
+
+    def _returns(self, entries: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The discounted rewards of the n_step transitions from each entry (fewer if the episode ends first),
+        the entry of the state after them, and whether the episode ended.
+        """
+        if self.n_step == 1:
+            positions = self._positions(entries)
+            return self.rewards[positions], entries + 1, self.terminals[positions]
+        steps = np.arange(self.n_step)
+        positions = self._positions(entries[:, np.newaxis] + steps)
+        terminals = self.terminals[positions]
+        # Only the steps up to the episode's end count: those with no terminal before them.
+        counted = np.cumsum(terminals, axis=1) - terminals == 0
+        rewards = (self.rewards[positions] * counted) @ (self.gamma ** steps).astype(np.float32)
+        return rewards, entries + counted.sum(axis=1), terminals.any(axis=1)
+
+    def sample_batch(self, batch_size: int, batch_idxs: Optional[Any] = None) -> ExperienceBatch:
+        """
+        A random batch of transitions, as arrays.
+        batch_idxs are as for SequentialMemory.sample: the entries (counting from the oldest) to use as state0.
+        """
+        entries = self._sample_entries(batch_size) if batch_idxs is None else np.asarray(batch_idxs)
+        positions = self._positions(entries)
+        rewards, next_entries, terminals = self._returns(entries)
+        return ExperienceBatch(self._observations(self.boards[positions]), self.actions[positions].astype(int),
+                               rewards, self._observations(self.boards[self._positions(next_entries)]), terminals)
+
+    def sample(self, batch_size: int, batch_idxs: Optional[Any] = None) -> List[Experience]:
+        """
+        A random batch of transitions, as DQNAgent expects them.
+        """
+        batch = self.sample_batch(batch_size, batch_idxs)
+        return [Experience(*transition) for transition in zip(*batch)]
+
+    def get_config(self) -> dict:
+        config = super().get_config()
+        config['limit'] = self.limit
+        config['board_size'] = self.board_size
+        config['one_hot'] = self.one_hot
+        config['n_step'] = self.n_step
+        config['gamma'] = self.gamma
+        return config
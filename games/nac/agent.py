@@ -1,59 +1,128 @@
-from typing import Type, Tuple
+from typing import Any, List, Optional, Type, Tuple
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Dense, Flatten
 from tensorflow.keras.optimizers import Adam
 
-from rl.agents.dqn import DQNAgent
 from rl.core import Agent
-from rl.policy import EpsGreedyQPolicy
-from rl.memory import SequentialMemory
+from rl.policy import EpsGreedyQPolicy, GreedyQPolicy
 
 from gym import Env
 
 from games.nac.env import NacEnv, NacSecondPlayerEnv
 from games.nac.processor import NacProcessor
-
-
-def get_dqn_agent(env: Env) -> Agent:
+from games.nac.solver import Evaluation, evaluate
+from games.nac.symmetry import SYMMETRIES
+from games.nac.vector_env import VectorNacEnv, VectorNacSecondPlayerEnv, legal_action_mask
+from games.dqn import MaskedDQNAgent, PrioritizedDQNAgent, PrioritizedMaskedDQNAgent, VersionedDQNAgent
+from games.masked_policy import MaskedEpsGreedyQPolicy, MaskedGreedyQPolicy
+from games.memory import BoardMemory
+from games.numpy_dqn import get_numpy_dqn_agent
+from games.prioritized import PrioritizedBoardMemory, PrioritizedSymmetricMemory
+from games.symmetry import SymmetricMemory
+from games.opponent import CACHE_SIZE, BatchedOpponent
+from games.rollout import ParallelRollouts, train_parallel
+
+VECTOR_ENVS = {NacEnv: VectorNacEnv, NacSecondPlayerEnv: VectorNacSecondPlayerEnv}
+
+
+def get_dqn_agent(env: Env, augment: bool = True, mask_illegal: bool = True, perspective: bool = False,
+                  layer_size: int = 27, memory_limit: int = 50000, nb_steps_warmup: int = 100,
+                  target_model_update: float = 1e-2, learning_rate: float = 1e-3, prioritized: bool = False,
+                  batch_size: int = 32, train_interval: int = 1, gradient_steps: int = 1, n_step: int = 1,
+                  backend: str = 'keras') -> Agent:
     """
+    With mask_illegal, the agent only ever picks legal moves (and only learns from legal moves in the next state);
+    otherwise it has to learn not to play in taken squares.
+    With perspective, the network sees the squares as its own and its opponent's, rather than X's and O's
+    (so it could play either side).
+    With prioritized, transitions are replayed by priority (see prioritized.py) rather than uniformly.
+    It trains every train_interval steps on a batch of batch_size transitions (gradient_steps batches, one after
+    the other, with backend='numpy'), of n_step steps each (see memory.py).
+    With backend='numpy', the agent is a NumpyDQNAgent (see numpy_dqn.py), trained without TensorFlow.
+    The rest are the hyperparameters: the hidden layer's size, the replay memory's, and keras-rl's and Adam's settings.
+
     >>> env = NacEnv()
     >>> agent = get_dqn_agent(env)
     >>> agent.layers[1].weights[0].shape
     TensorShape([27, 27])
     >>> agent.layers[2].weights[0].shape
     TensorShape([27, 9])
+
+    It only picks legal moves when tested, too.
+    >>> import numpy as np
+    >>> agent.training = False
+    >>> agent.forward(agent.processor.process_observation(np.array([1, 2, 1, 2, 1, 2, 0, 1, 2])))
+    6
     """
+    if backend == 'numpy':
+        return get_numpy_dqn_agent(env, augment, mask_illegal, perspective, layer_size, memory_limit, nb_steps_warmup,
+                                   target_model_update, learning_rate, prioritized, batch_size, train_interval,
+                                   gradient_steps, n_step)
+    if gradient_steps != 1:
+        raise ValueError('keras-rl trains on one batch at a time: gradient_steps needs the numpy backend')
     nb_actions = env.action_space.n
 
     model = Sequential([
         Flatten(input_shape=(1,) + env.observation_space.shape),
-        Dense(27, activation='relu'),
+        Dense(layer_size, activation='relu'),
         Dense(nb_actions, activation='linear'),
     ])
 
-    memory = SequentialMemory(limit=50000, window_length=1)
-    policy = EpsGreedyQPolicy(eps=0.2)
-    processor = NacProcessor()
-    dqn = DQNAgent(model=model,
-                   processor=processor,
-                   nb_actions=nb_actions,
-                   memory=memory,
-                   nb_steps_warmup=100,
-                   target_model_update=1e-2,
-                   policy=policy)
-    dqn.compile(Adam(lr=1e-3), metrics=['mae'])
+    # With augment, every move is also learnt in its symmetric positions.
+    # The processor encodes whole batches of raw boards as they are sampled, so the memory holds raw boards.
+    if prioritized:
+        memory = PrioritizedSymmetricMemory(limit=memory_limit, board_size=9, symmetries=SYMMETRIES, one_hot=False,
+                                            n_step=n_step) if augment \
+            else PrioritizedBoardMemory(limit=memory_limit, board_size=9, one_hot=False, n_step=n_step)
+    else:
+        memory = SymmetricMemory(limit=memory_limit, board_size=9, symmetries=SYMMETRIES, one_hot=False,
+                                 n_step=n_step) if augment \
+            else BoardMemory(limit=memory_limit, board_size=9, one_hot=False, n_step=n_step)
+    policy = MaskedEpsGreedyQPolicy(eps=0.2) if mask_illegal else EpsGreedyQPolicy(eps=0.2)
+    test_policy = MaskedGreedyQPolicy() if mask_illegal else GreedyQPolicy()
+    processor = NacProcessor(perspective=perspective, deferred=True)
+    if prioritized:
+        agent_class = PrioritizedMaskedDQNAgent if mask_illegal else PrioritizedDQNAgent
+    else:
+        agent_class = MaskedDQNAgent if mask_illegal else VersionedDQNAgent
+    dqn = agent_class(model=model,
+                      processor=processor,
+                      nb_actions=nb_actions,
+                      memory=memory,
+                      gamma=memory.gamma ** n_step,
+                      batch_size=batch_size,
+                      nb_steps_warmup=nb_steps_warmup,
+                      train_interval=train_interval,
+                      target_model_update=target_model_update,
+                      policy=policy,
+                      test_policy=test_policy)
+    dqn.compile(Adam(lr=learning_rate), metrics=['mae'])
     return dqn
 
 
-def train_agent(env: Env, agent: Agent, steps: int = 10000) -> Agent:
-    agent.fit(env, nb_steps=steps, visualize=False, verbose=1)
+def train_agent(env: Env, agent: Agent, steps: int = 10000, rollouts: Optional[ParallelRollouts] = None,
+                callbacks: Optional[List[Any]] = None, verbose: int = 1) -> Agent:
+    """
+    Trains the agent in the env (against a random opponent, if the env has none) or, given rollouts,
+    on the same kind of games played in its worker processes.
+    The keras-rl callbacks are only used when training in the env.
+    """
+    if rollouts is None:
+        agent.fit(env, nb_steps=steps, visualize=False, verbose=verbose, callbacks=callbacks)
+    else:
+        train_parallel(agent, VECTOR_ENVS[type(env)], rollouts, steps, verbose=verbose > 0)
     return agent
 
 
-def train_against(trainee: Agent, trainee_env: Type[Env], opponent: Agent, steps: int = 10000) -> Env:
+def train_against(trainee: Agent, trainee_env: Type[Env], opponent: Agent, steps: int = 10000,
+                  rollouts: Optional[ParallelRollouts] = None, callbacks: Optional[List[Any]] = None,
+                  verbose: int = 1) -> Env:
     opponent.training = True  # So that it still takes random choices occasionally when played against.
-    env = trainee_env(get_opponent_action=lambda board: opponent.forward(opponent.processor.process_observation(board)))
-    train_agent(env, trainee, steps)
+    env = trainee_env(get_opponent_action=BatchedOpponent(opponent, legal_action_mask, cache_size=CACHE_SIZE))
+    if rollouts is None:
+        train_agent(env, trainee, steps, callbacks=callbacks, verbose=verbose)
+    else:
+        train_parallel(trainee, VECTOR_ENVS[trainee_env], rollouts, steps, opponent, verbose=verbose > 0)
     return env
 
 
@@ -70,8 +139,8 @@ def load_agents(path_base: str) -> Tuple[Agent, Env, Agent, Env]:
 
 def save_agents(path_base: str, agent1: Agent, agent2: Agent) -> None:
     path_ext = '.hdf5'
-    agent1.save_weights(f'{path_base}-1{path_ext}')
-    agent2.save_weights(f'{path_base}-2{path_ext}')
+    agent1.save_weights(f'{path_base}-1{path_ext}', overwrite=True)
+    agent2.save_weights(f'{path_base}-2{path_ext}', overwrite=True)
 
 
 def play(env: Env, agent: Agent) -> None:
@@ -87,3 +156,12 @@ def play(env: Env, agent: Agent) -> None:
         env.render()
         print(f"{'Game over' if done else ''} Reward: {reward} {info}\n")
         step += 1
+
+
+def test(agent: Agent, player: int) -> Evaluation:
+    """
+    Checks the agent's moves against perfect play, in every position it could face, and prints how it did.
+    """
+    evaluation = evaluate(agent, player)
+    print(f'  {evaluation}')
+    return evaluation
@@ -0,0 +1,72 @@
+"""
+A bitboard encoding of the noughts and crosses board: each player's marks as the bits of an int, bit n for square n.
+"""
+from typing import NamedTuple, Optional, Tuple
+import numpy as np
+
+from .env import NacEnv
+from .types import Action, Board
+
+BOARD_MASK = (1 << 9) - 1
+DRAW_REWARD = 0.  # As NacEnv gives.
+LINE_MASKS = tuple(sum(1 << square for square in combo) for combo in NacEnv.winning_combos)
+SHIFTS = np.arange(9)
+
+
+def from_board(board: Board, mark: int) -> int:
+    """
+    >>> from_board(np.array([1, 0, 0, 0, 2, 0, 0, 0, 1]), 1) == 0b100000001
+    True
+    """
+    return sum(1 << square for square in np.flatnonzero(board == mark).tolist())
+
+
+def has_line(bitboard: int) -> bool:
+    return any(bitboard & line == line for line in LINE_MASKS)
+
+
+class NacState(NamedTuple):
+    """
+    A position as bitboards, for searching without copying the env's board: play returns a new state.
+
+    >>> state = NacState.from_board(np.zeros(9, dtype=np.int8))
+    >>> for square in (0, 3, 1, 4):
+    ...     state = state.play(square)
+    >>> state.mark, state.legal_actions(), state.outcome(), state.play(2).outcome()
+    (1, (2, 5, 6, 7, 8), None, 1.0)
+    >>> NacState.from_board(state.board()) == state, state.board().tolist()
+    (True, [1, 1, 0, 2, 2, 0, 0, 0, 0])
+    """
+    current: int  # The marks of the player to move.
+    occupied: int
+    mark: int  # Of the player to move: 1 or 2.
+
+    @classmethod
+    def from_board(cls, board: Board) -> 'NacState':
+        mark = 1 if (board == 1).sum() == (board == 2).sum() else 2
+        return cls(from_board(board, mark), from_board(board, 1) | from_board(board, 2), mark)
+
+    def legal_actions(self) -> Tuple[Action, ...]:
+        return tuple(Action(square) for square in range(9) if not self.occupied >> square & 1)
+
+    def play(self, action: Action) -> 'NacState':
+        return NacState(self.current ^ self.occupied, self.occupied | 1 << action, 3 - self.mark)
+
+    def lost(self) -> bool:
+        """
+        Whether the player who just moved has won.
+        """
+        return has_line(self.current ^ self.occupied)
+
+    def outcome(self) -> Optional[float]:
+        """
+        The reward for the player who just moved, as NacEnv gives it, if the game is over (and None if not).
+        """
+        if self.lost():
+            return 1.
+        return DRAW_REWARD if self.occupied == BOARD_MASK else None
+
+    def board(self) -> Board:
+        first = self.current if self.mark == 1 else self.current ^ self.occupied
+        second = self.occupied ^ first
+        return Board((((first >> SHIFTS) & 1) + 2 * ((second >> SHIFTS) & 1)).astype(np.int8))
@@ -5,6 +5,7 @@ import numpy as np
 from gym import spaces, Env
 from gym.utils import seeding
 
+from games.lines import LineCounts
 from .types import Action, Board
 
 
@@ -16,6 +17,10 @@ class NacEnv(Env):
     [0, 1, 2,
      3, 4, 5,
      6, 7, 8]
+
+    Each player's marks on each winning line are counted as they are played (see games/lines.py),
+    so a win or a threat is found from the lines through the last move.
+    Assign a whole board to self.board (rather than changing it in place) to start from another position.
     """
     reward_range = (-np.inf, np.inf)
     observation_space = spaces.MultiBinary(9 * 3)
@@ -40,8 +45,18 @@ class NacEnv(Env):
         self.get_opponent_action = get_opponent_action or default_get_action
         # Both of these encode the state, and are mutable.
         self.current_player: Literal[0, 1] = 0
+        self.lines = LineCounts(self.winning_combos, 9)
         self.board = np.zeros(9, dtype="int")
 
+    @property
+    def board(self) -> np.ndarray:
+        return self._board
+
+    @board.setter
+    def board(self, board: np.ndarray) -> None:
+        self._board = board
+        self.lines.reset(board)
+
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
         self.action_space.seed(seed)
@@ -68,6 +83,22 @@ class NacEnv(Env):
         """
         return self.board[action] == 0
 
+    def legal_action_mask(self) -> np.ndarray:
+        """
+        Which squares are still free.
+
+        >>> env = NacEnv()
+        >>> obs = env.reset()
+        >>> _ = env.step(0)
+        >>> env.render()
+        X••
+        •O•
+        •••
+        >>> env.legal_action_mask().astype(int)
+        array([0, 1, 1, 1, 0, 1, 1, 1, 1])
+        """
+        return self.board == 0
+
     def _can_other_player_win_next(self) -> bool:
         """
         >>> env = NacEnv()
@@ -95,12 +126,8 @@ class NacEnv(Env):
         >>> env._can_other_player_win_next()
         True
         """
-        for combo in self.winning_combos:
-            # Looking for two spaces in the combo claimed by the other player, and one empty space.
-            if (self.board[list(combo)] == 2 - self.current_player).sum() == 2 \
-                    and (self.board[list(combo)] == 0).sum() == 1:
-                return True
-        return False
+        # Looking for a line with two spaces claimed by the other player, and one empty space.
+        return bool(self.lines.open[1 - self.current_player])
 
     def _has_current_player_won(self) -> bool:
         """
@@ -118,10 +145,7 @@ class NacEnv(Env):
         >>> env._has_current_player_won()
         True
         """
-        for combo in self.winning_combos:
-            if (self.board[list(combo)] == self.current_player + 1).all():
-                return True
-        return False
+        return self.lines.won[self.current_player]
 
     def _is_board_full_next(self) -> bool:
         """
@@ -137,6 +161,13 @@ class NacEnv(Env):
         """
         return (self.board != 0).sum() >= 8
 
+    def mark(self, action: Action) -> None:
+        """
+        Puts the current player's mark in the square.
+        """
+        self.board[action] = self.current_player + 1
+        self.lines.add(action, self.current_player)
+
     def step(self, action: Action) -> Tuple[Board, float, bool, dict]:
         """
         Run one timestep of the environment's dynamics.
@@ -159,7 +190,7 @@ class NacEnv(Env):
             done = True
             return self.board, reward, done, info
 
-        self.board[action] = self.current_player + 1
+        self.mark(action)
 
         if self._has_current_player_won():
             reward = 1
@@ -192,7 +223,7 @@ class NacEnv(Env):
             opponent_action = self.get_opponent_action(self.board)
             while not self._is_legal(opponent_action):
                 opponent_action = self.get_opponent_action(self.board)
-            self.board[opponent_action] = self.current_player + 1
+            self.mark(opponent_action)
             # And return to the original player's turn.
             self.current_player = 1 - self.current_player
 
@@ -216,6 +247,6 @@ class NacSecondPlayerEnv(NacEnv):
         """
         super().reset()
         opponent_action = self.get_opponent_action(self.board)
-        self.board[opponent_action] = self.current_player + 1
+        self.mark(opponent_action)
         self.current_player = 1 - self.current_player
         return self.board
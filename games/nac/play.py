@@ -1,9 +1,17 @@
+import argparse
 import os
 from games.nac.env import NacEnv, NacSecondPlayerEnv
-from games.nac.agent import train_against, train_agent, load_agents, get_dqn_agent, play, save_agents
+from games.nac.agent import train_against, train_agent, load_agents, get_dqn_agent, play, save_agents, test
 from games.nac.play_human import play_human
+from games.rollout import ParallelRollouts
 
 if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Train noughts and crosses agents, and play against them.')
+    PARSER.add_argument('--workers', type=int, default=0,
+                        help='collect training games in this many worker processes (0 to play them in this one)')
+    ARGS = PARSER.parse_args()
+    ROLLOUTS = ParallelRollouts(ARGS.workers) if ARGS.workers else None
+
     SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
     WORDS = ['']
     while WORDS[0] not in ('load', 'new'):
@@ -21,6 +29,10 @@ Your choice? """)
         except IndexError:
             pass
         agent_1, env_1, agent_2, env_2 = load_agents(os.path.join(SCRIPT_PATH, 'weights', FILENAME))
+        print('Testing player 1')
+        test(agent_1, player=0)
+        print('Testing player 2')
+        test(agent_2, player=1)
     else:
         ROUNDS = 10
         try:
@@ -36,21 +48,24 @@ Your choice? """)
         print()
         print(f'Round 1 of {ROUNDS}')
         print('Training player 1')
-        agent_1 = train_agent(env_1, agent_1)
-        play(env_1, agent_1)
+        agent_1 = train_agent(env_1, agent_1, rollouts=ROLLOUTS)
+        test(agent_1, player=0)
         print('Training player 2')
-        agent_2 = train_agent(env_2, agent_2)
-        play(env_2, agent_2)
+        agent_2 = train_agent(env_2, agent_2, rollouts=ROLLOUTS)
+        test(agent_2, player=1)
 
         for i in range(ROUNDS - 1):
             print()
             print(f'Round {i + 2} of {ROUNDS}')
             print('Training player 1')
-            env_1 = train_against(agent_1, NacEnv, agent_2)
-            play(env_1, agent_1)
+            env_1 = train_against(agent_1, NacEnv, agent_2, rollouts=ROLLOUTS)
+            test(agent_1, player=0)
             print('Training player 2')
-            env_2 = train_against(agent_2, NacSecondPlayerEnv, agent_1)
-            play(env_2, agent_2)
+            env_2 = train_against(agent_2, NacSecondPlayerEnv, agent_1, rollouts=ROLLOUTS)
+            test(agent_2, player=1)
+
+        if ROLLOUTS is not None:
+            ROLLOUTS.close()
 
         print('Saving weights for trained agents')
         save_agents(os.path.join(SCRIPT_PATH, 'weights', 'temp'), agent_1, agent_2)
@@ -1,11 +1,13 @@
 import sys
-from typing import Optional, Type
+from typing import TYPE_CHECKING, Optional, Type
 from gym.core import Env
-from rl.core import Agent
 
 from games.nac.types import Board, Action
 from games.nac.env import MARKS
 
+if TYPE_CHECKING:  # So that get_human_action can be used without loading TensorFlow (see games/server.py).
+    from rl.core import Agent
+
 def to_int(s: str) -> Optional[int]:
     """
     >>> to_int('foo')
@@ -30,7 +32,7 @@ def get_human_action(board: Board) -> Action:
     return to_int(user_input)
 
 
-def play_human(env_class: Type[Env], agent: Agent) -> None:
+def play_human(env_class: Type[Env], agent: 'Agent') -> None:
     env = env_class(get_opponent_action=get_human_action)
     done = False
     observation = env.reset()
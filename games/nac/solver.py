@@ -0,0 +1,217 @@
+"""
+Solves noughts and crosses exactly, and scores agents against perfect play.
+
+Every position is numbered by reading the board as a base 3 number (board_index),
+and the value of each position reachable from an empty board, for the player to move,
+is worked out once by negamax and kept in a (2, 3 ** 9) int8 table indexed by [current_player, board_index]:
+1 if the player to move can force a win, 0 for a draw, and -1 if they lose whatever they do.
+A position where the game is already over has the value -1 if it was won (by the other player) or 0 if it is a draw.
+"""
+from functools import lru_cache
+from typing import Any, Dict, NamedTuple, Optional, Union
+import numpy as np
+
+from .env import NacEnv
+
+NUM_POSITIONS = 3 ** 9
+POWERS = 3 ** np.arange(9)
+COMBOS = np.array(NacEnv.winning_combos)
+UNREACHABLE = -128
+WIN, DRAW, LOSS = 1, 0, -1
+
+
+def board_index(boards: np.ndarray) -> np.ndarray:
+    """
+    The number of each board, reading its squares as the digits of a base 3 number (the first square is the 1s).
+
+    >>> board_index(np.array([[0, 0, 0, 0, 0, 0, 0, 0, 0], [2, 1, 0, 0, 0, 0, 0, 0, 1]]))
+    array([   0, 6566])
+    """
+    return np.asarray(boards, dtype=np.int64) @ POWERS
+
+
+def index_board(index: Union[int, np.ndarray]) -> np.ndarray:
+    """
+    The board numbered index, or the boards of a column of indices.
+
+    >>> index_board(6566)
+    array([2, 1, 0, 0, 0, 0, 0, 0, 1], dtype=int8)
+    """
+    return (index // POWERS % 3).astype(np.int8)
+
+
+def _is_won(board: np.ndarray, mark: int) -> bool:
+    return bool((board[COMBOS] == mark).all(axis=1).any())
+
+
+@lru_cache(maxsize=None)
+def solve() -> np.ndarray:
+    """
+    The value table, computed the first time it is needed.
+
+    There are 5478 positions that can come up in a game, and with perfect play it is a draw.
+    >>> values = solve()
+    >>> int((values != UNREACHABLE).sum()), int(values[0, 0])
+    (5478, 0)
+
+    After X opens in a corner, O can hold the draw in the centre, but not on the edge next to X.
+    >>> int(values[0, board_index([1, 0, 0, 0, 2, 0, 0, 0, 0])]), int(values[0, board_index([1, 2, 0, 0, 0, 0, 0, 0, 0])])
+    (0, 1)
+    """
+    values = np.full((2, NUM_POSITIONS), UNREACHABLE, dtype=np.int8)
+
+    def negamax(board: np.ndarray, index: int, player: int) -> int:
+        if values[player, index] != UNREACHABLE:
+            return int(values[player, index])
+        if _is_won(board, 2 - player):
+            value = LOSS
+        elif (board != 0).all():
+            value = DRAW
+        else:
+            value = LOSS
+            for action in np.flatnonzero(board == 0):
+                board[action] = player + 1
+                value = max(value, -negamax(board, index + (player + 1) * int(POWERS[action]), 1 - player))
+                board[action] = 0
+        values[player, index] = value
+        return value
+
+    negamax(np.zeros(9, dtype=np.int8), 0, 0)
+    return values
+
+
+def action_values(boards: np.ndarray, players: np.ndarray) -> np.ndarray:
+    """
+    The value of each action for the player to move, with perfect play afterwards, for a batch of boards.
+    Illegal actions are -inf.
+
+    >>> action_values(np.array([[1, 1, 0, 2, 2, 0, 0, 0, 0]]), np.array([0]))
+    array([[-inf, -inf,   1., -inf, -inf,   0.,  -1.,  -1.,  -1.]])
+    """
+    boards = np.asarray(boards)
+    players = np.asarray(players)
+    values = solve()
+    free = boards == 0
+    children = board_index(boards)[:, np.newaxis] + free * (players[:, np.newaxis] + 1) * POWERS
+    child_values = (-values[1 - players[:, np.newaxis], children]).astype(float)
+    return np.where(free, child_values, -np.inf)
+
+
+def current_players(boards: np.ndarray) -> np.ndarray:
+    """
+    Whose turn it is on each board: player 0 (with mark 1) always moves first.
+    """
+    return ((boards != 0).sum(axis=-1) % 2).astype(int)
+
+
+class PerfectPlayer:
+    """
+    Plays one of the best moves at random, as an env's get_opponent_action (or act_batch as a vector env's).
+
+    >>> PerfectPlayer()(np.array([1, 1, 0, 2, 2, 0, 0, 0, 0]))
+    2
+    """
+    def __init__(self, random_state: Optional[Any] = None) -> None:
+        self.random_state = np.random.RandomState(0) if random_state is None else random_state
+
+    def act_batch(self, boards: np.ndarray) -> np.ndarray:
+        values = action_values(boards, current_players(boards))
+        best = values == values.max(axis=1, keepdims=True)
+        return np.argmax(self.random_state.random_sample(best.shape) * best, axis=1)
+
+    def __call__(self, board: np.ndarray) -> int:
+        return int(self.act_batch(board[np.newaxis])[0])
+
+
+@lru_cache(maxsize=None)
+def positions_to_play(player: int) -> np.ndarray:
+    """
+    The indices of every reachable position where the player is to move and the game isn't over.
+
+    >>> len(positions_to_play(0)), len(positions_to_play(1))
+    (2423, 2097)
+    """
+    values = solve()
+    indices = np.flatnonzero(values[player] != UNREACHABLE)
+    boards = index_board(indices[:, np.newaxis])
+    lines = boards[:, COMBOS]
+    over = (lines == 2 - player).all(axis=2).any(axis=1) | (boards != 0).all(axis=1)
+    return indices[~over]
+
+
+class Evaluation(NamedTuple):
+    positions: int  # The positions the agent could be asked to move in.
+    optimal: int  # How many of those it plays a best move in.
+    blunders: int  # How many it plays a move that gives away a win or a draw (as opposed to a win by a longer route).
+    illegal: int  # How many it plays an illegal move in.
+    outcome: int  # The result for the agent from the start, against the perfect player's most damaging choice of best moves.
+
+    def __str__(self) -> str:
+        outcome = {WIN: 'wins', DRAW: 'draws', LOSS: 'loses'}[self.outcome]
+        return f'best move in {self.optimal}/{self.positions} positions ({self.blunders} blunders, ' \
+               f'{self.illegal} illegal); {outcome} against perfect play'
+
+
+def evaluate(agent: Any, player: int) -> Evaluation:
+    """
+    Scores the agent's greedy moves (the action with the highest Q-value, legal or not unless agent.mask_illegal
+    is set) as the given player, in every position it could face, in one batch.
+    The agent needs a processor and compute_batch_q_values, as keras-rl's DQNAgent has.
+
+    A player that always takes the first free square only plays the best move sometimes.
+    >>> class FirstFree:
+    ...     class processor:
+    ...         process_observation = staticmethod(lambda board: board)
+    ...     def compute_batch_q_values(self, state_batch):
+    ...         return (np.array(state_batch)[:, 0] == 0) * np.arange(9, 0, -1)
+    >>> print(evaluate(FirstFree(), player=0))
+    best move in 1440/2423 positions (983 blunders, 0 illegal); loses against perfect play
+    """
+    indices = positions_to_play(player)
+    boards = index_board(indices[:, np.newaxis])
+    process_observation = agent.processor.process_observation
+    q_values = agent.compute_batch_q_values([[process_observation(board)] for board in boards])
+    if getattr(agent, 'mask_illegal', False):
+        q_values = np.where(boards == 0, q_values, -np.inf)
+    actions = np.argmax(q_values, axis=1)
+
+    values = action_values(boards, np.full(len(boards), player))
+    chosen = values[np.arange(len(boards)), actions]
+    best = values.max(axis=1)
+    agent_actions = dict(zip(indices.tolist(), actions.tolist()))
+    return Evaluation(positions=len(indices),
+                      optimal=int((chosen == best).sum()),
+                      blunders=int(((chosen < best) & (chosen != -np.inf)).sum()),
+                      illegal=int((chosen == -np.inf).sum()),
+                      outcome=_outcome(agent_actions, player, np.zeros(9, dtype=np.int8), 0, {}))
+
+
+def _outcome(agent_actions: Dict[int, int], player: int, board: np.ndarray, to_move: int, cache: Dict[int, int]) -> int:
+    """
+    The result for the agent from this position, if it plays agent_actions and its opponent plays
+    whichever of its best moves is worst for the agent. An illegal move loses.
+    """
+    index = int(board_index(board))
+    if index in cache:
+        return cache[index]
+    if _is_won(board, 2 - to_move):
+        result = LOSS if to_move == player else WIN
+    elif (board != 0).all():
+        result = DRAW
+    else:
+        if to_move == player:
+            actions = [agent_actions[index]]
+        else:
+            values = action_values(board[np.newaxis], np.array([to_move]))[0]
+            actions = np.flatnonzero(values == values.max()).tolist()
+        results = []
+        for action in actions:
+            if board[action] != 0:
+                results.append(LOSS)
+                continue
+            board[action] = to_move + 1
+            results.append(_outcome(agent_actions, player, board, 1 - to_move, cache))
+            board[action] = 0
+        result = min(results)
+    cache[index] = result
+    return result
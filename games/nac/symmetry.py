@@ -0,0 +1,24 @@
+"""
+Noughts and crosses is the same game rotated or reflected: the 8 symmetries of the square.
+
+>>> board = np.array([1, 2, 0, 0, 0, 0, 0, 0, 0])
+>>> len({tuple(symmetric) for symmetric in SYMMETRIES.boards(board)})
+8
+>>> SYMMETRIES.canonical(np.array([[0, 0, 2, 0, 0, 1, 0, 0, 0], [2, 1, 0, 0, 0, 0, 0, 0, 0]]))[0]
+array([[0, 0, 0, 0, 0, 0, 0, 1, 2],
+       [0, 0, 0, 0, 0, 0, 0, 1, 2]])
+
+The action taken moves with the board.
+>>> boards = SYMMETRIES.boards(board)
+>>> all(boards[i][SYMMETRIES.actions[i, 1]] == 2 for i in range(8))
+True
+"""
+import numpy as np
+
+from games.symmetry import Symmetries
+
+_GRID = np.arange(9).reshape(3, 3)
+_SQUARES = np.array([np.rot90(grid, turns).reshape(-1) for grid in (_GRID, _GRID.T) for turns in range(4)])
+
+# An action is a square, so the action in the transformed board is wherever that square ended up.
+SYMMETRIES = Symmetries(squares=_SQUARES, actions=np.argsort(_SQUARES, axis=1))
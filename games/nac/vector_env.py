@@ -0,0 +1,170 @@
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+from gym.utils import seeding
+
+from .env import NacEnv, MARKS
+
+COMBOS = np.array(NacEnv.winning_combos)  # (8, 3)
+TIE_REWARD = 0
+
+# The outcome of a step for each board, as an index into REASONS.
+IN_PROGRESS, ILLEGAL, WON, WILL_LOSE, TIED = range(5)
+REASONS = ('', 'Illegal move', 'Player {} has won', 'Player {} will win', 'Players have tied (or are about to)')
+
+
+def legal_action_mask(boards: np.ndarray) -> np.ndarray:
+    """
+    Which squares are still free, for one board or a batch of them.
+
+    >>> legal_action_mask(np.array([[0, 1, 0, 0, 2, 0, 0, 0, 0]])).astype(int)
+    array([[1, 0, 1, 1, 0, 1, 1, 1, 1]])
+    """
+    return boards == 0
+
+
+class VectorNacEnv:
+    """
+    A batch of noughts and crosses games, held as one (num_envs, 9) int8 array and stepped all at once,
+    with the same rules and rewards as NacEnv.
+    Finished boards are reset automatically; the board they finished on is in
+    infos[i]['terminal_observation'].
+
+    get_opponent_actions takes a (k, 9) array of the boards where the opponent is to move,
+    and returns k actions. It defaults to random legal moves.
+    Illegal opponent actions are replaced by random legal ones.
+
+    The same moves against the same opponent give the same results as NacEnv.
+    >>> first_free = lambda boards: np.argmax(boards == 0, axis=-1)
+    >>> vector_env = VectorNacEnv(3, get_opponent_actions=first_free)
+    >>> envs = [NacEnv(get_opponent_action=first_free) for _ in range(3)]
+    >>> _, _ = vector_env.reset(), [env.reset() for env in envs]
+    >>> matches = []
+    >>> for actions in np.random.RandomState(0).randint(9, size=(200, 3)):
+    ...     obs, rewards, dones, infos = vector_env.step(actions)
+    ...     for i, (env, action) in enumerate(zip(envs, actions)):
+    ...         board, reward, done, info = env.step(action)
+    ...         if done:
+    ...             matches.append((board == infos[i]['terminal_observation']).all())
+    ...             board = env.reset()
+    ...         _ = infos[i].pop('terminal_observation', None)
+    ...         matches.append((board == obs[i]).all() and (reward, done, info) == (rewards[i], dones[i], infos[i]))
+    >>> all(matches)
+    True
+    """
+    reward_range = NacEnv.reward_range
+    observation_space = NacEnv.observation_space
+    action_space = NacEnv.action_space
+    legal_action_mask = staticmethod(legal_action_mask)
+    player = 0  # The agent's player index; its marks are player + 1.
+
+    def __init__(self, num_envs: int, get_opponent_actions: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+                 seed: int = 1) -> None:
+        self.num_envs = num_envs
+        self.get_opponent_actions = get_opponent_actions
+        self.np_random, _ = seeding.np_random(seed)
+        self.outcomes = np.full(num_envs, IN_PROGRESS)  # Of the last step, as indices into REASONS.
+        self.boards = np.zeros((num_envs, 9), dtype=np.int8)
+
+    def seed(self, seed: Optional[int] = None) -> List[int]:
+        self.np_random, seed = seeding.np_random(seed)
+        return [seed]
+
+    def reset(self) -> np.ndarray:
+        """
+        >>> VectorNacEnv(2).reset()
+        array([[0, 0, 0, 0, 0, 0, 0, 0, 0],
+               [0, 0, 0, 0, 0, 0, 0, 0, 0]], dtype=int8)
+        """
+        self._reset_boards(np.arange(self.num_envs))
+        return self.boards.copy()
+
+    def _reset_boards(self, indices: np.ndarray) -> None:
+        self.boards[indices] = 0
+
+    def _random_legal_actions(self, boards: np.ndarray) -> np.ndarray:
+        legal = legal_action_mask(boards)
+        return np.argmax(self.np_random.random_sample(legal.shape) * legal, axis=1)
+
+    def _play_opponent(self, indices: np.ndarray) -> None:
+        """
+        Plays the opponent's move on each of the given boards.
+        """
+        if len(indices) == 0:
+            return
+        boards = self.boards[indices]
+        if self.get_opponent_actions is None:
+            actions = self._random_legal_actions(boards)
+        else:
+            actions = np.asarray(self.get_opponent_actions(boards), dtype=int)
+            illegal = ~legal_action_mask(boards)[np.arange(len(indices)), actions]
+            actions[illegal] = self._random_legal_actions(boards[illegal])
+        self.boards[indices, actions] = 2 - self.player
+
+    def step(self, actions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[dict]]:
+        """
+        Plays one action on every board, and the opponent's reply where the game goes on.
+        Returns (observations, rewards, dones, infos) for the whole batch.
+
+        >>> env = VectorNacEnv(2)
+        >>> _ = env.reset()
+        >>> env.step(np.array([4, 4]))[:3]
+        (array([[2, 0, 0, 0, 1, 0, 0, 0, 0],
+               [0, 2, 0, 0, 1, 0, 0, 0, 0]], dtype=int8), array([0., 0.], dtype=float32), array([False, False]))
+        """
+        actions = np.asarray(actions, dtype=int)
+        mark = self.player + 1
+        everything = np.arange(self.num_envs)
+        outcomes = np.full(self.num_envs, IN_PROGRESS)
+
+        legal = legal_action_mask(self.boards)[everything, actions]
+        outcomes[~legal] = ILLEGAL
+        self.boards[everything[legal], actions[legal]] = mark
+
+        lines = self.boards[:, COMBOS]
+        won = legal & (lines == mark).all(axis=2).any(axis=1)
+        outcomes[won] = WON
+
+        # The other player has two of a line, and the third square is free.
+        threats = ((lines == 2 - self.player).sum(axis=2) == 2) & ((lines == 0).sum(axis=2) == 1)
+        will_lose = (outcomes == IN_PROGRESS) & threats.any(axis=1)
+        outcomes[will_lose] = WILL_LOSE
+
+        tied = (outcomes == IN_PROGRESS) & ((self.boards != 0).sum(axis=1) >= 8)
+        outcomes[tied] = TIED
+
+        self._play_opponent(np.flatnonzero(outcomes == IN_PROGRESS))
+
+        self.outcomes = outcomes
+        rewards = np.array([0, -10, 1, -2, TIE_REWARD], dtype=np.float32)[outcomes]
+        dones = outcomes != IN_PROGRESS
+        infos = [self._info(outcome) for outcome in outcomes]
+        finished = np.flatnonzero(dones)
+        for i in finished:
+            infos[i]['terminal_observation'] = self.boards[i].copy()
+        self._reset_boards(finished)
+        return self.boards.copy(), rewards, dones, infos
+
+    def _info(self, outcome: int) -> dict:
+        if outcome == IN_PROGRESS:
+            return {"state": "in progress"}
+        winner = self.player + 1 if outcome == WON else 2 - self.player
+        return {"state": "done", "reason": REASONS[outcome].format(winner)}
+
+    def render(self, index: int = 0) -> None:
+        print("{}{}{}\n{}{}{}\n{}{}{}".format(*[MARKS[x] for x in self.boards[index].tolist()]))
+
+
+class VectorNacSecondPlayerEnv(VectorNacEnv):
+    """
+    A batch of noughts and crosses games where you play second.
+    As for NacSecondPlayerEnv, each board starts with the opponent's first move.
+
+    >>> env = VectorNacSecondPlayerEnv(3)
+    >>> (env.reset() == 1).sum(axis=1)
+    array([1, 1, 1])
+    """
+    player = 1
+
+    def _reset_boards(self, indices: np.ndarray) -> None:
+        super()._reset_boards(indices)
+        self._play_opponent(indices)
@@ -0,0 +1,457 @@
+"""
+A DQN learner in plain NumPy, in place of keras-rl's DQNAgent on TensorFlow.
+
+The networks are tiny (a single hidden layer of 27 or 138), so most of the time a keras-rl training step takes goes
+on TensorFlow's overheads rather than on the arithmetic. NumpyDQNAgent does the same update as DQNAgent
+(and MaskedDQNAgent, with mask_illegal): a squared error loss on the Q-value of the action taken, against
+r + gamma * max Q of the target network, with Adam, and soft (or hard) updates of the target network,
+reporting the same metrics (loss, mae and mean_q). It has enough of DQNAgent's interface to be trained,
+played, tested, checkpointed and saved in its place, and reads and writes the same hdf5 weight files.
+
+This module doesn't import keras-rl or TensorFlow, so it starts in well under a second.
+
+    agent = get_numpy_dqn_agent(Connect4Env())  # Or get_dqn_agent(Connect4Env(), backend='numpy')
+    agent.fit(Connect4Env(), nb_steps=10000)
+"""
+import os
+import time
+from typing import Any, List, NamedTuple, Optional, Tuple
+import h5py
+import numpy as np
+
+from games.encoding import OneHotProcessor
+from games.memory import BoardMemory
+from games.numpy_network import Layer, NumpyQNetwork, read_weights
+from games.policy import DEFAULT_CLIP, select_legal_actions
+from games.prioritized import PrioritizedBoardMemory, PrioritizedSymmetricMemory
+from games.symmetry import SymmetricMemory
+
+LOG_INTERVAL = 10000  # Steps between the lines fit prints, as keras-rl's does.
+
+
+class Policy:
+    """
+    A Q policy with the settings of one of keras-rl's (see policy.py's QPolicy), that can be changed
+    (eg. to anneal eps, or by Checkpointer.load), and picks only legal actions if given a mask of them.
+
+    >>> Policy(eps=0.).select_action(np.array([1., 5., 2.]), legal=np.array([True, False, True]))
+    2
+    """
+    def __init__(self, eps: Optional[float] = None, tau: Optional[float] = None,
+                 clip: Any = DEFAULT_CLIP) -> None:
+        self.eps = eps
+        self.tau = tau
+        self.clip = clip
+
+    def select_action(self, q_values: np.ndarray, legal: Optional[np.ndarray] = None,
+                      random_state: Optional[Any] = None) -> int:
+        legal = np.ones(q_values.shape, dtype=bool) if legal is None else legal
+        return int(select_legal_actions(self, q_values[np.newaxis], legal[np.newaxis], random_state)[0])
+
+    @property
+    def metrics(self) -> List[float]:
+        return []
+
+
+class Adam:
+    """
+    Keras' Adam optimizer (its legacy version, which keras-rl uses), updating arrays in place.
+
+    >>> optimizer = Adam(learning_rate=.1)
+    >>> weights = [np.array([1., -1.])]
+    >>> optimizer.apply(weights, [np.array([2., -.5])])
+    >>> weights[0].round(4), len(optimizer.get_weights())  # The first step is about learning_rate, either way.
+    (array([ 0.9, -0.9]), 3)
+    """
+    def __init__(self, learning_rate: float = 1e-3, beta_1: float = .9, beta_2: float = .999,
+                 epsilon: float = 1e-7) -> None:
+        self.learning_rate = learning_rate
+        self.beta_1 = beta_1
+        self.beta_2 = beta_2
+        self.epsilon = epsilon
+        self.iterations = 0
+        self.moments: List[np.ndarray] = []  # The first moments, then the second.
+
+    @property
+    def weights(self) -> List[np.ndarray]:
+        return self.get_weights()
+
+    def get_weights(self) -> List[np.ndarray]:
+        """
+        The iteration count and the moments, as Keras' get_weights gives an optimizer's.
+        """
+        return [np.array(self.iterations)] + [moment.copy() for moment in self.moments]
+
+    def set_weights(self, weights: List[np.ndarray]) -> None:
+        self.iterations = int(weights[0])
+        self.moments = [np.array(moment) for moment in weights[1:]]
+
+    def apply(self, weights: List[np.ndarray], gradients: List[np.ndarray]) -> None:
+        if not self.moments:
+            self.moments = [np.zeros_like(w) for _ in range(2) for w in weights]
+        self.iterations += 1
+        step = self.learning_rate * np.sqrt(1 - self.beta_2 ** self.iterations) / (1 - self.beta_1 ** self.iterations)
+        first, second = self.moments[:len(weights)], self.moments[len(weights):]
+        for w, gradient, m, v in zip(weights, gradients, first, second):
+            m *= self.beta_1
+            m += (1 - self.beta_1) * gradient
+            v *= self.beta_2
+            v += (1 - self.beta_2) * np.square(gradient)
+            w -= step * m / (np.sqrt(v) + self.epsilon)
+
+
+class _Trainable(NamedTuple):
+    """
+    Stands in for DQNAgent's trainable_model, for what Checkpointer needs of it.
+    """
+    optimizer: Adam
+
+
+def glorot_uniform(fan_in: int, fan_out: int, random_state: Any) -> np.ndarray:
+    """
+    Keras' default initialization of a Dense layer's kernel.
+    """
+    limit = np.sqrt(6 / (fan_in + fan_out))
+    return random_state.uniform(-limit, limit, size=(fan_in, fan_out)).astype(np.float32)
+
+
+class NumpyDQNAgent:
+    """
+    A DQN agent trained in NumPy, as keras-rl's DQNAgent is (see the module's docstring): on a memory (a BoardMemory,
+    with one_hot=False, or any of its subclasses, including the prioritized ones) of raw boards,
+    which processor (a deferred OneHotProcessor) encodes a batch at a time.
+
+    Its gradients match the loss's.
+    >>> random_state = np.random.RandomState(0)
+    >>> agent = NumpyDQNAgent([(random_state.randn(6, 4), random_state.randn(4)), (random_state.randn(4, 2), np.zeros(2))],
+    ...                       BoardMemory(limit=100, board_size=2, one_hot=False), learning_rate=.01)
+    >>> inputs = random_state.randn(5, 6).astype(np.float32)
+    >>> actions, targets = np.array([0, 1, 1, 0, 1]), random_state.randn(5).astype(np.float32)
+    >>> loss, _, gradients = agent.gradients(inputs, actions, targets, np.ones(5))
+    >>> def loss_with(i, delta):
+    ...     agent.model.layers[0][0][i] += delta
+    ...     loss = agent.gradients(inputs, actions, targets, np.ones(5))[0]
+    ...     agent.model.layers[0][0][i] -= delta
+    ...     return loss
+    >>> numerical = (loss_with((2, 1), 1e-2) - loss_with((2, 1), -1e-2)) / 2e-2
+    >>> abs(numerical - gradients[0][2, 1]) < 1e-3
+    True
+
+    And training lowers its loss on the same batch.
+    >>> for _ in range(100):
+    ...     _ = agent.train_batch(inputs, actions, targets)
+    >>> agent.gradients(inputs, actions, targets, np.ones(5))[0] < loss / 10
+    True
+    """
+    def __init__(self, layers: List[Layer], memory: BoardMemory, processor: Optional[OneHotProcessor] = None,
+                 policy: Optional[Policy] = None, test_policy: Optional[Policy] = None, mask_illegal: bool = False,
+                 gamma: float = .99, batch_size: int = 32, nb_steps_warmup: int = 1000, train_interval: int = 1,
+                 memory_interval: int = 1, target_model_update: float = 1e-2, learning_rate: float = 1e-3,
+                 gradient_steps: int = 1, random_state: Optional[Any] = None) -> None:
+        self.processor = OneHotProcessor(deferred=True) if processor is None else processor
+        self.policy = Policy(eps=.1) if policy is None else policy
+        self.test_policy = Policy() if test_policy is None else test_policy
+        self.model = NumpyQNetwork(layers, processor=self.processor, mask_illegal=mask_illegal)
+        self.target_model = NumpyQNetwork(layers, processor=self.processor, mask_illegal=mask_illegal)
+        self.trainable_model = _Trainable(Adam(learning_rate))
+        self.memory = memory
+        self.mask_illegal = mask_illegal
+        self.nb_actions = self.model.nb_actions
+        self.gamma = gamma
+        self.batch_size = batch_size
+        self.nb_steps_warmup = nb_steps_warmup
+        self.train_interval = train_interval
+        self.gradient_steps = gradient_steps  # Each on its own batch, every train_interval steps.
+        self.memory_interval = memory_interval
+        self.target_model_update = int(target_model_update) if target_model_update >= 1 else target_model_update
+        self.random_state = random_state  # For the policies' random choices (numpy's global random state if None).
+        self.metrics_names = ['loss', 'mae', 'mean_q']
+        self.training = False
+        self.step = 0
+        self.recent_observation: Any = None
+        self.recent_action: Any = None
+        self.compiled = True
+
+    @property
+    def optimizer(self) -> Adam:
+        optimizer: Adam = self.trainable_model.optimizer
+        return optimizer
+
+    @property
+    def weights_version(self) -> Tuple[int, int]:
+        """
+        Changes whenever the model's weights do: with each gradient step, or set_weights (eg. from load_weights).
+        """
+        return self.optimizer.iterations, self.model.weights_version
+
+    def reset_states(self) -> None:
+        self.recent_observation = None
+        self.recent_action = None
+
+    def update_target_model_hard(self) -> None:
+        self.target_model.set_weights(self.model.get_weights())
+
+    def compute_batch_q_values(self, state_batch: Any) -> np.ndarray:
+        return self.model.compute_batch_q_values(state_batch)
+
+    def compute_q_values(self, state: Any) -> np.ndarray:
+        return self.model.compute_q_values(state)
+
+    def forward(self, observation: np.ndarray) -> int:
+        state = self.memory.get_recent_state(observation)
+        q_values = self.compute_q_values(state)
+        policy = self.policy if self.training else self.test_policy
+        legal = self.processor.legal_action_mask(observation, self.nb_actions) if self.mask_illegal else None
+        action = policy.select_action(q_values, legal=legal, random_state=self.random_state)
+        self.recent_observation = observation
+        self.recent_action = action
+        return action
+
+    def backward(self, reward: float, terminal: bool) -> List[float]:
+        if self.step % self.memory_interval == 0:
+            self.memory.append(self.recent_observation, self.recent_action, reward, terminal, training=self.training)
+        metrics = [np.nan] * len(self.metrics_names)
+        if not self.training:
+            return metrics
+        if self.step > self.nb_steps_warmup and self.step % self.train_interval == 0:
+            for _ in range(self.gradient_steps):
+                metrics = self.train(self.memory.sample_batch(self.batch_size))
+        if self.target_model_update >= 1 and self.step % self.target_model_update == 0:
+            self.update_target_model_hard()
+        return metrics
+
+    def train(self, batch: Any) -> List[float]:
+        """
+        Trains on a batch sampled from the memory (an ExperienceBatch), and returns the metrics.
+        """
+        q_values = self.target_model.q_values(self.processor.process_state_batch(batch.state1))
+        if self.mask_illegal:
+            legal = self.processor.legal_action_mask(batch.state1, self.nb_actions).reshape(q_values.shape)
+            # As MaskedModel does: illegal actions get the lowest Q-value, so the best is a legal one.
+            q_values = np.where(legal, q_values, q_values.min(axis=1, keepdims=True))
+        targets = batch.reward + self.gamma * q_values.max(axis=1) * ~batch.terminal1
+        weights = getattr(self.memory, 'last_weights', None)
+        if weights is None or len(weights) != len(targets):
+            weights = np.ones(len(targets))
+        inputs = self.processor.process_state_batch(batch.state0)
+        metrics, td_errors = self.train_batch(inputs, batch.action, targets, weights)
+        if hasattr(self.memory, 'update_priorities'):
+            self.memory.update_priorities(td_errors)
+        return metrics
+
+    def gradients(self, inputs: np.ndarray, actions: np.ndarray, targets: np.ndarray,
+                  weights: np.ndarray) -> Any:
+        """
+        The loss (as Keras reports it: the mean, weighted by weights, of half the squared errors),
+        the activations of each layer, and the gradients of the loss with respect to the weights,
+        in the order of get_weights.
+        """
+        activations = [np.asarray(inputs, dtype=np.float32).reshape(len(inputs), -1)]
+        layers = self.model.layers
+        for kernel, bias in layers[:-1]:
+            activations.append(np.maximum(activations[-1] @ kernel + bias, 0))
+        kernel, bias = layers[-1]
+        q_values = activations[-1] @ kernel + bias
+        rows = np.arange(len(inputs))
+        errors = q_values[rows, actions] - targets
+        loss = float(np.mean(weights * .5 * np.square(errors)))
+
+        output_gradients = np.zeros_like(q_values)
+        output_gradients[rows, actions] = weights * errors / len(inputs)
+        gradients: List[np.ndarray] = []
+        for i in range(len(layers) - 1, -1, -1):
+            kernel, _ = layers[i]
+            gradients[:0] = [activations[i].T @ output_gradients, output_gradients.sum(axis=0)]
+            if i:
+                output_gradients = (output_gradients @ kernel.T) * (activations[i] > 0)
+        return loss, (activations, q_values, errors), gradients
+
+    def train_batch(self, inputs: np.ndarray, actions: np.ndarray, targets: np.ndarray,
+                    weights: Optional[np.ndarray] = None) -> Any:
+        """
+        One gradient step (and soft update of the target network) on a batch of processed states,
+        the actions taken and their target Q-values, with the samples weighted by weights.
+        Returns the metrics (from before the step) and the TD errors.
+        """
+        weights = np.ones(len(targets)) if weights is None else weights
+        loss, (_, q_values, errors), gradients = self.gradients(inputs, actions, targets, weights)
+        self.optimizer.apply([w for layer in self.model.layers for w in layer], gradients)
+        if self.target_model_update < 1:
+            tau = self.target_model_update
+            for (kernel, bias), (target_kernel, target_bias) in zip(self.model.layers, self.target_model.layers):
+                target_kernel += tau * (kernel - target_kernel)
+                target_bias += tau * (bias - target_bias)
+
+        # keras-rl's mae compares all the Q-values with a target of 0 for the actions not taken.
+        full_targets = np.zeros_like(q_values)
+        full_targets[np.arange(len(targets)), actions] = targets
+        metrics = [loss, float(np.mean(np.abs(full_targets - q_values))), float(np.mean(q_values.max(axis=1)))]
+        return metrics + self.policy.metrics, -errors
+
+    def fit(self, env: Any, nb_steps: int, visualize: bool = False, verbose: int = 1,
+            callbacks: Optional[List[Any]] = None, **_: Any) -> None:
+        """
+        Trains in the env for nb_steps steps, as keras-rl's Agent.fit does (with its default settings),
+        calling the keras-rl callbacks it is given, and with verbose, printing a summary every LOG_INTERVAL steps.
+        """
+        callbacks = callbacks or []
+        for callback in callbacks:
+            callback.model = self
+            callback.env = env
+        self.training = True
+        self._call(callbacks, 'on_train_begin')
+        self.step = 0
+        episode = 0
+        observation = None
+        episode_reward = 0.
+        episode_step = 0
+        interval_rewards: List[float] = []
+        interval_metrics: List[List[float]] = []
+        start = time.perf_counter()
+        while self.step < nb_steps:
+            if observation is None:
+                self._call(callbacks, 'on_episode_begin', episode)
+                episode_reward, episode_step = 0., 0
+                self.reset_states()
+                observation = self.processor.process_observation(env.reset())
+            self._call(callbacks, 'on_step_begin', episode_step)
+            action = self.forward(observation)
+            self._call(callbacks, 'on_action_begin', action)
+            next_observation, reward, done, _ = env.step(action)
+            if visualize:
+                env.render()
+            observation = self.processor.process_observation(next_observation)
+            self._call(callbacks, 'on_action_end', action)
+            metrics = self.backward(reward, terminal=done)
+            if not np.isnan(metrics[0]):
+                interval_metrics.append(metrics)
+            episode_reward += reward
+            self._call(callbacks, 'on_step_end', episode_step,
+                       {'action': action, 'observation': observation, 'reward': reward, 'metrics': metrics,
+                        'episode': episode})
+            episode_step += 1
+            self.step += 1
+            if done:
+                # As keras-rl does, to store the final observation (with no reward) in the memory.
+                self.forward(observation)
+                self.backward(0., terminal=False)
+                self._call(callbacks, 'on_episode_end', episode,
+                           {'episode_reward': episode_reward, 'nb_episode_steps': episode_step,
+                            'nb_steps': self.step})
+                interval_rewards.append(episode_reward)
+                episode += 1
+                observation = None
+            if verbose and (self.step % LOG_INTERVAL == 0 or self.step >= nb_steps):
+                _print_interval(self.step, nb_steps, time.perf_counter() - start, interval_rewards, interval_metrics,
+                                self.metrics_names)
+                interval_rewards, interval_metrics = [], []
+                start = time.perf_counter()
+        self._call(callbacks, 'on_train_end', {'did_abort': False})
+
+    @staticmethod
+    def _call(callbacks: List[Any], method: str, *args: Any) -> None:
+        for callback in callbacks:
+            getattr(callback, method)(*args)
+
+    def save_weights(self, filepath: str, overwrite: bool = False) -> None:
+        """
+        Writes the model's weights to an hdf5 file, laid out as Keras' save_weights does,
+        so that Keras models (and DQNAgent.load_weights) can load it.
+        """
+        if not overwrite and os.path.exists(filepath):
+            raise FileExistsError(f'{filepath} exists: pass overwrite=True to replace it')
+        write_weights(filepath, self.model.layers)
+
+    def load_weights(self, filepath: str) -> None:
+        self.model.set_weights([weights for layer in read_weights(filepath) for weights in layer])
+        self.update_target_model_hard()
+
+
+def _print_interval(step: int, nb_steps: int, seconds: float, rewards: List[float], metrics: List[List[float]],
+                    names: List[str]) -> None:
+    means = np.mean(metrics, axis=0) if metrics else [np.nan] * len(names)
+    summary = ', '.join(f'{name}: {mean:.4f}' for name, mean in zip(names, means))
+    reward = f'mean reward {np.mean(rewards):.3f}' if rewards else 'no episodes finished'
+    print(f'  {step}/{nb_steps} steps ({seconds:.1f}s): {len(rewards)} episodes, {reward}, {summary}', flush=True)
+
+
+def write_weights(filepath: str, layers: List[Layer]) -> None:
+    """
+    Writes the (kernel, bias) of each Dense layer to a Keras hdf5 weights file, after a Flatten layer,
+    as the agents' Sequential models save theirs.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'weights.hdf5')
+    >>> layers = [(np.ones((27, 4), dtype=np.float32), np.zeros(4, dtype=np.float32)),
+    ...           (np.ones((4, 9), dtype=np.float32), np.arange(9, dtype=np.float32))]
+    >>> write_weights(path, layers)
+    >>> [bias.tolist() for _, bias in read_weights(path)][1]
+    [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0]
+
+    Keras reads it too.
+    >>> from tensorflow.keras.models import Sequential
+    >>> from tensorflow.keras.layers import Dense, Flatten
+    >>> model = Sequential([Flatten(input_shape=(1, 27)), Dense(4, activation='relu'), Dense(9, activation='linear')])
+    >>> model.load_weights(path)
+    >>> model.get_weights()[3].tolist()
+    [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0]
+    """
+    layer_names = ['flatten'] + ['dense' + (f'_{i}' if i else '') for i in range(len(layers))]
+    with h5py.File(filepath, 'w') as weights_file:
+        weights_file.attrs['backend'] = b'tensorflow'
+        weights_file.attrs['keras_version'] = b'2.4.0'
+        weights_file.attrs['layer_names'] = [name.encode() for name in layer_names]
+        weights_file.create_group('flatten').attrs['weight_names'] = np.array([], dtype=np.float64)
+        for name, (kernel, bias) in zip(layer_names[1:], layers):
+            group = weights_file.create_group(name)
+            weight_names = [f'{name}/kernel:0', f'{name}/bias:0']
+            group.attrs['weight_names'] = [weight_name.encode() for weight_name in weight_names]
+            for weight_name, weights in zip(weight_names, (kernel, bias)):
+                group.create_dataset(weight_name, data=np.asarray(weights, dtype=np.float32))
+
+
+def get_numpy_dqn_agent(env: Any, augment: bool = True, mask_illegal: bool = True, perspective: bool = False,
+                        layer_size: int = 0, memory_limit: int = 50000, nb_steps_warmup: int = 100,
+                        target_model_update: float = 1e-2, learning_rate: float = 1e-3, prioritized: bool = False,
+                        batch_size: int = 32, train_interval: int = 1, gradient_steps: int = 1, n_step: int = 1,
+                        random_state: Optional[Any] = None) -> NumpyDQNAgent:
+    """
+    A NumpyDQNAgent for either game's env, set up as get_dqn_agent sets up a DQNAgent
+    (with the same arguments, and layer_size 0 for the game's usual size).
+    Its weights are initialized from random_state (numpy's global random state if None).
+
+    >>> from games.nac.env import NacEnv
+    >>> agent = get_numpy_dqn_agent(NacEnv())
+    >>> [weights.shape for weights in agent.model.get_weights()], type(agent.memory).__name__
+    ([(27, 27), (27,), (27, 9), (9,)], 'SymmetricMemory')
+    """
+    # Imported here, to use only the game's.
+    # pylint: disable=import-outside-toplevel
+    board_size = env.observation_space.shape[-1] // 3
+    nb_actions = env.action_space.n
+    if board_size == 9:
+        from games.nac.symmetry import SYMMETRIES
+        layer_size = layer_size or 27
+        policy, test_policy = Policy(eps=.2), Policy()
+    else:
+        from games.connect4.symmetry import SYMMETRIES  # type: ignore
+        layer_size = layer_size or 69 * 2
+        policy, test_policy = Policy(eps=.15, tau=1.), Policy(tau=1.)
+
+    if prioritized:
+        memory: BoardMemory = PrioritizedSymmetricMemory(limit=memory_limit, board_size=board_size,
+                                                         symmetries=SYMMETRIES, one_hot=False, n_step=n_step) \
+            if augment else PrioritizedBoardMemory(limit=memory_limit, board_size=board_size, one_hot=False,
+                                                   n_step=n_step)
+    else:
+        memory = SymmetricMemory(limit=memory_limit, board_size=board_size, symmetries=SYMMETRIES, one_hot=False,
+                                 n_step=n_step) if augment \
+            else BoardMemory(limit=memory_limit, board_size=board_size, one_hot=False, n_step=n_step)
+    random_state = np.random if random_state is None else random_state
+    layers = [(glorot_uniform(3 * board_size, layer_size, random_state), np.zeros(layer_size, dtype=np.float32)),
+              (glorot_uniform(layer_size, nb_actions, random_state), np.zeros(nb_actions, dtype=np.float32))]
+    return NumpyDQNAgent(layers, memory, OneHotProcessor(perspective, deferred=True), policy, test_policy,
+                         mask_illegal, gamma=memory.gamma ** n_step, batch_size=batch_size,
+                         nb_steps_warmup=nb_steps_warmup, train_interval=train_interval,
+                         target_model_update=target_model_update, learning_rate=learning_rate,
+                         gradient_steps=gradient_steps)
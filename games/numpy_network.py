@@ -0,0 +1,132 @@
+"""
+An inference-only version of the DQN agents' Q-network, run in NumPy.
+It reads the hdf5 weight files written by save_agents, and doesn't load TensorFlow or keras-rl,
+so it is quick to start and light on memory, for playing and evaluating trained agents.
+"""
+from typing import Any, List, Optional, Tuple
+import h5py
+import numpy as np
+
+from games.encoding import OneHotProcessor
+from games.policy import QPolicy, select_legal_actions
+
+Layer = Tuple[np.ndarray, np.ndarray]  # (kernel, bias)
+
+
+def read_weights(filepath: str) -> List[Layer]:
+    """
+    Reads the (kernel, bias) of each layer with weights from a Keras hdf5 weights file, in order.
+
+    >>> import os
+    >>> path = os.path.join(os.path.dirname(__file__), 'nac', 'weights', 'weights-1.hdf5')
+    >>> [kernel.shape for kernel, _ in read_weights(path)]
+    [(27, 27), (27, 9)]
+    """
+    layers = []
+    with h5py.File(filepath, 'r') as weights_file:
+        for layer_name in weights_file.attrs['layer_names']:
+            group = weights_file[layer_name]
+            weights = [np.asarray(group[weight_name]) for weight_name in group.attrs['weight_names']]
+            if weights:
+                kernel, bias = weights
+                layers.append((kernel, bias))
+    return layers
+
+
+class NumpyQNetwork:
+    """
+    The agents' Flatten -> Dense(relu) -> Dense(linear) network (any number of relu layers),
+    with enough of keras-rl's DQNAgent interface to play in place of one: processor, training,
+    policy, test_policy, forward and compute_batch_q_values.
+    The policies are QPolicy settings (or keras-rl policies), and default to keras-rl's defaults.
+    With mask_illegal, it only picks legal actions, as MaskedDQNAgent does.
+
+    Its Q-values match the Keras model's.
+    >>> import os
+    >>> from tensorflow.keras.models import Sequential
+    >>> from tensorflow.keras.layers import Dense, Flatten
+    >>> path = os.path.join(os.path.dirname(__file__), 'nac', 'weights', 'weights-1.hdf5')
+    >>> model = Sequential([Flatten(input_shape=(1, 27)), Dense(27, activation='relu'), Dense(9, activation='linear')])
+    >>> model.load_weights(path)
+    >>> network = NumpyQNetwork.load(path)
+    >>> boards = np.random.RandomState(0).randint(3, size=(100, 9))
+    >>> states = [[network.processor.process_observation(board)] for board in boards]
+    >>> np.abs(network.compute_batch_q_values(states) - model.predict_on_batch(np.array(states))).max() < 1e-5
+    True
+
+    And the same goes for a freshly saved Connect 4 sized network.
+    >>> import tempfile
+    >>> model = Sequential([Flatten(input_shape=(1, 126)), Dense(138, activation='relu'), Dense(7, activation='linear')])
+    >>> path = os.path.join(tempfile.mkdtemp(), 'weights.hdf5')
+    >>> model.save_weights(path)
+    >>> network = NumpyQNetwork.load(path)
+    >>> boards = np.random.RandomState(0).randint(3, size=(100, 42))
+    >>> states = [[network.processor.process_observation(board)] for board in boards]
+    >>> np.abs(network.compute_batch_q_values(states) - model.predict_on_batch(np.array(states))).max() < 1e-5
+    True
+    """
+    def __init__(self, layers: List[Layer], policy: Any = None, test_policy: Any = None,
+                 processor: Any = None, random_state: Optional[Any] = None, mask_illegal: bool = False) -> None:
+        self.layers = [(kernel.astype(np.float32), bias.astype(np.float32)) for kernel, bias in layers]
+        self.policy = QPolicy(eps=.1) if policy is None else policy
+        self.test_policy = QPolicy() if test_policy is None else test_policy
+        self.processor = OneHotProcessor() if processor is None else processor
+        self.random_state = random_state
+        self.mask_illegal = mask_illegal
+        self.training = False
+        self.nb_actions = self.layers[-1][1].shape[0]
+        self.weights_version = 0  # Bumped by set_weights, so that caches of its Q-values know to drop them.
+
+    @classmethod
+    def load(cls, filepath: str, **kwargs: Any) -> 'NumpyQNetwork':
+        return cls(read_weights(filepath), **kwargs)
+
+    def get_weights(self) -> List[np.ndarray]:
+        """
+        Copies of the weights, in the same order as Keras' model.get_weights().
+        """
+        return [weights.copy() for layer in self.layers for weights in layer]
+
+    def set_weights(self, weights: List[np.ndarray]) -> None:
+        self.layers = [(weights[i].astype(np.float32), weights[i + 1].astype(np.float32)) for i in range(0, len(weights), 2)]
+        self.weights_version += 1
+
+    def q_values(self, inputs: np.ndarray) -> np.ndarray:
+        """
+        Runs the network on a batch of processed observations, of shape (batch, ...).
+
+        >>> network = NumpyQNetwork([(np.eye(2), np.zeros(2)), (np.array([[1.], [-1.]]), np.ones(1))])
+        >>> network.q_values(np.array([[1, 0], [0, 1], [-1, 0]]))
+        array([[2.],
+               [0.],
+               [1.]], dtype=float32)
+        """
+        activations = np.asarray(inputs, dtype=np.float32).reshape(len(inputs), -1)
+        for kernel, bias in self.layers[:-1]:
+            activations = np.maximum(activations @ kernel + bias, 0)
+        kernel, bias = self.layers[-1]
+        return activations @ kernel + bias
+
+    def compute_batch_q_values(self, state_batch: Any) -> np.ndarray:
+        return self.q_values(self.processor.process_state_batch(np.asarray(state_batch)))
+
+    def compute_q_values(self, state: Any) -> np.ndarray:
+        return self.compute_batch_q_values([state])[0]
+
+    def forward(self, observation: np.ndarray) -> int:
+        """
+        Picks an action for a processed observation, as DQNAgent.forward does (so it may be illegal, without mask_illegal).
+
+        >>> network = NumpyQNetwork([(np.zeros((27, 9)), np.arange(9))])
+        >>> board = np.array([0, 0, 0, 0, 0, 0, 0, 0, 1], dtype=np.int8)
+        >>> network.forward(network.processor.process_observation(board))
+        8
+        >>> network.mask_illegal = True
+        >>> network.forward(network.processor.process_observation(board))
+        7
+        """
+        q_values = self.compute_q_values([observation])
+        policy = self.policy if self.training else self.test_policy
+        legal = self.processor.legal_action_mask(observation, self.nb_actions) if self.mask_illegal \
+            else np.ones(self.nb_actions, dtype=bool)
+        return int(select_legal_actions(policy, q_values[np.newaxis], legal[np.newaxis], self.random_state)[0])
@@ -0,0 +1,214 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+import numpy as np
+
+from games.memory import pack_boards
+from games.policy import select_legal_actions
+
+CACHE_SIZE = 100000  # Boards whose Q-values an opponent in training keeps: a few megabytes.
+
+
+class QValueCache:
+    """
+    The Q-values of up to size boards, keyed by the board packed two bits a square,
+    evicting the least recently used when full. Q-values rather than actions are kept,
+    so that a stochastic policy still picks afresh each time.
+
+    >>> cache = QValueCache(size=2)
+    >>> calls = []
+    >>> def q_values(boards):
+    ...     calls.append(len(boards))
+    ...     return boards.sum(axis=1, keepdims=True) * np.ones((1, 2))
+    >>> cache.lookup(np.array([[0, 1, 2], [1, 1, 0], [0, 1, 2]]), q_values)
+    array([[3., 3.],
+           [2., 2.],
+           [3., 3.]])
+    >>> cache.lookup(np.array([[0, 0, 1], [1, 1, 0]]), q_values)  # [0, 1, 2] is evicted, as the least recently used.
+    array([[1., 1.],
+           [2., 2.]])
+    >>> cache.lookup(np.array([[0, 1, 2]]), q_values)
+    array([[3., 3.]])
+    >>> calls, cache.hits, cache.misses, f'{cache.hit_rate:.0%}'
+    ([2, 1, 1], 2, 4, '33%')
+    """
+    def __init__(self, size: int = 100000) -> None:
+        self.size = size
+        self.slots: 'OrderedDict[bytes, int]' = OrderedDict()  # Rows of table, by key, least recently used first.
+        self.table = np.zeros((0, 0))  # Made once the size of the Q-values is known.
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def clear(self) -> None:
+        self.slots.clear()
+
+    def lookup(self, boards: np.ndarray, q_values: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """
+        The Q-values of the boards, from the cache where it has them,
+        and otherwise from calling q_values once with the rest (each only once).
+        """
+        keys = [row.tobytes() for row in pack_boards(boards)]
+        hits = []
+        missing: Dict[bytes, int] = {}  # The position in the batch of the first board with each missing key.
+        for i, key in enumerate(keys):
+            slot = self.slots.get(key)
+            if slot is None:
+                missing.setdefault(key, i)
+            else:
+                self.slots.move_to_end(key)
+                hits.append((i, slot))
+        # Repeats of a missing board in the batch count as hits, since it is only computed once.
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if not missing:
+            return self.table[[slot for _, slot in hits]]
+
+        new_q_values = q_values(boards[list(missing.values())])
+        if self.table.shape[1:] != new_q_values.shape[1:]:
+            self.table = np.zeros((self.size,) + new_q_values.shape[1:], dtype=new_q_values.dtype)
+        q_values_batch = np.zeros((len(keys),) + self.table.shape[1:], dtype=self.table.dtype)
+        if hits:
+            positions, slots = zip(*hits)
+            q_values_batch[list(positions)] = self.table[list(slots)]
+        rows = dict(zip(missing, new_q_values))
+        for i, key in enumerate(keys):
+            if key in rows:
+                q_values_batch[i] = rows[key]
+        for key, row in rows.items():
+            slot = len(self.slots) if len(self.slots) < self.size else self.slots.popitem(last=False)[1]
+            self.slots[key] = slot
+            self.table[slot] = row
+        return q_values_batch
+
+
+def weights_version(agent: Any) -> Any:
+    """
+    Something that changes whenever the agent is trained: its weights_version if it has one (as NumpyQNetwork,
+    NumpyDQNAgent and the agents of dqn.py do), or else, for any other keras-rl agent, the number of steps
+    its optimizer has taken (slower to read than a forward pass is to run, on small networks), or None.
+    """
+    version = getattr(agent, 'weights_version', None)
+    if version is not None:
+        return version
+    trainable_model = getattr(agent, 'trainable_model', None)
+    if trainable_model is None:
+        return None
+    from tensorflow.keras import backend  # pylint: disable=import-outside-toplevel
+    optimizer = trainable_model.optimizer
+    optimizer = getattr(optimizer, 'optimizer', optimizer)  # keras-rl wraps it, in an AdditionalUpdatesOptimizer.
+    return int(backend.get_value(optimizer.iterations))
+
+
+class BatchedOpponent:
+    """
+    Plays a (usually frozen) DQN agent as the opponent inside an env.
+
+    Call it with a single board, as an env's get_opponent_action, or pass act_batch as a vector env's
+    get_opponent_actions, so that the moves pending across all its boards are answered by one
+    forward pass through the agent's network.
+    Illegal actions are masked out before the agent's policy picks one, so unlike calling
+    agent.forward directly, the env never has to ask again.
+
+    The agent needs a processor and compute_batch_q_values, as keras-rl's DQNAgent has,
+    and picks actions with its policy if agent.training is set, or else its test_policy.
+
+    With a cache_size, the Q-values of up to that many boards are kept in a QValueCache, to save asking the network
+    again for boards it has seen (the same openings come up again and again). It is cleared when the agent's
+    weights_version changes (see weights_version), as it does when the agent is trained or loads weights;
+    call cache.clear() after setting a keras-rl agent's weights any other way.
+    With a book (an OpeningBook of the agent's Q-values: see connect4/book.py), the boards in it are looked up there
+    first. A book keeps the Q-values of the weights it was built from, so it is only for agents that are not trained.
+
+    >>> from games.nac.vector_env import legal_action_mask
+    >>> class Agent:  # Prefers the highest numbered square.
+    ...     training = False
+    ...     test_policy = None
+    ...     class processor:
+    ...         process_observation = staticmethod(lambda board: board)
+    ...     def compute_batch_q_values(self, state_batch):
+    ...         return np.tile(np.arange(9.), (len(state_batch), 1))
+    >>> opponent = BatchedOpponent(Agent(), legal_action_mask)
+    >>> opponent(np.array([0, 0, 0, 0, 0, 0, 0, 0, 0]))
+    8
+    >>> opponent.act_batch(np.array([[0, 0, 0, 0, 0, 0, 0, 0, 1], [0, 0, 0, 0, 0, 0, 0, 2, 1]]))
+    array([7, 6])
+    >>> opponent = BatchedOpponent(Agent(), legal_action_mask, cache_size=100)
+    >>> opponent.act_batch(np.array([[0, 0, 0, 0, 0, 0, 0, 0, 1], [0, 0, 0, 0, 0, 0, 0, 0, 1]]))
+    array([7, 7])
+    >>> opponent.cache.hits, opponent.cache.misses
+    (1, 1)
+
+    Training the agent again drops what was cached, even though its step ends where it did before.
+    >>> from games.nac.env import NacEnv
+    >>> from games.numpy_dqn import get_numpy_dqn_agent
+    >>> agent = get_numpy_dqn_agent(NacEnv(), nb_steps_warmup=10, random_state=np.random.RandomState(0))
+    >>> agent.fit(NacEnv(), nb_steps=50, verbose=0)
+    >>> opponent = BatchedOpponent(agent, legal_action_mask, cache_size=100)
+    >>> board = np.zeros(9, dtype=np.int8)
+    >>> before = opponent.q_values(board[np.newaxis])
+    >>> agent.fit(NacEnv(), nb_steps=50, verbose=0)
+    >>> after = opponent.q_values(board[np.newaxis])
+    >>> agent.step, opponent.cache.misses, np.array_equal(after, agent.compute_batch_q_values([[board]]))
+    (50, 2, True)
+    >>> np.array_equal(before, after)
+    False
+    """
+    def __init__(self, agent: Any, legal_action_mask: Callable[[np.ndarray], np.ndarray],
+                 mask_illegal: bool = True, random_state: Optional[Any] = None, cache_size: int = 0,
+                 book: Optional[Any] = None) -> None:
+        self.agent = agent
+        self.legal_action_mask = legal_action_mask
+        self.mask_illegal = mask_illegal
+        self.random_state = random_state
+        self.cache = QValueCache(cache_size) if cache_size else None
+        self.cached_version = weights_version(agent)
+        self.book = book
+
+    def q_values(self, boards: np.ndarray) -> np.ndarray:
+        """
+        The agent's Q-values for a batch of boards: from the book for those in it, if it has one,
+        and the rest from a single forward pass (of those not in the cache, if it has one).
+        """
+        if self.book is None:
+            return self.cached_q_values(boards)
+        found, book_q_values = self.book.lookup(boards)
+        if found.all():
+            return book_q_values
+        q_values = np.empty((len(boards), book_q_values.shape[1]), dtype=book_q_values.dtype)
+        q_values[found] = book_q_values
+        q_values[~found] = self.cached_q_values(boards[~found])
+        return q_values
+
+    def cached_q_values(self, boards: np.ndarray) -> np.ndarray:
+        if self.cache is None:
+            return self.network_q_values(boards)
+        version = weights_version(self.agent)
+        if version != self.cached_version:
+            self.cache.clear()
+            self.cached_version = version
+        return self.cache.lookup(boards, self.network_q_values)
+
+    def network_q_values(self, boards: np.ndarray) -> np.ndarray:
+        process_observation = self.agent.processor.process_observation
+        return self.agent.compute_batch_q_values([[process_observation(board)] for board in boards])
+
+    def act_batch(self, boards: np.ndarray) -> np.ndarray:
+        q_values = self.q_values(boards)
+        legal = self.legal_action_mask(boards) if self.mask_illegal else np.ones(q_values.shape, dtype=bool)
+        policy = self.agent.policy if self.agent.training else self.agent.test_policy
+        return select_legal_actions(policy, q_values, legal, self.random_state)
+
+    def __call__(self, board: np.ndarray) -> int:
+        return int(self.act_batch(board[np.newaxis])[0])
+
+    def reseeded(self, random_state: Any) -> 'BatchedOpponent':
+        """
+        The same opponent (sharing its cache and book), drawing from random_state instead.
+        """
+        opponent = BatchedOpponent(self.agent, self.legal_action_mask, self.mask_illegal, random_state, book=self.book)
+        opponent.cache = self.cache
+        opponent.cached_version = self.cached_version
+        return opponent
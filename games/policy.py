@@ -0,0 +1,121 @@
+"""
+Action selection from a batch of Q-values, restricted to legal actions.
+
+These follow keras-rl's GreedyQPolicy, EpsGreedyQPolicy, BoltzmannQPolicy and MaxBoltzmannQPolicy,
+except that illegal actions are never chosen (so there is no need to ask again), and a whole
+batch of Q-values is handled at once.
+This module doesn't import keras-rl, so it can be used without loading TensorFlow.
+"""
+from typing import Any, NamedTuple, Optional, Tuple
+import numpy as np
+
+DEFAULT_CLIP = (-500., 500.)
+
+
+class QPolicy(NamedTuple):
+    """
+    The settings of one of keras-rl's Q policies, for select_legal_actions, without keras-rl.
+    Eg. QPolicy(eps=0.15, tau=1.) behaves as MaxBoltzmannQPolicy(eps=0.15, tau=1.),
+    and QPolicy() as GreedyQPolicy().
+    """
+    eps: Optional[float] = None
+    tau: Optional[float] = None
+    clip: Tuple[float, float] = DEFAULT_CLIP
+
+
+def as_q_policy(policy: Any) -> QPolicy:
+    """
+    The QPolicy settings of a keras-rl policy, eg. to send to another process without the agent attached.
+
+    >>> class BoltzmannQPolicy:
+    ...     tau = 2.
+    ...     clip = (-500., 500.)
+    >>> as_q_policy(BoltzmannQPolicy())
+    QPolicy(eps=None, tau=2.0, clip=(-500.0, 500.0))
+    """
+    return QPolicy(getattr(policy, 'eps', None), getattr(policy, 'tau', None), getattr(policy, 'clip', DEFAULT_CLIP))
+
+
+def _random_legal(legal: np.ndarray, random_state: Any) -> np.ndarray:
+    return np.argmax(random_state.random_sample(legal.shape) * legal, axis=-1)
+
+
+def greedy(q_values: np.ndarray, legal: np.ndarray) -> np.ndarray:
+    """
+    >>> q_values = np.array([[1., 5., 2.], [3., 2., 1.]])
+    >>> greedy(q_values, np.array([[True, False, True], [True, True, True]]))
+    array([2, 0])
+    """
+    return np.argmax(np.where(legal, q_values, -np.inf), axis=-1)
+
+
+def boltzmann(q_values: np.ndarray, legal: np.ndarray, tau: float = 1., clip: Tuple[float, float] = DEFAULT_CLIP,
+              random_state: Any = np.random) -> np.ndarray:
+    """
+    Samples actions with probability proportional to exp(Q / tau), over the legal actions only.
+
+    >>> q_values = np.array([[0., 0., 0.]] * 1000)
+    >>> legal = np.array([[True, False, True]] * 1000)
+    >>> np.bincount(boltzmann(q_values, legal, random_state=np.random.RandomState(0)), minlength=3)
+    array([517,   0, 483])
+    """
+    exp_values = np.exp(np.clip(q_values.astype('float64') / tau, clip[0], clip[1])) * legal
+    cumulative = np.cumsum(exp_values, axis=-1)
+    thresholds = random_state.random_sample(q_values.shape[:-1] + (1,)) * cumulative[..., -1:]
+    # The first action whose cumulative weight passes the threshold; illegal actions add no weight.
+    return np.minimum((cumulative <= thresholds).sum(axis=-1), q_values.shape[-1] - 1)
+
+
+def eps_greedy(q_values: np.ndarray, legal: np.ndarray, eps: float = .1, random_state: Any = np.random) -> np.ndarray:
+    """
+    Takes a random legal action with probability eps, and the best legal action otherwise.
+
+    >>> q_values = np.array([[1., 5., 2.]] * 1000)
+    >>> legal = np.array([[True, False, True]] * 1000)
+    >>> np.bincount(eps_greedy(q_values, legal, eps=0.2, random_state=np.random.RandomState(0)), minlength=3)
+    array([ 98,   0, 902])
+    """
+    actions = greedy(q_values, legal)
+    explore = random_state.random_sample(actions.shape) < eps
+    actions[explore] = _random_legal(legal[explore], random_state)
+    return actions
+
+
+def max_boltzmann(q_values: np.ndarray, legal: np.ndarray, eps: float = .1, tau: float = 1.,
+                  clip: Tuple[float, float] = DEFAULT_CLIP, random_state: Any = np.random) -> np.ndarray:
+    """
+    Samples from the Boltzmann distribution with probability eps, and takes the best legal action otherwise.
+
+    >>> q_values = np.array([[1., 5., 2.]] * 1000)
+    >>> legal = np.array([[True, False, True]] * 1000)
+    >>> np.bincount(max_boltzmann(q_values, legal, eps=0.2, random_state=np.random.RandomState(0)), minlength=3)
+    array([ 58,   0, 942])
+    """
+    actions = greedy(q_values, legal)
+    explore = random_state.random_sample(actions.shape) < eps
+    actions[explore] = boltzmann(q_values[explore], legal[explore], tau, clip, random_state)
+    return actions
+
+
+def select_legal_actions(policy: Any, q_values: np.ndarray, legal: np.ndarray,
+                         random_state: Optional[Any] = None) -> np.ndarray:
+    """
+    Selects legal actions the way the given keras-rl policy would (or a QPolicy, or anything with the same attributes):
+    MaxBoltzmannQPolicy has eps and tau, BoltzmannQPolicy has tau, EpsGreedyQPolicy has eps,
+    and anything else is treated as GreedyQPolicy.
+    Uses numpy's global random state by default, as keras-rl does.
+
+    >>> select_legal_actions(QPolicy(eps=0.), np.array([[1., 5., 2.]]), np.array([[True, False, True]]))
+    array([2])
+    """
+    random_state = np.random if random_state is None else random_state
+    eps = getattr(policy, 'eps', None)
+    tau = getattr(policy, 'tau', None)
+    clip = getattr(policy, 'clip', DEFAULT_CLIP)
+    if eps is not None and tau is not None:
+        return max_boltzmann(q_values, legal, eps, tau, clip, random_state)
+    if tau is not None:
+        return boltzmann(q_values, legal, tau, clip, random_state)
+    if eps is not None:
+        return eps_greedy(q_values, legal, eps, random_state)
+    return greedy(q_values, legal)
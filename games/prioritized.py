@@ -0,0 +1,179 @@
+"""
+Prioritized experience replay (Schaul et al., 2015): transitions are sampled in proportion to their priority,
+(|TD error| + eps) ** alpha, so that the rare decisive ones (a win, or a missed block) are learnt from more often
+than the many unremarkable mid-game moves. The bias this brings is corrected by importance-sampling weights,
+(N * P(i)) ** -beta, with beta annealed up to 1 over training.
+
+The priorities are kept in a sum-tree, so sampling and updating priorities take O(log n) a transition,
+done for a whole batch at a time with NumPy.
+New transitions get the highest priority seen so far, so that each is sampled at least about once.
+"""
+from typing import Any
+import numpy as np
+
+from games.memory import BoardMemory
+from games.symmetry import SymmetricMemory
+
+
+class SumTree:
+    """
+    A tree of sums over an array of capacity non-negative priorities, kept in one array.
+    Each node has branches children (rather than two, so that the tree is shallower: 4 levels for a million
+    priorities, each a handful of NumPy calls for a whole batch): node 0 is the root, node i's children are nodes
+    branches * i + 1 to branches * (i + 1), and the leaves (the priorities) are the last level.
+
+    >>> tree = SumTree(5, branches=2)
+    >>> tree.update(np.array([0, 1, 3]), np.array([1., 2., 3.]))
+    >>> tree.total, tree.priorities(np.array([1, 2, 3]))
+    (6.0, array([2., 0., 3.]))
+    >>> tree.find(np.array([0., .99, 1., 2.99, 3., 5.99]))  # Leaf i covers [sum of those before, + priority i).
+    array([0, 0, 1, 1, 3, 3])
+    """
+    def __init__(self, capacity: int, branches: int = 32) -> None:
+        self.capacity = capacity
+        self.branches = branches
+        self.depth = 1
+        while branches ** self.depth < capacity:
+            self.depth += 1
+        self.first_leaf = (branches ** self.depth - 1) // (branches - 1)
+        self.nodes = np.zeros(self.first_leaf + branches ** self.depth)
+        self.children = self.nodes[1:].reshape(-1, branches)  # Row i is node i's children.
+
+    @property
+    def total(self) -> float:
+        return float(self.nodes[0])
+
+    def priorities(self, indices: np.ndarray) -> np.ndarray:
+        return self.nodes[self.first_leaf + indices]
+
+    def update(self, indices: np.ndarray, priorities: np.ndarray) -> None:
+        """
+        Sets the priorities of the leaves at indices, and the sums above them, a level at a time.
+        """
+        nodes = self.first_leaf + np.asarray(indices)
+        self.nodes[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = (nodes - 1) // self.branches
+            # Repeated nodes are all set to the same sum, so needn't be removed.
+            self.nodes[nodes] = self.children[nodes].sum(axis=1)
+
+    def find(self, values: np.ndarray) -> np.ndarray:
+        """
+        The leaf covering each value (from 0 up to the total), found by going down from the root:
+        to the child covering the value, less the sum of the children before it.
+        """
+        values = np.array(values, dtype=np.float64)
+        rows = np.arange(len(values))
+        nodes = np.zeros(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            children = self.children[nodes]
+            before = children.cumsum(axis=1) - children
+            # The last child whose sum before it is at most the value, skipping any with no priority.
+            child = (before <= values[:, np.newaxis]).sum(axis=1) - 1
+            values -= before[rows, child]
+            nodes = self.branches * nodes + 1 + child
+        # Rounding can lead past the last priority, into the leaves beyond the capacity.
+        return np.minimum(nodes - self.first_leaf, self.capacity - 1)
+
+
+class PrioritizedBoardMemory(BoardMemory):
+    """
+    A BoardMemory sampled by priority.
+    After each batch is sampled, last_weights holds its importance-sampling weights (the largest being 1),
+    and update_priorities takes the batch's TD errors.
+    Sampling doesn't avoid repeats, unlike SequentialMemory's.
+
+    >>> np.random.seed(0)
+    >>> memory = PrioritizedBoardMemory(limit=10, board_size=3, one_hot=False)
+    >>> for step in range(6):
+    ...     memory.append(np.array([step % 3, 0, 1]), action=step, reward=0., terminal=False)
+    >>> batch = memory.sample_batch(100)  # Only 1 to 4: 0 is the oldest, and 5 the newest.
+    >>> np.bincount(batch.action, minlength=6)
+    array([ 0, 25, 25, 25, 25,  0])
+    >>> memory.update_priorities(np.where(batch.action == 3, 1., 0.))  # Only action 3's transition surprised it.
+    >>> batch = memory.sample_batch(100)
+    >>> np.bincount(batch.action, minlength=6)
+    array([ 0,  2,  1, 96,  1,  0])
+    >>> memory.last_weights[batch.action == 3].max() < memory.last_weights[batch.action != 3].min()
+    True
+    """
+    def __init__(self, *args: Any, alpha: float = .6, beta: float = .4, beta_steps: int = 100000, eps: float = 1e-3,
+                 **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.alpha = alpha
+        self.beta = beta  # Annealed linearly from this to 1 over beta_steps batches.
+        self.beta_steps = beta_steps
+        self.eps = eps
+        self.tree = SumTree(self.limit)
+        self.priorities = self.tree.nodes  # By that name, so that checkpoints keep it with the memory's arrays.
+        self.max_priority = 1.
+        self.batches = 0
+        self.last_positions = np.zeros(0, dtype=np.int64)
+        self.last_weights = np.zeros(0)
+
+    def append_board(self, board: np.ndarray, action: int, reward: float, terminal: bool) -> None:
+        # Only transitions that can be sampled have a priority, so that they needn't be drawn again.
+        # The new one can't until n_step more are appended, and the one n_step before it now can (if it doesn't start
+        # an episode and isn't the oldest, as the entry after the new one now is, if the memory was full).
+        positions, priorities = [self.next_index], [0.]
+        if self.size >= self.n_step:
+            ready = self.size > self.n_step and not self.terminals[(self.next_index - self.n_step - 1) % self.limit]
+            positions.append((self.next_index - self.n_step) % self.limit)
+            priorities.append(self.max_priority if ready else 0.)
+        if self.size == self.limit:
+            positions.append((self.next_index + 1) % self.limit)
+            priorities.append(0.)
+        self.tree.update(np.array(positions), np.array(priorities))
+        super().append_board(board, action, reward, terminal)
+
+    def _entries(self, positions: np.ndarray) -> np.ndarray:
+        start = self.next_index if self.size == self.limit else 0
+        return (positions - start) % self.limit
+
+    def _draw(self, count: int, stratified: bool) -> np.ndarray:
+        """
+        Entries drawn in proportion to their priorities: one from each of count equal slices of the total if stratified.
+        """
+        offsets = np.arange(count) if stratified else 0
+        values = (offsets + np.random.random_sample(count)) * (self.tree.total / (count if stratified else 1))
+        return self._entries(self.tree.find(values))
+
+    def _sample_entries(self, batch_size: int) -> np.ndarray:
+        """
+        As BoardMemory's, except drawn by priority, and with the importance-sampling weights kept in last_weights.
+        """
+        assert self.size >= self.n_step + 2, 'not enough entries in the memory'
+        entries = self._draw(batch_size, stratified=True)
+        while True:
+            # Those that can't be sampled have no priority, but rounding could still pick one: pick again.
+            invalid = (entries < 1) | (entries > self.size - self.n_step - 1) | self.terminals[self._positions(entries - 1)]
+            if not invalid.any():
+                break
+            entries[invalid] = self._draw(int(invalid.sum()), stratified=False)
+
+        self.last_positions = self._positions(entries)
+        beta = min(1., self.beta + (1 - self.beta) * self.batches / self.beta_steps)
+        self.batches += 1
+        probabilities = self.tree.priorities(self.last_positions) / self.tree.total
+        weights = (self.size * probabilities) ** -beta
+        self.last_weights = weights / weights.max()
+        return entries
+
+    def update_priorities(self, td_errors: np.ndarray) -> None:
+        """
+        Sets the priorities of the last batch sampled from its transitions' TD errors.
+        """
+        priorities = (np.abs(td_errors) + self.eps) ** self.alpha
+        self.tree.update(self.last_positions, priorities)
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+
+    def get_config(self) -> dict:
+        config = super().get_config()
+        config.update(alpha=self.alpha, beta=self.beta, beta_steps=self.beta_steps, eps=self.eps)
+        return config
+
+
+class PrioritizedSymmetricMemory(PrioritizedBoardMemory, SymmetricMemory):
+    """
+    A SymmetricMemory sampled by priority: all the versions of a transition share its priority.
+    """
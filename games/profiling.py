@@ -0,0 +1,189 @@
+"""
+Timing of the phases of training, to find where the time goes in a round.
+
+A Profiler times calls to the methods it is asked to wrap (on an env, its opponent, an agent and its processor
+and memory), and whatever is run inside its phase() context.
+Nothing is wrapped unless it is switched on, so profiling costs nothing when it isn't used.
+ProfilingCallback switches it on for one agent.fit call, reports the round as a table when it ends,
+and can write every timed call to a trace file in Chrome's trace event format
+(to open in chrome://tracing or https://ui.perfetto.dev).
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from rl.callbacks import Callback
+
+PERCENTILES = (50, 90, 99)
+
+# The methods wrapped by instrument, with their phase names: the env's, and the agent's or its processor's or memory's.
+# Phases can include others: the env's step includes its checks and the opponent,
+# and the agent's backward includes replay sampling.
+ENV_PHASES = (
+    ('env: win check', '_has_current_player_won'),
+    ('env: threat check', '_can_other_player_win_next'),
+)
+AGENT_PHASES = (
+    ('agent: forward', None, 'forward'),
+    ('agent: backward', None, 'backward'),
+    ('processor', 'processor', 'process_observation'),
+    ('replay sampling', 'memory', 'sample'),
+)
+
+
+class Profiler:
+    """
+    Records how long each call in each phase takes.
+
+    >>> profiler = Profiler()
+    >>> class Env:
+    ...     def _has_current_player_won(self):
+    ...         return False
+    >>> env = Env()
+    >>> profiler.wrap(env, '_has_current_player_won', 'win check')
+    >>> env._has_current_player_won(), env._has_current_player_won()
+    (False, False)
+    >>> with profiler.phase('thinking'):
+    ...     pass
+    >>> profiler.restore()
+    >>> '_has_current_player_won' in vars(env), sorted((name, len(times)) for name, times in profiler.times.items())
+    (False, [('thinking', 1), ('win check', 2)])
+    """
+    def __init__(self, trace: bool = False) -> None:
+        self.trace = trace
+        self.times: Dict[str, List[float]] = {}
+        self.events: List[dict] = []
+        self.start = time.perf_counter()
+        self.rounds: List[dict] = []
+        self._wrapped: List[Tuple[Any, str, Any]] = []
+
+    def record(self, name: str, start: float, duration: float) -> None:
+        self.times.setdefault(name, []).append(duration)
+        if self.trace:
+            self.events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': threading.get_ident(),
+                                'ts': (start - self.start) * 1e6, 'dur': duration * 1e6})
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - start)
+
+    def timed(self, function: Callable[..., Any], name: str) -> Callable[..., Any]:
+        def timed_function(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(name, start, time.perf_counter() - start)
+        return timed_function
+
+    def wrap(self, obj: Any, attribute: str, name: str) -> None:
+        """
+        Times calls to obj.attribute as the named phase, until restore is called.
+        """
+        self._wrapped.append((obj, attribute, vars(obj).get(attribute)))
+        setattr(obj, attribute, self.timed(getattr(obj, attribute), name))
+
+    def instrument(self, env: Any, agent: Any) -> None:
+        """
+        Wraps the env's win and threat checks and its opponent, and the agent's forward and backward passes,
+        processor and replay sampling (any that they have).
+        """
+        for name, attribute in ENV_PHASES:
+            if hasattr(env, attribute):
+                self.wrap(env, attribute, name)
+        if hasattr(env, 'get_opponent_action'):
+            self.wrap(env, 'get_opponent_action', 'opponent')
+        for name, owner, attribute in AGENT_PHASES:
+            obj = agent if owner is None else getattr(agent, owner, None)
+            if hasattr(obj, attribute):
+                self.wrap(obj, attribute, name)
+
+    def restore(self) -> None:
+        """
+        Puts back everything that was wrapped.
+        """
+        for obj, attribute, original in reversed(self._wrapped):
+            if original is None:
+                delattr(obj, attribute)
+            else:
+                setattr(obj, attribute, original)
+        self._wrapped = []
+
+    def summary(self, wall_time: float) -> Dict[str, dict]:
+        """
+        For each phase: calls, total seconds, share of the wall time, calls per second (of wall time),
+        and percentiles of the time per call in milliseconds.
+        """
+        summary = {}
+        for name, times in self.times.items():
+            percentiles = np.percentile(times, PERCENTILES) * 1000
+            summary[name] = {'calls': len(times), 'total': sum(times), 'share': sum(times) / wall_time,
+                             'calls_per_sec': len(times) / wall_time,
+                             **{f'p{p}_ms': float(value) for p, value in zip(PERCENTILES, percentiles)}}
+        return summary
+
+    def end_round(self, name: str, wall_time: float) -> str:
+        """
+        Keeps the summary of the phases timed since the last round ended, and returns it as a table.
+        """
+        summary = self.summary(wall_time)
+        self.rounds.append({'round': name, 'wall_time': wall_time, 'phases': summary})
+        self.times = {}
+        lines = [f'  {name}: {wall_time:.1f}s',
+                 f'  {"phase":<18} {"calls":>8} {"total s":>8} {"share":>6} {"calls/s":>9} '
+                 + ' '.join(f'{f"p{p} ms":>8}' for p in PERCENTILES)]
+        for phase, stats in sorted(summary.items(), key=lambda item: -item[1]['total']):
+            lines.append(f'  {phase:<18} {stats["calls"]:>8} {stats["total"]:>8.2f} {stats["share"]:>6.1%} '
+                         f'{stats["calls_per_sec"]:>9.0f} '
+                         + ' '.join(f'{stats[f"p{p}_ms"]:>8.3f}' for p in PERCENTILES))
+        return '\n'.join(lines)
+
+    def write_trace(self, path: str) -> None:
+        """
+        Writes every call timed so far, and the summary of each round, as a Chrome trace file.
+        """
+        with open(path, 'w', encoding='utf-8') as trace_file:
+            json.dump({'traceEvents': self.events, 'rounds': self.rounds}, trace_file)
+
+
+class ProfilingCallback(Callback):
+    """
+    A keras-rl callback that profiles one fit (or test) call: the whole of each step, the env's step,
+    and the phases wrapped by Profiler.instrument.
+    At the end it prints the round's table (under the given name) and, given trace_path, rewrites the trace file.
+    """
+    def __init__(self, profiler: Profiler, name: str = 'round', trace_path: Optional[str] = None) -> None:
+        super().__init__()
+        self.profiler = profiler
+        self.name = name
+        self.trace_path = trace_path
+        self.train_start = self.step_start = self.action_start = 0.
+
+    def on_train_begin(self, logs: Optional[dict] = None) -> None:
+        self.profiler.instrument(self.env, self.model)
+        self.train_start = time.perf_counter()
+
+    def on_step_begin(self, step: int, logs: Optional[dict] = None) -> None:
+        self.step_start = time.perf_counter()
+
+    def on_step_end(self, step: int, logs: Optional[dict] = None) -> None:
+        self.profiler.record('step', self.step_start, time.perf_counter() - self.step_start)
+
+    def on_action_begin(self, action: int, logs: Optional[dict] = None) -> None:
+        self.action_start = time.perf_counter()
+
+    def on_action_end(self, action: int, logs: Optional[dict] = None) -> None:
+        self.profiler.record('env: step', self.action_start, time.perf_counter() - self.action_start)
+
+    def on_train_end(self, logs: Optional[dict] = None) -> None:
+        self.profiler.restore()
+        # After a new line, since keras-rl's progress bar (which ends after this) doesn't end with one.
+        print('\n' + self.profiler.end_round(self.name, time.perf_counter() - self.train_start))
+        if self.trace_path is not None:
+            self.profiler.write_trace(self.trace_path)
@@ -0,0 +1,224 @@
+"""
+Collects training experience in worker processes, to use every core.
+
+Each worker plays a batch of games in one of the vector envs (see vector_env.py), choosing the agent's
+moves with a NumPy copy of its network (see numpy_network.py), so the workers never load TensorFlow.
+Finished episodes are sent back over the pool's pipes, in a fixed order, and replayed into the
+agent's memory and training steps just as agent.fit would have made them.
+The workers play each batch of sync_steps steps while the agent learns from the one before,
+with the weights it had before that one: the most recent it can have without waiting.
+
+Given the same seed, number of workers and starting weights, the same games are played.
+"""
+import itertools
+import multiprocessing
+import os
+from typing import Any, Iterator, List, NamedTuple, Optional, Type
+import numpy as np
+
+from games.encoding import OneHotProcessor
+from games.numpy_network import NumpyQNetwork
+from games.opponent import BatchedOpponent
+from games.policy import QPolicy, as_q_policy, select_legal_actions
+
+
+class Episode(NamedTuple):
+    observations: np.ndarray  # (steps + 1, board size) raw boards, ending with the final board
+    actions: np.ndarray  # (steps,)
+    rewards: np.ndarray  # (steps,)
+
+
+class RolloutJob(NamedTuple):
+    env_class: Type[Any]  # A vector env class, eg. VectorConnect4Env
+    num_envs: int
+    steps: int
+    weights: List[np.ndarray]
+    policy: QPolicy
+    opponent_weights: Optional[List[np.ndarray]]  # None to play random legal moves
+    opponent_policy: QPolicy
+    seed: int
+    mask_illegal: bool = False  # Whether the agent only picks legal moves, as MaskedDQNAgent does.
+    perspective: bool = False  # Whether the agent's processor uses the perspective encoding (see encoding.py).
+    opponent_perspective: bool = False  # And the opponent's.
+
+
+def get_weights(agent: Any) -> List[np.ndarray]:
+    """
+    The weights of a keras-rl DQNAgent's model, or of a NumpyQNetwork.
+    """
+    model = getattr(agent, 'model', agent)
+    return model.get_weights()
+
+
+def _network(weights: List[np.ndarray], policy: QPolicy, random_state: Any, perspective: bool) -> NumpyQNetwork:
+    network = NumpyQNetwork(list(zip(weights[::2], weights[1::2])), policy=policy, random_state=random_state,
+                            processor=OneHotProcessor(perspective, deferred=True))
+    network.training = True
+    return network
+
+
+def run_rollout(job: RolloutJob) -> List[Episode]:
+    """
+    Plays at least job.steps steps, in whole episodes, and returns those episodes in the order they finished.
+    Episodes still going once enough steps are collected are played out too (rather than dropped,
+    which would favour short games).
+
+    >>> from games.nac.vector_env import VectorNacEnv
+    >>> weights = [np.random.RandomState(0).randn(27, 9)]
+    >>> job = RolloutJob(VectorNacEnv, 4, 50, weights + [np.zeros(9)], QPolicy(eps=.2), None, QPolicy(), seed=0)
+    >>> episodes = run_rollout(job)
+    >>> sum(len(episode.actions) for episode in episodes) >= 50
+    True
+    >>> all(len(episode.observations) == len(episode.actions) + 1 for episode in episodes)
+    True
+    >>> [np.array_equal(a.observations, b.observations) for a, b in zip(episodes, run_rollout(job))][:3]
+    [True, True, True]
+    """
+    random_state = np.random.RandomState(job.seed)
+    agent = _network(job.weights, job.policy, random_state, job.perspective)
+    opponent = None
+    if job.opponent_weights is not None:
+        opponent_network = _network(job.opponent_weights, job.opponent_policy, random_state,
+                                    job.opponent_perspective)
+        opponent = BatchedOpponent(opponent_network, job.env_class.legal_action_mask,
+                                   random_state=random_state).act_batch
+    env = job.env_class(job.num_envs, get_opponent_actions=opponent, seed=job.seed)
+
+    boards = env.reset()
+    trajectories: List[List[Any]] = [[[board], [], []] for board in boards]
+    active = np.ones(job.num_envs, dtype=bool)
+    episodes: List[Episode] = []
+    collected = 0
+    while active.any():
+        # As in agent.fit, the agent's own moves are only masked if it masks them itself,
+        # otherwise it still learns what is illegal.
+        q_values = agent.compute_batch_q_values(boards[:, np.newaxis])
+        legal = env.legal_action_mask(boards) if job.mask_illegal else np.ones(q_values.shape, dtype=bool)
+        actions = select_legal_actions(agent.policy, q_values, legal, random_state)
+        boards, rewards, dones, infos = env.step(actions)
+        for i in np.flatnonzero(active):
+            observations, episode_actions, episode_rewards = trajectories[i]
+            episode_actions.append(actions[i])
+            episode_rewards.append(rewards[i])
+            if dones[i]:
+                observations.append(infos[i]['terminal_observation'])
+                episodes.append(Episode(np.array(observations), np.array(episode_actions),
+                                        np.array(episode_rewards, dtype=np.float32)))
+                collected += len(episode_actions)
+                trajectories[i] = [[boards[i]], [], []]
+                active[i] = collected < job.steps
+            else:
+                observations.append(boards[i])
+    return episodes
+
+
+def learn_from_episode(agent: Any, episode: Episode) -> None:
+    """
+    Feeds an episode to a keras-rl DQNAgent one step at a time, as agent.fit does,
+    so that it is stored in the agent's memory and trained on in the same way.
+    """
+    process_observation = agent.processor.process_observation
+    last = len(episode.actions) - 1
+    for step, (action, reward) in enumerate(zip(episode.actions, episode.rewards)):
+        agent.recent_observation = process_observation(episode.observations[step])
+        agent.recent_action = int(action)
+        agent.backward(float(reward), terminal=step == last)
+        agent.step += 1
+    # agent.fit also stores the final observation, with no reward, to mark the end of the episode.
+    # Its action is never learnt from (as the memory never starts a transition after a terminal one),
+    # so rather than the action agent.fit would pick for it, it is given 0, not the last move's.
+    agent.recent_observation = process_observation(episode.observations[-1])
+    agent.recent_action = 0
+    agent.backward(0., terminal=False)
+
+
+class ParallelRollouts:
+    """
+    A pool of worker processes playing games for a learner.
+    Use it as a context manager, or call close() when done.
+
+    >>> from games.nac.vector_env import VectorNacEnv
+    >>> network = NumpyQNetwork([(np.random.RandomState(0).randn(27, 9), np.zeros(9))], policy=QPolicy(eps=.2))
+    >>> def first_boards(seed):
+    ...     with ParallelRollouts(workers=2, seed=seed) as rollouts:
+    ...         return [episode.observations[1] for episode in rollouts.collect(VectorNacEnv, network, 40)]
+    >>> boards = first_boards(seed=3)
+    >>> len(boards) >= 40 // 9
+    True
+    >>> all(np.array_equal(a, b) for a, b in zip(boards, first_boards(seed=3)))
+    True
+    """
+    def __init__(self, workers: Optional[int] = None, envs_per_worker: int = 16, seed: int = 0) -> None:
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.envs_per_worker = envs_per_worker
+        self.seed = seed
+        self.round = 0
+        # Workers are spawned rather than forked, since forking a process running TensorFlow isn't safe.
+        self.pool = multiprocessing.get_context('spawn').Pool(self.workers)
+
+    def __enter__(self) -> 'ParallelRollouts':
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.pool.close()
+        self.pool.join()
+
+    def collect(self, env_class: Type[Any], agent: Any, steps: int, opponent: Optional[Any] = None) -> Iterator[Episode]:
+        """
+        Plays at least steps steps with the agent's current weights and training policy, split between the workers,
+        against the opponent (with its training policy) or else random legal moves.
+        Gives the episodes of each worker in turn, as soon as that worker is done.
+        The workers start straight away, so the caller can get on with something else (eg. learning) meanwhile.
+        """
+        seeds = np.random.SeedSequence([self.seed, self.round]).generate_state(self.workers)
+        self.round += 1
+        weights = get_weights(agent)
+        opponent_weights = None if opponent is None else get_weights(opponent)
+        opponent_policy = QPolicy() if opponent is None else as_q_policy(opponent.policy)
+        worker_steps = -(-steps // self.workers)
+        jobs = [RolloutJob(env_class, self.envs_per_worker, worker_steps, weights, as_q_policy(agent.policy),
+                           opponent_weights, opponent_policy, int(seed), getattr(agent, 'mask_illegal', False),
+                           getattr(agent.processor, 'perspective', False),
+                           getattr(getattr(opponent, 'processor', None), 'perspective', False))
+                for seed in seeds]
+        return itertools.chain.from_iterable(self.pool.imap(run_rollout, jobs))
+
+
+def train_parallel(agent: Any, env_class: Type[Any], rollouts: ParallelRollouts, steps: int = 10000,
+                   opponent: Optional[Any] = None, sync_steps: int = 1000, verbose: bool = True) -> Any:
+    """
+    Trains a keras-rl DQNAgent for about steps steps (rounded up to whole episodes) on games played by the rollout workers,
+    in batches of sync_steps steps. While it learns from each batch, the workers play the next with its weights from
+    before that batch, so they are up to two batches behind rather than one, but neither side waits for the other.
+
+    >>> from games.nac.env import NacEnv
+    >>> from games.nac.vector_env import VectorNacEnv
+    >>> from games.numpy_dqn import get_numpy_dqn_agent
+    >>> agent = get_numpy_dqn_agent(NacEnv(), nb_steps_warmup=50, random_state=np.random.RandomState(0))
+    >>> with ParallelRollouts(workers=2) as rollouts:
+    ...     _ = train_parallel(agent, VectorNacEnv, rollouts, steps=300, sync_steps=100, verbose=False)
+    >>> agent.step >= 300, agent.optimizer.iterations > 0
+    (True, True)
+    """
+    agent.training = True
+    trained = 0
+    requested = min(sync_steps, steps)
+    batch: Optional[Iterator[Episode]] = rollouts.collect(env_class, agent, requested, opponent)
+    while batch is not None:
+        # A batch plays a little over the steps it asks for, to finish its episodes: the batch after next asks for less.
+        next_requested = min(sync_steps, steps - trained - requested)
+        next_batch = rollouts.collect(env_class, agent, next_requested, opponent) if next_requested > 0 else None
+        episodes = 0
+        total_reward = 0.
+        for episode in batch:
+            learn_from_episode(agent, episode)
+            trained += len(episode.actions)
+            episodes += 1
+            total_reward += float(episode.rewards.sum())
+        if verbose:
+            print(f'  {trained}/{steps} steps: {episodes} episodes, mean reward {total_reward / episodes:.3f}')
+        batch, requested = next_batch, next_requested
+    return agent
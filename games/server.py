@@ -0,0 +1,403 @@
+"""
+A local move server, which loads a game's agents once and plays any number of games at a time against clients,
+and a thin terminal client to play it from.
+
+The server speaks one JSON object a line over TCP, and keeps each game's position by the session ID its client
+picked, so games are independent of connections. Moves asked for within a few milliseconds of each other
+are answered together, by one forward pass through each player's network (see opponent.py).
+The agents are played from their weights in NumPy (see numpy_agent.py), so the server never loads TensorFlow.
+Connect 4 agents can look their openings up in books of their Q-values (see connect4/book.py), one for each player.
+
+    python -m games.server serve nac [--weights PATH_BASE] [--port PORT]
+    python -m games.server serve connect4 --weights PATH_BASE [--books BOOK_1 BOOK_2] [--port PORT]
+    python -m games.server play nac [--second] [--port PORT]
+
+Requests, and their replies:
+    {"op": "new", "session": ID, "agent_first": BOOL} -> {"board": [...], "done": BOOL, "winner": MARK}
+    {"op": "move", "session": ID, "action": N} -> the same, after the agent's reply (unless the game is over).
+    {"op": "stats"} -> {"sessions": ..., "moves": ..., "batches": ..., "p50_ms": ..., "p99_ms": ...}
+winner is 1 or 2 for the mark that won, 0 for a tie, and null while the game goes on; a game's session ends with it,
+or once it has gone unused for SESSION_TIMEOUT. A session takes one move at a time.
+Bad requests (such as illegal moves, or moves sent before the last one is answered) get {"error": MESSAGE},
+and change nothing; so do moves the agent fails to answer.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import socket
+import sys
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Optional, Set, Tuple, Type
+import numpy as np
+
+from games.connect4.bitboard import Connect4State
+from games.connect4.book import OpeningBook
+from games.connect4.env import Connect4Env, NUM_POSITIONS
+from games.connect4 import numpy_agent as connect4_numpy_agent
+from games.connect4.vector_env import legal_action_mask as connect4_legal_action_mask
+from games.nac.bitboard import NacState
+from games.nac.env import NacEnv
+from games.nac import numpy_agent as nac_numpy_agent
+from games.nac.vector_env import legal_action_mask as nac_legal_action_mask
+from games.opponent import CACHE_SIZE, BatchedOpponent
+
+PORT = 5007
+BATCH_WINDOW = 0.002  # Seconds to wait for more moves to answer along with the first.
+MAX_BATCH = 256
+LATENCY_SAMPLES = 10000  # The most recent move latencies kept for the percentiles.
+SESSION_TIMEOUT = 3600.  # Seconds a session is kept unused before it is dropped.
+
+
+class Game(NamedTuple):
+    state_class: Type[Any]  # The game's bitboard state (see bitboard.py), which knows the rules.
+    board_size: int
+    legal_action_mask: Callable[[np.ndarray], np.ndarray]
+    load_agents: Callable[[str], Tuple[Any, Any]]  # From a path base, as save_agents saves them.
+    weights: Optional[str]  # The default path base, if the game has saved agents.
+    env_class: Type[Any]  # For rendering the board.
+    module: str  # The game's package, for its play_human.
+
+
+GAMES = {
+    'nac': Game(NacState, 9, nac_legal_action_mask, nac_numpy_agent.load_numpy_agents,
+                os.path.join(os.path.dirname(__file__), 'nac', 'weights', 'weights'), NacEnv, 'games.nac'),
+    'connect4': Game(Connect4State, NUM_POSITIONS, connect4_legal_action_mask, connect4_numpy_agent.load_numpy_agents,
+                     None, Connect4Env, 'games.connect4'),
+}
+
+
+class Session(NamedTuple):
+    state: Any
+    last_used: float  # By time.monotonic().
+
+
+class LatencyStats:
+    """
+    The percentiles of the most recent latencies recorded.
+
+    >>> stats = LatencyStats()
+    >>> for seconds in range(1, 101):
+    ...     stats.record(seconds / 1000)
+    >>> stats.count, round(stats.percentile(50), 1), round(stats.percentile(99), 1)
+    (100, 50.5, 99.0)
+    """
+    def __init__(self, size: int = LATENCY_SAMPLES) -> None:
+        self.latencies: Deque[float] = deque(maxlen=size)
+        self.count = 0
+
+    def record(self, seconds: float) -> None:
+        self.latencies.append(seconds)
+        self.count += 1
+
+    def percentile(self, percent: float) -> float:
+        """
+        In milliseconds (and 0 before any are recorded).
+        """
+        return float(np.percentile(list(self.latencies), percent)) * 1000 if self.latencies else 0.
+
+
+class MoveBatcher:
+    """
+    Answers requests for the agents' moves in batches: the moves asked for within window seconds of the first pending
+    one (or up to max_batch of them) are answered together, by one act_batch call for each player's opponent.
+
+    >>> from games.nac.vector_env import legal_action_mask
+    >>> class Agent:  # Prefers the highest numbered square.
+    ...     training = False
+    ...     test_policy = None
+    ...     class processor:
+    ...         process_observation = staticmethod(lambda board: board)
+    ...     def compute_batch_q_values(self, state_batch):
+    ...         return np.tile(np.arange(9.), (len(state_batch), 1))
+    >>> batcher = MoveBatcher({mark: BatchedOpponent(Agent(), legal_action_mask) for mark in (1, 2)})
+    >>> async def ask():
+    ...     return await asyncio.gather(*[batcher.move(NacState.from_board(board)) for board in
+    ...                                   np.array([[0] * 9, [0] * 8 + [1], [0] * 7 + [2, 1]])])
+    >>> asyncio.run(ask()), batcher.batches
+    ([8, 7, 6], 1)
+
+    If an opponent fails, the moves waiting on it fail with its error.
+    >>> batcher.opponents[1].agent = None
+    >>> asyncio.run(ask())
+    Traceback (most recent call last):
+    ...
+    AttributeError: 'NoneType' object has no attribute 'processor'
+    """
+    def __init__(self, opponents: Dict[int, BatchedOpponent], window: float = BATCH_WINDOW,
+                 max_batch: int = MAX_BATCH) -> None:
+        self.opponents = opponents  # By the mark they play.
+        self.window = window
+        self.max_batch = max_batch
+        self.pending: List[Tuple[Any, 'asyncio.Future[int]']] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.batches = 0
+
+    async def move(self, state: Any) -> int:
+        loop = asyncio.get_running_loop()
+        future: 'asyncio.Future[int]' = loop.create_future()
+        self.pending.append((state, future))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        pending, self.pending = self.pending, []
+        for mark, opponent in self.opponents.items():
+            requests = [(state, future) for state, future in pending if state.mark == mark]
+            if requests:
+                try:
+                    actions = opponent.act_batch(np.array([state.board() for state, _ in requests]))
+                except Exception as error:  # pylint: disable=broad-except
+                    for _, future in requests:
+                        if not future.done():
+                            future.set_exception(error)
+                    continue
+                for (_, future), action in zip(requests, actions.tolist()):
+                    if not future.done():  # Unless cancelled, by its client going away.
+                        future.set_result(action)
+        self.batches += 1
+
+
+class MoveServer:
+    """
+    Plays the game's agents against its clients' moves, in as many sessions as they start,
+    dropping those unused for session_timeout seconds. Each agent looks its Q-values up in its book first, if given one.
+
+    >>> class Agent:  # Prefers the highest numbered square.
+    ...     training = False
+    ...     test_policy = None
+    ...     class processor:
+    ...         process_observation = staticmethod(lambda board: board)
+    ...     def compute_batch_q_values(self, state_batch):
+    ...         return np.tile(np.arange(9.), (len(state_batch), 1))
+    >>> server = MoveServer(GAMES['nac'], (Agent(), Agent()))
+    >>> async def play(*requests):
+    ...     return [await server.respond(request) for request in requests]
+    >>> for reply in asyncio.run(play({'op': 'new', 'session': 'a', 'agent_first': True},
+    ...                               {'op': 'move', 'session': 'a', 'action': 8},
+    ...                               {'op': 'move', 'session': 'a', 'action': 0},
+    ...                               {'op': 'move', 'session': 'a', 'action': 4},
+    ...                               {'op': 'move', 'session': 'a', 'action': 3})):
+    ...     print(reply)
+    {'board': [0, 0, 0, 0, 0, 0, 0, 0, 1], 'done': False, 'winner': None}
+    {'error': 'illegal move: 8'}
+    {'board': [2, 0, 0, 0, 0, 0, 0, 1, 1], 'done': False, 'winner': None}
+    {'board': [2, 0, 0, 0, 2, 0, 1, 1, 1], 'done': True, 'winner': 1}
+    {'error': 'no such session: a'}
+    >>> stats = asyncio.run(server.respond({'op': 'stats'}))
+    >>> stats['sessions'], stats['moves'], stats['batches']
+    (0, 3, 3)
+
+    Requests need a session ID, and moves a square's number.
+    >>> for reply in asyncio.run(play({'op': 'new', 'agent_first': True},
+    ...                               {'op': 'new', 'session': 'c', 'agent_first': False},
+    ...                               {'op': 'move', 'session': 'c', 'action': True})):
+    ...     print(reply)
+    {'error': 'expected a session ID, not null'}
+    {'board': [0, 0, 0, 0, 0, 0, 0, 0, 0], 'done': False, 'winner': None}
+    {'error': 'illegal move: True'}
+
+    A session's second move, sent before its first is answered, is turned away.
+    >>> for reply in asyncio.run(play({'op': 'new', 'session': 'b', 'agent_first': False})):
+    ...     print(reply)
+    {'board': [0, 0, 0, 0, 0, 0, 0, 0, 0], 'done': False, 'winner': None}
+    >>> async def play_at_once(*requests):
+    ...     return await asyncio.gather(*[server.respond(request) for request in requests])
+    >>> for reply in asyncio.run(play_at_once({'op': 'move', 'session': 'b', 'action': 0},
+    ...                                       {'op': 'move', 'session': 'b', 'action': 1})):
+    ...     print(reply)
+    {'board': [1, 0, 0, 0, 0, 0, 0, 0, 2], 'done': False, 'winner': None}
+    {'error': 'a move is already pending in session: b'}
+
+    So is a move the agent fails to answer, and sessions left unused are dropped.
+    >>> server.batcher.opponents[2].agent = None
+    >>> asyncio.run(server.respond({'op': 'move', 'session': 'b', 'action': 1}))
+    {'error': "the agent could not move: 'NoneType' object has no attribute 'processor'"}
+    >>> server.session_timeout = 0.
+    >>> asyncio.run(server.respond({'op': 'stats'}))['sessions']
+    0
+    """
+    def __init__(self, game: Game, agents: Tuple[Any, Any], window: float = BATCH_WINDOW,
+                 session_timeout: float = SESSION_TIMEOUT, books: Tuple[Any, Any] = (None, None)) -> None:
+        self.game = game
+        opponents = {mark: BatchedOpponent(agent, game.legal_action_mask, cache_size=CACHE_SIZE, book=book)
+                     for mark, agent, book in zip((1, 2), agents, books)}
+        self.batcher = MoveBatcher(opponents, window)
+        self.session_timeout = session_timeout
+        # Each game's state, by session ID, least recently used first.
+        self.sessions: 'OrderedDict[str, Session]' = OrderedDict()
+        self.moving: Set[str] = set()  # The sessions waiting on the agent's move.
+        self.latency = LatencyStats()
+
+    async def respond(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        self._evict()
+        op = request.get('op')
+        if op == 'stats':
+            return {'sessions': len(self.sessions), 'moves': self.latency.count, 'batches': self.batcher.batches,
+                    'p50_ms': self.latency.percentile(50), 'p99_ms': self.latency.percentile(99)}
+        session = request.get('session')
+        if not isinstance(session, str):
+            return {'error': f'expected a session ID, not {json.dumps(session)}'}
+        if session in self.moving:
+            return {'error': f'a move is already pending in session: {session}'}
+        if op == 'new':
+            state = self.game.state_class.from_board(np.zeros(self.game.board_size, dtype=np.int8))
+            return await self._reply(session, state, agent_to_move=bool(request.get('agent_first')))
+        if op == 'move':
+            if session not in self.sessions:
+                return {'error': f'no such session: {session}'}
+            state = self.sessions[session].state
+            action = request.get('action')
+            if not isinstance(action, int) or isinstance(action, bool) or action not in state.legal_actions():
+                return {'error': f'illegal move: {action}'}
+            return await self._reply(session, state.play(action), agent_to_move=True)
+        return {'error': f'unknown op: {op}'}
+
+    async def _reply(self, session: str, state: Any, agent_to_move: bool) -> Dict[str, Any]:
+        start = time.perf_counter()
+        winner = _winner(state)
+        if winner is None and agent_to_move:
+            self.moving.add(session)
+            try:
+                action = await self.batcher.move(state)
+            except Exception as error:  # pylint: disable=broad-except
+                return {'error': f'the agent could not move: {error}'}
+            finally:
+                self.moving.discard(session)
+            state = state.play(action)
+            winner = _winner(state)
+            self.latency.record(time.perf_counter() - start)
+        self.sessions.pop(session, None)
+        if winner is None:
+            self.sessions[session] = Session(state, time.monotonic())
+        return {'board': state.board().tolist(), 'done': winner is not None, 'winner': winner}
+
+    def _evict(self) -> None:
+        """
+        Drops the sessions unused for session_timeout (the least recently used come first).
+        """
+        expired = time.monotonic() - self.session_timeout
+        while self.sessions and next(iter(self.sessions.values())).last_used <= expired:
+            self.sessions.popitem(last=False)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Answers one connection's requests, a line each, until it closes.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    reply = await self.respond(request) if isinstance(request, dict) else {'error': 'expected an object'}
+                except ValueError as error:
+                    reply = {'error': str(error)}
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, port: int = PORT) -> None:
+        server = await asyncio.start_server(self.handle, 'localhost', port)
+        print(f'Serving moves on localhost:{port}', flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+def _winner(state: Any) -> Optional[int]:
+    """
+    The mark that has won (or 0 for a tie), once the game is over.
+    """
+    outcome = state.outcome()
+    if outcome is None:
+        return None
+    return 3 - state.mark if outcome == 1 else 0
+
+
+class MoveClient:
+    """
+    Sends requests to a move server, and waits for each reply.
+    """
+    def __init__(self, port: int = PORT) -> None:
+        self.connection = socket.create_connection(('localhost', port))
+        self.stream = self.connection.makefile('rw', encoding='utf-8')
+
+    def request(self, **request: Any) -> Dict[str, Any]:
+        self.stream.write(json.dumps(request) + '\n')
+        self.stream.flush()
+        reply: Dict[str, Any] = json.loads(self.stream.readline())
+        return reply
+
+    def close(self) -> None:
+        self.stream.close()
+        self.connection.close()
+
+
+def play_remote(game_name: str, agent_first: bool = True, port: int = PORT) -> None:
+    """
+    Plays a game against the server's agent from the terminal, as play_human does.
+    """
+    game = GAMES[game_name]
+    get_human_action = importlib.import_module(f'{game.module}.play_human').get_human_action
+    client = MoveClient(port)
+    session = uuid.uuid4().hex
+    try:
+        reply = client.request(op='new', session=session, agent_first=agent_first)
+        while not reply['done']:
+            action = get_human_action(np.array(reply['board'], dtype=np.int8))
+            move = client.request(op='move', session=session, action=action)
+            if 'error' in move:
+                print(move['error'])
+            else:
+                reply = move
+    finally:
+        client.close()
+    env = game.env_class()
+    env.board = np.array(reply['board'], dtype=np.int8)
+    env.render()
+    human = 2 if agent_first else 1
+    print(f"Game over: {'You won' if reply['winner'] == human else 'Tied' if reply['winner'] == 0 else 'You lost'}\n")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Serve moves from a game\'s agents, or play them from the terminal.')
+    parser.add_argument('command', choices=['serve', 'play'])
+    parser.add_argument('game', choices=sorted(GAMES))
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--weights', help='the path base the agents were saved with (serve; default: the saved agents)')
+    parser.add_argument('--books', nargs=2, metavar=('BOOK_1', 'BOOK_2'),
+                        help='opening books of the first and second player\'s Q-values (serve; connect4 only)')
+    parser.add_argument('--second', action='store_true', help='play second (play)')
+    args = parser.parse_args(argv)
+    game = GAMES[args.game]
+    if args.command == 'play':
+        play_remote(args.game, agent_first=args.second, port=args.port)
+        return 0
+    weights = args.weights or game.weights
+    if weights is None:
+        parser.error(f'{args.game} has no saved agents: give --weights')
+    if args.books and args.game != 'connect4':
+        parser.error('only connect4 has opening books')
+    books = (OpeningBook(args.books[0]), OpeningBook(args.books[1])) if args.books else (None, None)
+    server = MoveServer(game, game.load_agents(weights), books=books)
+    try:
+        asyncio.run(server.serve(args.port))
+    except KeyboardInterrupt:
+        print(f'{server.latency.count} moves, p50 {server.latency.percentile(50):.2f}ms, '
+              f'p99 {server.latency.percentile(99):.2f}ms')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
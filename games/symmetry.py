@@ -0,0 +1,113 @@
+"""
+Symmetries of the game boards, for getting more training data from each move played,
+and for reducing boards to one canonical form.
+"""
+from typing import Any, Optional, Tuple
+import numpy as np
+
+from games.memory import BoardMemory, ExperienceBatch, pack_boards
+
+SQUARES_PER_KEY = 32  # Two bits a square, in a uint64.
+
+
+class Symmetries:
+    """
+    A group of symmetries of a board, given as permutations:
+    symmetry i takes a board to board[..., squares[i]], and an action a to actions[i, a].
+    The first is the identity.
+
+    >>> flip = Symmetries(squares=np.array([[0, 1, 2], [2, 1, 0]]), actions=np.array([[0, 1, 2], [2, 1, 0]]))
+    >>> flip.boards(np.array([1, 0, 2]))
+    array([[1, 0, 2],
+           [2, 0, 1]])
+    >>> flip.canonical(np.array([[1, 0, 2], [2, 0, 1], [0, 1, 0]]))
+    (array([[1, 0, 2],
+           [1, 0, 2],
+           [0, 1, 0]]), array([0, 1, 0]))
+    """
+    def __init__(self, squares: np.ndarray, actions: np.ndarray) -> None:
+        self.squares = squares
+        self.actions = actions
+        self.inverse_actions = np.argsort(actions, axis=1)
+        board_size = squares.shape[1]
+        key_squares = -(-board_size // SQUARES_PER_KEY) * SQUARES_PER_KEY
+        # Earlier squares are more significant, so comparing keys compares boards square by square.
+        self.key_shifts = (2 * (SQUARES_PER_KEY - 1 - np.arange(key_squares) % SQUARES_PER_KEY)).astype(np.uint64)
+        self.key_shifts = self.key_shifts[:board_size]
+
+    def __len__(self) -> int:
+        return len(self.squares)
+
+    def boards(self, boards: np.ndarray) -> np.ndarray:
+        """
+        Every symmetric version of each board: (..., len(self), board size).
+        """
+        return boards[..., self.squares]
+
+    def _keys(self, boards: np.ndarray) -> np.ndarray:
+        """
+        Numbers that sort in the same order as the boards do (square by square), in one or more uint64s.
+        """
+        chunks = np.split(boards.astype(np.uint64) << self.key_shifts,
+                          range(SQUARES_PER_KEY, boards.shape[-1], SQUARES_PER_KEY), axis=-1)
+        return np.stack([np.bitwise_or.reduce(chunk, axis=-1) for chunk in chunks], axis=-1)
+
+    def canonical(self, boards: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The smallest of the symmetric versions of each board, and the index of the symmetry that gives it.
+        Symmetric boards have the same canonical board.
+        An action a in the original board is actions[index, a] in the canonical one,
+        and canonical action c is inverse_actions[index, c] in the original board.
+        """
+        variants = self.boards(boards)
+        keys = self._keys(variants)
+        smallest = np.ones(keys.shape[:-1], dtype=bool)
+        for chunk in range(keys.shape[-1]):
+            chunk_keys = np.where(smallest, keys[..., chunk], np.iinfo(np.uint64).max)
+            smallest &= chunk_keys == chunk_keys.min(axis=-1, keepdims=True)
+        index = smallest.argmax(axis=-1)
+        canonical = np.take_along_axis(variants, index[..., np.newaxis, np.newaxis], axis=-2)[..., 0, :]
+        return canonical, index
+
+
+class SymmetricMemory(BoardMemory):
+    """
+    A BoardMemory that stores every symmetric version of each transition it is given,
+    and samples from all of them: a transition is sampled in one of its versions, picked at random.
+    So each real transition gives len(symmetries) training transitions.
+
+    >>> flip = Symmetries(squares=np.array([[0, 1, 2], [2, 1, 0]]), actions=np.array([[0, 1, 2], [2, 1, 0]]))
+    >>> memory = SymmetricMemory(limit=10, board_size=3, symmetries=flip, one_hot=False)
+    >>> for step in range(4):
+    ...     memory.append(np.array([step % 3, 0, 1]), action=step % 3, reward=step, terminal=False)
+    >>> batch = memory.sample_batch(40)
+    >>> sorted({(tuple(board[0]), action) for board, action in zip(batch.state0, batch.action)})
+    [((1, 0, 1), 1), ((1, 0, 2), 0), ((2, 0, 1), 2)]
+    """
+    def __init__(self, limit: int, board_size: int, symmetries: Symmetries, one_hot: bool = True, **kwargs: Any) -> None:
+        super().__init__(limit, board_size, one_hot, **kwargs)
+        self.symmetries = symmetries
+        self.boards = np.zeros((limit, len(symmetries), self.boards.shape[1]), dtype=np.uint8)
+        self.actions = np.zeros((limit, len(symmetries)), dtype=np.uint8)
+
+    def append_board(self, board: np.ndarray, action: int, reward: float, terminal: bool) -> None:
+        self.boards[self.next_index] = pack_boards(self.symmetries.boards(board))
+        self.actions[self.next_index] = self.symmetries.actions[:, action]
+        self.rewards[self.next_index] = reward
+        self.terminals[self.next_index] = terminal
+        self.next_index = (self.next_index + 1) % self.limit
+        self.size = min(self.size + 1, self.limit)
+
+    def sample_batch(self, batch_size: int, batch_idxs: Optional[Any] = None) -> ExperienceBatch:
+        entries = self._sample_entries(batch_size) if batch_idxs is None else np.asarray(batch_idxs)
+        positions = self._positions(entries)
+        versions = np.random.randint(len(self.symmetries), size=len(entries))
+        rewards, next_entries, terminals = self._returns(entries)
+        return ExperienceBatch(self._observations(self.boards[positions, versions]),
+                               self.actions[positions, versions].astype(int), rewards,
+                               self._observations(self.boards[self._positions(next_entries), versions]), terminals)
+
+    def get_config(self) -> dict:
+        config = super().get_config()
+        config['symmetries'] = len(self.symmetries)
+        return config
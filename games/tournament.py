@@ -0,0 +1,189 @@
+"""
+Plays many games between an agent and an opponent at once in a vector env, and sums up how the agent did:
+its win, loss, draw and illegal move rates (with 95% confidence intervals), and its average score and game length,
+as keras-rl's agent.test reports them.
+
+Each match is seeded (the env's random moves, and the agent's and opponent's policies if given random states from
+match_random_states), so playing the same agents again gives the same games, and the seeds of a schedule of matches
+(seed_schedule) can be reused every round so that rounds are compared on the same footing.
+"""
+import math
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Type
+import numpy as np
+
+from games.connect4.vector_env import IN_PROGRESS, ILLEGAL, WON, WILL_LOSE, TIED  # The same in both games.
+from games.opponent import BatchedOpponent
+
+GetActions = Callable[[np.ndarray], np.ndarray]
+Z_95 = 1.96
+
+
+def wilson_interval(count: int, total: int, z: float = Z_95) -> Tuple[float, float]:
+    """
+    A confidence interval for a rate, seen count times out of total (95% by default).
+    Unlike the usual rate +- z * standard error, it stays within 0 - 1 and is sensible near them.
+
+    >>> tuple(round(bound, 3) for bound in wilson_interval(40, 100))
+    (0.309, 0.498)
+    >>> tuple(round(bound, 3) for bound in wilson_interval(0, 250))
+    (0.0, 0.015)
+    """
+    if total == 0:
+        return 0., 1.
+    rate = count / total
+    centre = (rate + z * z / (2 * total)) / (1 + z * z / total)
+    spread = z * math.sqrt(rate * (1 - rate) / total + z * z / (4 * total * total)) / (1 + z * z / total)
+    return max(0., centre - spread), min(1., centre + spread)
+
+
+def seed_schedule(seed: int, matches: int) -> List[int]:
+    """
+    A seed for each of a number of matches, drawn from one base seed.
+
+    >>> seed_schedule(0, 3) == seed_schedule(0, 3) != seed_schedule(1, 3)
+    True
+    """
+    return [int(state.generate_state(1)[0]) for state in np.random.SeedSequence(seed).spawn(matches)]
+
+
+def match_random_states(seed: int) -> Tuple[np.random.RandomState, np.random.RandomState]:
+    """
+    Random states for the agent's and the opponent's policies in the match with this seed.
+    """
+    agent_state, opponent_state = np.random.SeedSequence(seed).spawn(2)
+    return (np.random.RandomState(agent_state.generate_state(1)[0]),
+            np.random.RandomState(opponent_state.generate_state(1)[0]))
+
+
+class Results(NamedTuple):
+    games: int
+    wins: int
+    losses: int  # Ended by the opponent being about to win.
+    draws: int
+    illegal: int
+    scores: np.ndarray  # The agent's total reward in each game.
+    lengths: np.ndarray  # The agent's number of moves in each game.
+
+    def rate(self, count: int) -> Tuple[float, float, float]:
+        """
+        The rate of count in games, and its 95% confidence interval.
+        """
+        return (count / self.games,) + wilson_interval(count, self.games)
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        The rates and averages, as plain numbers (eg. to write as JSON).
+
+        >>> Results(4, 2, 1, 1, 0, np.array([1., 1., -2., .5]), np.array([3, 4, 5, 4])).metrics()['win_rate']
+        0.5
+        """
+        return {'games': self.games, 'win_rate': self.wins / self.games, 'loss_rate': self.losses / self.games,
+                'draw_rate': self.draws / self.games, 'illegal_rate': self.illegal / self.games,
+                'mean_score': float(self.scores.mean()), 'mean_length': float(self.lengths.mean())}
+
+    def __str__(self) -> str:
+        rates = ', '.join(f'{name} {rate:.1%} ({low:.1%} - {high:.1%})' for name, (rate, low, high) in (
+            ('won', self.rate(self.wins)), ('lost', self.rate(self.losses)),
+            ('drew', self.rate(self.draws)), ('illegal', self.rate(self.illegal))))
+        return f'  over {self.games} games, average score  {self.scores.mean()}, ' \
+               f'range {self.scores.min()} - {self.scores.max()}\n' \
+               f'  over {self.games} games, average length {self.lengths.mean()}, ' \
+               f'range {self.lengths.min()} - {self.lengths.max()}\n' \
+               f'  {rates}'
+
+
+def play_games(get_actions: GetActions, vector_env_class: Type[Any], games: int = 250,
+               opponent: Optional[GetActions] = None, num_envs: int = 250, seed: int = 0) -> Results:
+    """
+    Plays games between get_actions (which takes a batch of boards, and returns an action for each)
+    and the opponent (the same; random legal moves by default) in up to num_envs games at a time,
+    as the player of vector_env_class.
+
+    A new game is only started on a board while fewer than games have been started,
+    so the results don't favour the games that finish quickly.
+
+    >>> from games.nac.vector_env import VectorNacEnv
+    >>> first_free = lambda boards: np.argmax(boards == 0, axis=1)
+    >>> results = play_games(first_free, VectorNacEnv, games=100, num_envs=30)
+    >>> results.games, results.wins + results.losses + results.draws + results.illegal
+    (100, 100)
+    >>> str(results) == str(play_games(first_free, VectorNacEnv, games=100, num_envs=30))
+    True
+
+    Against itself, it always gets three in a row down the left first.
+    >>> print(play_games(first_free, VectorNacEnv, games=10, opponent=first_free))
+      over 10 games, average score  1.0, range 1.0 - 1.0
+      over 10 games, average length 4.0, range 4 - 4
+      won 100.0% (72.2% - 100.0%), lost 0.0% (0.0% - 27.8%), drew 0.0% (0.0% - 27.8%), illegal 0.0% (0.0% - 27.8%)
+    """
+    env = vector_env_class(num_envs=min(games, num_envs), get_opponent_actions=opponent, seed=seed)
+    boards = env.reset()
+    started = env.num_envs
+    playing = np.ones(env.num_envs, dtype=bool)
+    scores = np.zeros(env.num_envs)
+    lengths = np.zeros(env.num_envs, dtype=int)
+    outcomes: List[np.ndarray] = []
+    final_scores: List[np.ndarray] = []
+    final_lengths: List[np.ndarray] = []
+    while playing.any():
+        boards, rewards, dones, _ = env.step(get_actions(boards))
+        scores += rewards
+        lengths += 1
+        finished = dones & playing
+        outcomes.append(env.outcomes[finished])
+        final_scores.append(scores[finished])
+        final_lengths.append(lengths[finished])
+        scores[dones] = 0
+        lengths[dones] = 0
+        # The boards that finished go on to new games (which are ignored) once enough have been started.
+        finishing = np.flatnonzero(finished)
+        carrying_on = finishing[:max(0, games - started)]
+        started += len(carrying_on)
+        playing[finishing[len(carrying_on):]] = False
+
+    counts = np.bincount(np.concatenate(outcomes), minlength=TIED + 1)
+    assert counts[IN_PROGRESS] == 0
+    return Results(games=games, wins=int(counts[WON]), losses=int(counts[WILL_LOSE]), draws=int(counts[TIED]),
+                   illegal=int(counts[ILLEGAL]),
+                   scores=np.concatenate(final_scores), lengths=np.concatenate(final_lengths))
+
+
+def play_agents(agent: Any, vector_env_class: Type[Any], games: int = 250, opponent: Optional[Any] = None,
+                num_envs: int = 250, seed: int = 0, book: Optional[Any] = None) -> Results:
+    """
+    Plays games between a DQN agent (or anything with a processor, compute_batch_q_values and test_policy,
+    like NumpyQNetwork), picking its moves with its test policy as agent.test does
+    (only legal ones if agent.mask_illegal is set, as for MaskedDQNAgent; otherwise illegal or not),
+    and an opponent: another such agent (playing with its policy if opponent.training is set, masked to legal moves,
+    as it does as an env's opponent), or any object with act_batch (eg. AlphaBetaOpponent or PerfectPlayer),
+    or None for random legal moves.
+    The agent's and opponent's policies draw from random states seeded by seed
+    (a BatchedOpponent's too, whatever random state it was given).
+    Given a book of the agent's Q-values (see connect4/book.py), it looks its openings up there.
+
+    >>> from games.nac.vector_env import VectorNacEnv, legal_action_mask
+    >>> from games.numpy_network import NumpyQNetwork
+    >>> from games.policy import QPolicy
+    >>> first_free = np.zeros((27, 9))
+    >>> first_free[::3] = np.eye(9)  # Each square's Q-value is 1 while it's free.
+    >>> agent = NumpyQNetwork([(first_free, np.zeros(9))])
+    >>> opponent_network = NumpyQNetwork([(np.zeros((27, 9)), np.arange(9.))], policy=QPolicy(eps=.5))
+    >>> opponent_network.training = True
+    >>> opponent = BatchedOpponent(opponent_network, legal_action_mask)
+    >>> str(play_agents(agent, VectorNacEnv, 50, opponent)) == str(play_agents(agent, VectorNacEnv, 50, opponent))
+    True
+    """
+    agent_random_state, opponent_random_state = match_random_states(seed)
+    training, agent.training = agent.training, False
+    try:
+        get_actions = BatchedOpponent(agent, vector_env_class.legal_action_mask,
+                                      mask_illegal=getattr(agent, 'mask_illegal', False),
+                                      random_state=agent_random_state, book=book).act_batch
+        if isinstance(opponent, BatchedOpponent):
+            opponent = opponent.reseeded(opponent_random_state)
+        elif opponent is not None and not hasattr(opponent, 'act_batch'):
+            opponent = BatchedOpponent(opponent, vector_env_class.legal_action_mask, random_state=opponent_random_state)
+        return play_games(get_actions, vector_env_class, games, None if opponent is None else opponent.act_batch,
+                          num_envs, seed)
+    finally:
+        agent.training = training
@@ -0,0 +1,322 @@
+"""
+Trains agents for either game unattended, as the play scripts do but without asking anything or playing afterwards,
+with the hyperparameters taken from a JSON config file and/or flags.
+Each run writes its config, a line of metrics for each player each round, and the final weights
+to its own directory, and checkpoints as it goes (see checkpoint.py), so that running it again carries on from there.
+
+    python -m games.train --game connect4 --rounds 20 --output runs
+    python -m games.train --config sweep.json --sweep learning_rate=0.001,0.0003 --processes 4
+
+A config file holds any of TrainConfig's fields (the rest keep their defaults), and optionally a "sweep":
+a list of values for some of them, eg.
+
+    {"game": "nac", "rounds": 5, "sweep": {"layer_size": [27, 54], "learning_rate": [0.001, 0.0003]}}
+
+Flags override the file. Every combination of the swept values is run, each in its own directory
+(named after its values), up to --processes at a time, in separate processes.
+
+With --league N, each player trains against a league of the other player's last N versions (see league.py)
+rather than only its latest one, and each new version plays every one of the other player's to score it.
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+import tensorflow as tf
+from rl.callbacks import Callback
+
+from games.checkpoint import Checkpointer
+from games.connect4 import agent as connect4_agent
+from games.connect4.book import OpeningBook
+from games.connect4.env import Connect4Env, Connect4SecondPlayerEnv
+from games.connect4.search import AlphaBetaOpponent
+from games.connect4.vector_env import VectorConnect4Env, VectorConnect4SecondPlayerEnv
+from games.league import League, Snapshot, take_snapshot
+from games.nac import agent as nac_agent
+from games.nac.env import NacEnv, NacSecondPlayerEnv
+from games.nac.solver import evaluate
+from games.nac.vector_env import VectorNacEnv, VectorNacSecondPlayerEnv
+from games.rollout import ParallelRollouts
+
+ENVS = {'connect4': (Connect4Env, Connect4SecondPlayerEnv), 'nac': (NacEnv, NacSecondPlayerEnv)}
+VECTOR_ENVS = {'connect4': (VectorConnect4Env, VectorConnect4SecondPlayerEnv),
+               'nac': (VectorNacEnv, VectorNacSecondPlayerEnv)}
+AGENTS = {'connect4': connect4_agent, 'nac': nac_agent}
+LEAGUE_FILE = 'league.npz'
+
+
+class TrainConfig(NamedTuple):
+    game: str = 'connect4'  # 'connect4' or 'nac'
+    rounds: int = 10  # The first against random legal moves, the rest against the other player.
+    steps: int = 10000  # Training steps for each player each round.
+    layer_size: int = 0  # The hidden layer's size (0 for the game's usual size).
+    memory_limit: int = 50000
+    warmup: int = 100  # Steps at the start of each round before training starts.
+    target_model_update: float = 1e-2
+    learning_rate: float = 1e-3
+    augment: bool = True
+    mask_illegal: bool = True
+    perspective: bool = False
+    prioritized: bool = False  # Replay transitions by priority (see prioritized.py) rather than uniformly.
+    backend: str = 'keras'  # 'keras', or 'numpy' to train without TensorFlow (see numpy_dqn.py).
+    batch_size: int = 32  # Transitions in each batch trained on.
+    train_interval: int = 1  # Steps between training.
+    gradient_steps: int = 1  # Batches trained on each time, one after the other (only with the numpy backend).
+    n_step: int = 1  # Steps of rewards in each transition trained on, before its next state's Q-value.
+    test_episodes: int = 250  # Games played to test Connect 4 agents (noughts and crosses ones are tested exhaustively).
+    search_depth: int = 0  # Also test Connect 4 agents against alpha-beta search this deep, if not 0.
+    search_book: str = ''  # An opening book of the search's moves, at search_depth (see connect4/book.py), if any.
+    workers: int = 0  # Play training games and league matches in this many worker processes (0 for none).
+    league: int = 0  # Train against this many of the other player's past versions (0 for only its latest).
+    league_opponents: int = 4  # Split each round's training between this many opponents picked from the league.
+    league_games: int = 100  # Games played against each of the other player's versions to score a new one.
+    seed: int = 0
+    name: str = ''  # The run's directory (by default, the game or else the swept values).
+
+    def agent_kwargs(self) -> Dict[str, Any]:
+        """
+        get_dqn_agent's keyword arguments.
+        """
+        kwargs = {'augment': self.augment, 'mask_illegal': self.mask_illegal, 'perspective': self.perspective,
+                  'prioritized': self.prioritized, 'backend': self.backend,
+                  'batch_size': self.batch_size, 'train_interval': self.train_interval,
+                  'gradient_steps': self.gradient_steps, 'n_step': self.n_step,
+                  'memory_limit': self.memory_limit, 'nb_steps_warmup': self.warmup,
+                  'target_model_update': self.target_model_update, 'learning_rate': self.learning_rate}
+        if self.layer_size:
+            kwargs['layer_size'] = self.layer_size
+        return kwargs
+
+
+def _parse_bool(text: str) -> bool:
+    """
+    >>> _parse_bool('yes'), _parse_bool('False')
+    (True, False)
+    """
+    if text.lower() not in ('true', 'yes', '1', 'false', 'no', '0'):
+        raise argparse.ArgumentTypeError(f'expected true or false, not {text}')
+    return text.lower() in ('true', 'yes', '1')
+
+
+def _field_type(name: str) -> Any:
+    field_type = TrainConfig.__annotations__[name]
+    return _parse_bool if field_type is bool else field_type
+
+
+def parse_sweep(texts: List[str]) -> Dict[str, List[Any]]:
+    """
+    Parses NAME=VALUE,VALUE... flags.
+
+    >>> parse_sweep(['learning_rate=0.001,0.0003', 'augment=true,false'])
+    {'learning_rate': [0.001, 0.0003], 'augment': [True, False]}
+    """
+    sweep = {}
+    for text in texts:
+        name, _, values = text.partition('=')
+        if name not in TrainConfig._fields or not values:
+            raise ValueError(f'expected a config field, = and comma separated values, not {text}')
+        sweep[name] = [_field_type(name)(value) for value in values.split(',')]
+    return sweep
+
+
+def sweep_configs(base: TrainConfig, sweep: Dict[str, List[Any]]) -> List[TrainConfig]:
+    """
+    A config for every combination of the swept values, named after them (following base's name, if it has one).
+
+    >>> [config.name for config in sweep_configs(TrainConfig(), {'layer_size': [27, 54], 'seed': [0, 1]})]
+    ['layer_size=27,seed=0', 'layer_size=27,seed=1', 'layer_size=54,seed=0', 'layer_size=54,seed=1']
+    >>> [config.name for config in sweep_configs(TrainConfig(game='nac'), {})]
+    ['nac']
+    >>> [config.name for config in sweep_configs(TrainConfig(name='big'), {'layer_size': [200, 400]})]
+    ['big-layer_size=200', 'big-layer_size=400']
+    """
+    configs = []
+    for values in itertools.product(*sweep.values()):
+        changes = dict(zip(sweep, values))
+        swept = ','.join(f'{field}={value}' for field, value in changes.items())
+        configs.append(base._replace(**changes, name='-'.join(filter(None, (base.name, swept))) or base.game))
+    return configs
+
+
+class EpisodeStats(Callback):
+    """
+    Counts the episodes of a fit call, and their total reward.
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self.episodes = 0
+        self.total_reward = 0.
+
+    def on_episode_end(self, episode: int, logs: Optional[dict] = None) -> None:
+        self.episodes += 1
+        self.total_reward += float((logs or {}).get('episode_reward', 0.))
+
+
+def _test(config: TrainConfig, agent: Any, player: int, env: Any) -> Dict[str, Any]:
+    """
+    The agent's test results, as numbers: against the env's opponent (and alpha-beta search, if set) for Connect 4,
+    or against perfect play for noughts and crosses.
+    """
+    if config.game == 'nac':
+        return dict(evaluate(agent, player)._asdict())
+    metrics = {'opponent': connect4_agent.test(env, agent, config.test_episodes, config.seed, verbose=False).metrics()}
+    if config.search_depth:
+        book = OpeningBook(config.search_book) if config.search_book else None
+        search_env = ENVS['connect4'][player](get_opponent_action=AlphaBetaOpponent(config.search_depth, book=book))
+        metrics['search'] = connect4_agent.test(search_env, agent, config.test_episodes, config.seed,
+                                                verbose=False).metrics()
+    return metrics
+
+
+def _train(config: TrainConfig, agents: List[Any], i: int, player: int, rollouts: Optional[ParallelRollouts],
+           league: Optional[League]) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Trains the player (0 or 1) for round i, against the other player or else (given a league) opponents picked from
+    its past versions, and returns the env it trained in, and its training stats.
+    """
+    game = AGENTS[config.game]
+    env_class = ENVS[config.game][player]
+    stats = EpisodeStats()
+    kwargs: Dict[str, Any] = {'callbacks': [stats], 'rollouts': rollouts, 'verbose': 0}
+    start = time.perf_counter()
+    if i == 0:
+        env = env_class()
+        game.train_agent(env, agents[player], config.steps, **kwargs)
+    elif league is not None:
+        for steps in np.diff(np.linspace(0, config.steps, config.league_opponents + 1, dtype=int)):
+            env = game.train_against(agents[player], env_class, league.sample(player).network(), int(steps), **kwargs)
+    else:
+        env = game.train_against(agents[player], env_class, agents[1 - player], config.steps, **kwargs)
+    seconds = time.perf_counter() - start
+    return env, {'episodes': stats.episodes, 'seconds': seconds, 'steps_per_second': config.steps / seconds,
+                 'mean_episode_reward': stats.total_reward / stats.episodes if stats.episodes else None}
+
+
+def _league(config: TrainConfig, directory: str, resuming: bool) -> League:
+    """
+    The run's league: as it was saved (random state and all), if resuming, or else a new one.
+    """
+    path = os.path.join(directory, LEAGUE_FILE)
+    random_state = np.random.RandomState(config.seed)
+    if resuming and os.path.exists(path):
+        return League.load(path, random_state)
+    return League(config.league, random_state=random_state)
+
+
+def _join_league(config: TrainConfig, directory: str, league: League, snapshot: Snapshot,
+                 pool: Optional[Any]) -> Dict[str, float]:
+    """
+    Scores a player's new version against the other player's versions in the league, adds it, saves the league,
+    and returns the scores.
+    """
+    scores = league.evaluate(snapshot, VECTOR_ENVS[config.game][snapshot.seat], config.league_games, config.seed,
+                             pool)
+    league.add(snapshot)
+    league.save(os.path.join(directory, LEAGUE_FILE))
+    return scores
+
+
+def _start(config: TrainConfig, output: str) -> str:
+    """
+    Makes the run's directory and writes its config there, seeds the random generators, and returns the directory.
+    """
+    directory = os.path.join(output, config.name or config.game)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'config.json'), 'w', encoding='utf-8') as config_file:
+        json.dump(config._asdict(), config_file, indent=2)
+    np.random.seed(config.seed)
+    tf.random.set_seed(config.seed)
+    return directory
+
+
+def run(config: TrainConfig, output: str) -> str:
+    """
+    Trains a pair of agents as configured, in output/config.name, carrying on from its latest checkpoint if it has one,
+    and returns the directory.
+    """
+    directory = _start(config, output)
+    agents = [AGENTS[config.game].get_dqn_agent(env_class(), **config.agent_kwargs())
+              for env_class in ENVS[config.game]]
+    names = {'player 1': agents[0], 'player 2': agents[1]}
+    checkpointer = Checkpointer(os.path.join(directory, 'checkpoints'))
+    state = checkpointer.load(names) or {'round': 0, 'player': 0}
+    league = _league(config, directory, resuming=checkpointer.latest() is not None) if config.league else None
+    rollouts = ParallelRollouts(config.workers, seed=config.seed) if config.workers else None
+    if rollouts is not None and state.get('rollouts_round') is not None:
+        rollouts.round = state['rollouts_round']
+    try:
+        with open(os.path.join(directory, 'metrics.jsonl'), 'a', encoding='utf-8') as metrics_file:
+            for i in range(state['round'], config.rounds):
+                for player in (0, 1):
+                    if (i, player) < (state['round'], state['player']):
+                        continue
+                    env, training = _train(config, agents, i, player, rollouts, league)
+                    metrics = {'round': i + 1, 'player': player + 1, 'training': training}
+                    if league is not None:
+                        metrics['league'] = _join_league(
+                            config, directory, league,
+                            take_snapshot(agents[player], player, f'player {player + 1} round {i + 1}'),
+                            None if rollouts is None else rollouts.pool)
+                    checkpointer.save(names, {'round': i + player, 'player': 1 - player,
+                                              'rollouts_round': None if rollouts is None else rollouts.round})
+                    metrics['test'] = _test(config, agents[player], player, env)
+                    metrics_file.write(json.dumps(metrics) + '\n')
+                    metrics_file.flush()
+                    print(f'{directory}: round {i + 1} of {config.rounds}, player {player + 1}: {metrics["test"]}',
+                          flush=True)
+        AGENTS[config.game].save_agents(os.path.join(directory, 'weights'), *agents)
+    finally:
+        checkpointer.wait()
+        if rollouts is not None:
+            rollouts.close()
+    return directory
+
+
+def _run_job(job: Tuple[TrainConfig, str]) -> str:
+    return run(*job)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Train agents unattended, from a config file and/or flags.')
+    parser.add_argument('--config', help='a JSON file of config fields, and optionally a "sweep" of values for some')
+    parser.add_argument('--output', default='runs', help='the directory to write each run\'s directory in')
+    parser.add_argument('--sweep', nargs='+', default=[], metavar='NAME=VALUES',
+                        help='run with each of these comma separated values of the field (as well as those swept '
+                             'in the config file)')
+    parser.add_argument('--processes', type=int, default=1, help='run up to this many configs at once')
+    for field, default in TrainConfig()._asdict().items():
+        parser.add_argument(f'--{field.replace("_", "-")}', type=_field_type(field), dest=field,
+                            choices=sorted(ENVS) if field == 'game' else None, help=f'(default {default!r})')
+    args = parser.parse_args(argv)
+
+    fields: Dict[str, Any] = {}
+    sweep: Dict[str, List[Any]] = {}
+    if args.config:
+        with open(args.config, encoding='utf-8') as config_file:
+            fields = json.load(config_file)
+        sweep = fields.pop('sweep', {})
+    fields.update({field: getattr(args, field) for field in TrainConfig._fields if getattr(args, field) is not None})
+    sweep.update(parse_sweep(args.sweep))
+    configs = sweep_configs(TrainConfig(**fields), sweep)
+    if args.processes > 1 and len(configs) > 1:
+        # Spawned rather than forked, so that each loads TensorFlow afresh, and not daemonic (as a Pool's processes
+        # are), so that runs with workers can start their own.
+        with concurrent.futures.ProcessPoolExecutor(min(args.processes, len(configs)),
+                                                    mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(_run_job, (config, args.output)) for config in configs]
+            for future in concurrent.futures.as_completed(futures):
+                print(f'Finished {future.result()}', flush=True)
+    else:
+        for config in configs:
+            print(f'Finished {run(config, args.output)}', flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())